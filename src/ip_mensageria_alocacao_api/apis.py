@@ -1,55 +1,119 @@
 from __future__ import annotations
 
 import logging
+from concurrent.futures import Future
 from http import HTTPStatus
-from typing import Sequence
+from typing import Optional, Sequence, TypeVar
 
 import numpy as np
 from fastapi import HTTPException
 
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.atributos import EntradaAtributos
 from ip_mensageria_alocacao_api.core.auxiliar import (
-    converter_df_em_pool,
+    avaliar_ensemble,
+    converter_matriz_em_pool,
+    montar_matriz_atributos,
     obter_caracteristicas_usuario,
+    obter_caracteristicas_usuarios,
     obter_midia_embedding,
     obter_template_embedding_por_nome,
     obter_template_embedding_por_texto,
+    obter_template_embeddings_por_textos,
     obter_tempo_desde_ultimo_procedimento,
-    preparar_atributos_para_predicao,
-    thompson_sample,
+    obter_tempos_desde_ultimo_procedimento,
+    thompson_sample_vetorizado,
+)
+from ip_mensageria_alocacao_api.core.executores import (
+    aguardar,
+    concluido,
+    submeter_consulta,
 )
 from ip_mensageria_alocacao_api.core.modelos import (
+    CidadaoCaracteristicas,
     Classificador,
     LinhaCuidado,
     Mensagem,
     MensagemTipo,
     Predicao,
+    PredicaoLote,
     PredicaoSimulacao,
 )
 
 logger = logging.getLogger(__name__)
 
+R = TypeVar("R")
 
-def prever_probabilidade_mensagem_ser_efetiva(
+# Cidadão sem nenhuma característica conhecida: na predição degradada, todos
+# os atributos do cidadão recebem os valores de imputação do treino.
+_CARACTERISTICAS_DESCONHECIDAS = CidadaoCaracteristicas(
+    idade=None,
+    plano_saude_privado=None,
+    raca_cor=None,
+    sexo=None,
+    tempo_desde_ultimo_procedimento=None,
+    municipio_prop_domicilios_zona_rural=None,
+)
+
+_CIDADAO_NAO_ENCONTRADO = "Not Found :: Cidadão não encontrado."
+
+
+def _aguardar_ou_padrao(
+    futuro: Future[R],
+    prazo: Optional[float],
+    padrao: R,
+    descricao: str,
+) -> tuple[R, bool]:
+    """
+    Resultado de `futuro` e `False`, ou `padrao` e `True` se o prazo vencer
+    antes (predição degradada).
+    """
+    try:
+        return aguardar(futuro, prazo), False
+    except TimeoutError:
+        logger.warning(f"Prazo esgotado ao obter {descricao}; usando valores padrão")
+        return padrao, True
+
+
+def _aguardar_embedding(
+    futuro: Future[np.ndarray], prazo: Optional[float]
+) -> np.ndarray:
+    # sem o embedding da mensagem não há predição, nem degradada
+    try:
+        return aguardar(futuro, prazo)
+    except TimeoutError as exc:
+        raise HTTPException(
+            status_code=HTTPStatus.GATEWAY_TIMEOUT,
+            detail="Gateway Timeout :: Prazo esgotado ao obter embeddings da mensagem.",
+        ) from exc
+
+
+def _submeter_dados_cidadao(
     cidadao_id: str,
     linha_cuidado: LinhaCuidado,
-    mensagem_tipo: MensagemTipo,
+) -> tuple[Future[CidadaoCaracteristicas], Future[Optional[int]]]:
+    return (
+        submeter_consulta(obter_caracteristicas_usuario, cidadao_id),
+        submeter_consulta(
+            obter_tempo_desde_ultimo_procedimento,
+            cidadao_id=cidadao_id,
+            linha_cuidado=linha_cuidado,
+        ),
+    )
+
+
+def _submeter_embeddings(
     mensagem: Mensagem,
     classificadores: Classificador,
-) -> Predicao:
-    logger.info(f"Iniciando predição para cidadão {cidadao_id}")
-    cidadao_caracteristicas = obter_caracteristicas_usuario(cidadao_id)
-    logger.info("Características do cidadão obtidas")
-    tempo_desde_ultimo_procedimento = obter_tempo_desde_ultimo_procedimento(
-        cidadao_id=cidadao_id,
-        linha_cuidado=linha_cuidado,
-    )
-    logger.info("Tempo desde último procedimento obtido")
+) -> tuple[Future[np.ndarray], Future[np.ndarray]]:
     if mensagem.template_nome:
-        template_embedding = obter_template_embedding_por_nome(
+        template_embedding = submeter_consulta(
+            obter_template_embedding_por_nome,
             mensagem.template_nome,
         )
     elif mensagem.template:
-        template_embedding = obter_template_embedding_por_texto(
+        template_embedding = submeter_consulta(
+            obter_template_embedding_por_texto,
             mensagem.template.texto,
             mensagem.template.botao0_texto,
             mensagem.template.botao1_texto,
@@ -60,17 +124,106 @@ def prever_probabilidade_mensagem_ser_efetiva(
             status_code=HTTPStatus.BAD_REQUEST,
             detail=("Bad Request :: `template_nome` ou `template` não informado."),
         )
-    logger.info("Template embedding obtido")
     if mensagem.midia_url:
-        midia_embedding = obter_midia_embedding(mensagem.midia_url)
+        midia_embedding = submeter_consulta(obter_midia_embedding, mensagem.midia_url)
     else:
-        midia_embedding = np.zeros(
-            classificadores.midia_embedding_dims,
-            dtype=float,
+        midia_embedding = concluido(
+            np.zeros(classificadores.midia_embedding_dims, dtype=float)
         )
+    return template_embedding, midia_embedding
+
+
+def _prever_com_ensemble(
+    entradas: Sequence[EntradaAtributos],
+    classificadores: Classificador,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Monta uma única matriz com as `entradas`, avalia cada modelo do ensemble
+    bootstrap uma só vez sobre ela e devolve média e desvio entre modelos por
+    linha. Acima de PREDICAO_LINHAS_POR_MATRIZ linhas, a matriz é montada e
+    avaliada em partes.
+    """
+    tamanho = max(1, configs.PREDICAO_LINHAS_POR_MATRIZ)
+    partes = []
+    for inicio in range(0, len(entradas), tamanho):
+        matriz = montar_matriz_atributos(
+            classificadores, entradas[inicio : inicio + tamanho]
+        )
+        pool = converter_matriz_em_pool(matriz, classificadores)
+        partes.append(avaliar_ensemble(pool, classificadores))
+    # modelos x linhas
+    ps = np.concatenate(partes, axis=1)
+    p_mean = ps.mean(axis=0)
+    if len(ps) > 1:
+        p_std = ps.std(axis=0, ddof=1)
+    else:
+        p_std = np.zeros_like(p_mean)
+    return p_mean, p_std
+
+
+def _antecipar_templates_por_texto(mensagens: Sequence[Mensagem]) -> None:
+    """
+    Busca de uma vez os embeddings dos templates informados por texto, para
+    que textos inéditos sejam gerados em uma única chamada. Em caso de falha,
+    cada mensagem segue pelo caminho unitário e reporta o próprio erro.
+    """
+    templates = [m.template for m in mensagens if not m.template_nome and m.template]
+    if len(templates) < 2:
+        return
+    try:
+        obter_template_embeddings_por_textos(templates)
+    except HTTPException as exc:
+        logger.warning(f"Falha ao obter embeddings de templates em lote: {exc!r}")
+
+
+def _descrever_erro(exc: Exception) -> str:
+    if isinstance(exc, HTTPException):
+        detail = exc.detail
+        if isinstance(detail, (list, tuple)):
+            detail = "".join(str(d) for d in detail)
+        return str(detail)
+    if isinstance(exc, AssertionError):
+        return _CIDADAO_NAO_ENCONTRADO
+    return str(exc)
+
+
+def prever_probabilidade_mensagem_ser_efetiva(
+    cidadao_id: str,
+    linha_cuidado: LinhaCuidado,
+    mensagem_tipo: MensagemTipo,
+    mensagem: Mensagem,
+    classificadores: Classificador,
+    prazo: Optional[float] = None,
+) -> Predicao:
+    """
+    Prevê a efetividade de uma mensagem para um cidadão. Se as consultas do
+    cidadão não terminarem até `prazo` (ver `executores.calcular_prazo`),
+    prevê com os valores de imputação e marca a predição como degradada.
+    """
+    logger.info(f"Iniciando predição para cidadão {cidadao_id}")
+    # as consultas independentes são disparadas juntas; as que já estão em
+    # cache não ocupam o pool
+    futuro_caracteristicas, futuro_tempo = _submeter_dados_cidadao(
+        cidadao_id,
+        linha_cuidado,
+    )
+    futuro_template, futuro_midia = _submeter_embeddings(mensagem, classificadores)
+    cidadao_caracteristicas, degradada = _aguardar_ou_padrao(
+        futuro_caracteristicas,
+        prazo,
+        _CARACTERISTICAS_DESCONHECIDAS,
+        "características do cidadão",
+    )
+    logger.info("Características do cidadão obtidas")
+    tempo_desde_ultimo_procedimento, tempo_degradado = _aguardar_ou_padrao(
+        futuro_tempo, prazo, None, "tempo desde o último procedimento"
+    )
+    logger.info("Tempo desde último procedimento obtido")
+    template_embedding = _aguardar_embedding(futuro_template, prazo)
+    logger.info("Template embedding obtido")
+    midia_embedding = _aguardar_embedding(futuro_midia, prazo)
     logger.info("Mídia embedding obtido")
-    atributos = preparar_atributos_para_predicao(
-        classificadores=classificadores,
+    entrada = EntradaAtributos(
         cidadao_caracteristicas=cidadao_caracteristicas,
         linha_cuidado=linha_cuidado,
         tempo_desde_ultimo_procedimento=tempo_desde_ultimo_procedimento,
@@ -80,19 +233,253 @@ def prever_probabilidade_mensagem_ser_efetiva(
         mensagem_template_embedding=template_embedding,
         mensagem_midia_embedding=midia_embedding,
     )
-    pool = converter_df_em_pool(atributos, classificadores)
 
     # ensemble bootstrap -> média e desvio entre modelos
-    ps = np.array([float(m.predict_proba(pool)[0, 1]) for m in classificadores.modelos])
-    p_mean = float(ps.mean())
-    p_std = float(ps.std(ddof=1)) if len(ps) > 1 else 0.0
+    ps_mean, ps_std = _prever_com_ensemble([entrada], classificadores)
+    p_mean = float(ps_mean[0])
+    p_std = float(ps_std[0])
 
     logger.info(f"Predição concluída: prob={p_mean}, std={p_std}")
     return Predicao(
         mensagem=mensagem,
         probabilidade=p_mean,
         erro_padrao=p_std,
+        degradada=degradada or tempo_degradado,
+    )
+
+
+def prever_probabilidades_mensagens_em_lote(
+    cidadaos_ids: Sequence[str],
+    linha_cuidado: LinhaCuidado,
+    mensagem_tipo: MensagemTipo,
+    mensagens: Sequence[Mensagem],
+    classificadores: Classificador,
+    prazo: Optional[float] = None,
+) -> list[PredicaoLote]:
+    """
+    Prevê a efetividade de cada mensagem para cada cidadão (produto
+    cartesiano) com o ensemble avaliado sobre uma matriz de atributos por
+    parte do lote (ver `_prever_com_ensemble`). Falhas de um cidadão ou de uma mensagem
+    são reportadas na linha correspondente, sem interromper o lote. Os dados
+    dos cidadãos são buscados em partes de até CARREGADOR_MAX_LOTE; as partes
+    que não chegarem até `prazo` têm as linhas marcadas como degradadas.
+    """
+    logger.info(
+        f"Iniciando predição em lote: {len(cidadaos_ids)} cidadãos x "
+        f"{len(mensagens)} mensagens"
+    )
+    ids_unicos = list(dict.fromkeys(cidadaos_ids))
+    # um job por parte de até CARREGADOR_MAX_LOTE cidadãos, para as
+    # características e para o tempo desde o último procedimento
+    tamanho = max(1, configs.CARREGADOR_MAX_LOTE)
+    futuros_cidadaos = [
+        (
+            parte,
+            submeter_consulta(obter_caracteristicas_usuarios, parte),
+            submeter_consulta(
+                obter_tempos_desde_ultimo_procedimento, parte, linha_cuidado
+            ),
+        )
+        for parte in (
+            ids_unicos[inicio : inicio + tamanho]
+            for inicio in range(0, len(ids_unicos), tamanho)
+        )
+    ]
+    _antecipar_templates_por_texto(mensagens)
+    futuros_mensagens: list[tuple[Future[np.ndarray], Future[np.ndarray]] | None] = []
+    erros_mensagens: list[Optional[str]] = []
+    for mensagem in mensagens:
+        try:
+            futuros_mensagens.append(_submeter_embeddings(mensagem, classificadores))
+            erros_mensagens.append(None)
+        except HTTPException as exc:
+            futuros_mensagens.append(None)
+            erros_mensagens.append(_descrever_erro(exc))
+
+    cidadaos: dict[str, tuple[CidadaoCaracteristicas, Optional[int]]] = {}
+    erros_cidadaos: dict[str, str] = {}
+    degradados: set[str] = set()
+    for parte, futuro_caracteristicas, futuro_tempos in futuros_cidadaos:
+        try:
+            tempos, tempos_degradados = _aguardar_ou_padrao(
+                futuro_tempos, prazo, {}, "tempos desde o último procedimento"
+            )
+            caracteristicas, degradado = _aguardar_ou_padrao(
+                futuro_caracteristicas,
+                prazo,
+                dict.fromkeys(parte, _CARACTERISTICAS_DESCONHECIDAS),
+                f"características de {len(parte)} cidadãos",
+            )
+        except (HTTPException, AssertionError, ValueError) as exc:
+            logger.warning(f"Falha ao obter dados de {len(parte)} cidadãos: {exc!r}")
+            erros_cidadaos.update(dict.fromkeys(parte, _descrever_erro(exc)))
+            continue
+        if tempos_degradados or degradado:
+            degradados.update(parte)
+        for cidadao_id in parte:
+            if cidadao_id not in caracteristicas:
+                erros_cidadaos[cidadao_id] = _CIDADAO_NAO_ENCONTRADO
+                continue
+            cidadaos[cidadao_id] = (
+                caracteristicas[cidadao_id],
+                tempos.get(cidadao_id),
+            )
+
+    embeddings: list[Optional[tuple[np.ndarray, np.ndarray]]] = []
+    for i, futuros in enumerate(futuros_mensagens):
+        if futuros is None:
+            embeddings.append(None)
+            continue
+        try:
+            embeddings.append(
+                (
+                    _aguardar_embedding(futuros[0], prazo),
+                    _aguardar_embedding(futuros[1], prazo),
+                )
+            )
+        except (HTTPException, ValueError) as exc:
+            logger.warning(f"Falha ao obter embeddings da mensagem: {exc!r}")
+            embeddings.append(None)
+            erros_mensagens[i] = _descrever_erro(exc)
+
+    resultados: list[PredicaoLote] = []
+    linhas_validas: list[int] = []
+    entradas: list[EntradaAtributos] = []
+    for cidadao_id in cidadaos_ids:
+        for mensagem, embedding, erro_mensagem in zip(
+            mensagens, embeddings, erros_mensagens
+        ):
+            erro = erros_cidadaos.get(cidadao_id) or erro_mensagem
+            resultados.append(
+                PredicaoLote(
+                    cidadao_id=cidadao_id,
+                    mensagem=mensagem,
+                    erro=erro,
+                    degradada=cidadao_id in degradados,
+                )
+            )
+            if erro is not None or embedding is None:
+                continue
+            cidadao_caracteristicas, tempo_desde_ultimo_procedimento = cidadaos[
+                cidadao_id
+            ]
+            entradas.append(
+                EntradaAtributos(
+                    cidadao_caracteristicas=cidadao_caracteristicas,
+                    linha_cuidado=linha_cuidado,
+                    tempo_desde_ultimo_procedimento=tempo_desde_ultimo_procedimento,
+                    mensagem_tipo=mensagem_tipo,
+                    mensagem_dia_semana=mensagem.dia_semana,
+                    mensagem_horario=mensagem.horario,
+                    mensagem_template_embedding=embedding[0],
+                    mensagem_midia_embedding=embedding[1],
+                )
+            )
+            linhas_validas.append(len(resultados) - 1)
+
+    if entradas:
+        ps_mean, ps_std = _prever_com_ensemble(entradas, classificadores)
+        for i, p_mean, p_std in zip(linhas_validas, ps_mean, ps_std):
+            resultados[i].probabilidade = float(p_mean)
+            resultados[i].erro_padrao = float(p_std)
+
+    logger.info(
+        f"Predição em lote concluída: {len(linhas_validas)} de "
+        f"{len(resultados)} linhas avaliadas"
     )
+    return resultados
+
+
+def _deduplicar_mensagens(mensagens: Sequence[Mensagem]) -> list[Mensagem]:
+    unicas: dict[str, Mensagem] = {}
+    for mensagem in mensagens:
+        unicas.setdefault(mensagem.model_dump_json(), mensagem)
+    return list(unicas.values())
+
+
+def prever_e_alocar_entre_mensagens(
+    cidadao_id: str,
+    linha_cuidado: LinhaCuidado,
+    mensagem_tipo: MensagemTipo,
+    mensagens: Sequence[Mensagem],
+    classificadores: Classificador,
+    prazo: Optional[float] = None,
+) -> PredicaoSimulacao:
+    """
+    Prevê a efetividade de todas as mensagens candidatas de um cidadão em
+    uma única matriz e aloca entre elas com Thompson Sampling. Mensagens
+    idênticas são avaliadas uma só vez; mensagens cujos embeddings não
+    puderem ser obtidos até `prazo` são descartadas da alocação.
+    """
+    assert len(mensagens) > 0, "Lista vazia"
+    logger.info(f"Iniciando predição e alocação para cidadão {cidadao_id}")
+    futuro_caracteristicas, futuro_tempo = _submeter_dados_cidadao(
+        cidadao_id,
+        linha_cuidado,
+    )
+    futuros_mensagens: list[
+        tuple[Mensagem, Future[np.ndarray], Future[np.ndarray]]
+    ] = []
+    ultimo_erro: Optional[HTTPException] = None
+    mensagens = _deduplicar_mensagens(mensagens)
+    _antecipar_templates_por_texto(mensagens)
+    for mensagem in mensagens:
+        try:
+            futuros_mensagens.append(
+                (mensagem, *_submeter_embeddings(mensagem, classificadores))
+            )
+        except HTTPException as exc:
+            logger.warning(f"Mensagem descartada da alocação: {exc.detail}")
+            ultimo_erro = exc
+    cidadao_caracteristicas, degradada = _aguardar_ou_padrao(
+        futuro_caracteristicas,
+        prazo,
+        _CARACTERISTICAS_DESCONHECIDAS,
+        "características do cidadão",
+    )
+    tempo_desde_ultimo_procedimento, tempo_degradado = _aguardar_ou_padrao(
+        futuro_tempo, prazo, None, "tempo desde o último procedimento"
+    )
+
+    candidatas: list[Mensagem] = []
+    entradas: list[EntradaAtributos] = []
+    for mensagem, futuro_template, futuro_midia in futuros_mensagens:
+        try:
+            template_embedding = _aguardar_embedding(futuro_template, prazo)
+            midia_embedding = _aguardar_embedding(futuro_midia, prazo)
+        except HTTPException as exc:
+            logger.warning(f"Mensagem descartada da alocação: {exc.detail}")
+            ultimo_erro = exc
+            continue
+        candidatas.append(mensagem)
+        entradas.append(
+            EntradaAtributos(
+                cidadao_caracteristicas=cidadao_caracteristicas,
+                linha_cuidado=linha_cuidado,
+                tempo_desde_ultimo_procedimento=tempo_desde_ultimo_procedimento,
+                mensagem_tipo=mensagem_tipo,
+                mensagem_dia_semana=mensagem.dia_semana,
+                mensagem_horario=mensagem.horario,
+                mensagem_template_embedding=template_embedding,
+                mensagem_midia_embedding=midia_embedding,
+            )
+        )
+    if not candidatas:
+        assert ultimo_erro is not None
+        raise ultimo_erro
+
+    ps_mean, ps_std = _prever_com_ensemble(entradas, classificadores)
+    predicoes = [
+        Predicao(
+            mensagem=mensagem,
+            probabilidade=float(p_mean),
+            erro_padrao=float(p_std),
+            degradada=degradada or tempo_degradado,
+        )
+        for mensagem, p_mean, p_std in zip(candidatas, ps_mean, ps_std)
+    ]
+    logger.info(f"Predição concluída para {len(predicoes)} mensagens candidatas")
+    return alocar_entre_mensagens(predicoes)
 
 
 def alocar_entre_mensagens(predicoes: Sequence[Predicao]) -> PredicaoSimulacao:
@@ -101,16 +488,40 @@ def alocar_entre_mensagens(predicoes: Sequence[Predicao]) -> PredicaoSimulacao:
     (probabilidade) e erro-padrão (desvio entre modelos) para aproximar um
     Beta(α,β) e amostrar uma 'probabilidade sorteada'.
     """
-    assert len(predicoes) > 0, "Lista vazia"
+    return alocar_entre_mensagens_em_lote([predicoes])[0]
 
-    amostras = []
-    for pr in predicoes:
-        p = float(pr.probabilidade)
-        se = max(float(pr.erro_padrao), 1e-6)
-        amostras.append(thompson_sample(p, se))
 
-    idx = int(np.argmax(amostras))
-    return PredicaoSimulacao(
-        mensagem=predicoes[idx].mensagem,
-        probabilidade_sorteada=float(amostras[idx]),
-    )
+def alocar_entre_mensagens_em_lote(
+    problemas: Sequence[Sequence[Predicao]],
+) -> list[PredicaoSimulacao]:
+    """
+    Resolve vários problemas de alocação independentes (um por cidadão) com
+    uma única amostragem vetorizada: todas as opções de todos os problemas
+    são convertidas em Beta(α,β) e sorteadas de uma vez, e o vencedor de cada
+    problema é escolhido por argmax na sua linha.
+    """
+    tamanhos = np.array([len(predicoes) for predicoes in problemas], dtype=int)
+    assert len(tamanhos) > 0, "Lista vazia"
+    assert tamanhos.min() > 0, "Lista vazia"
+
+    opcoes = [pr for predicoes in problemas for pr in predicoes]
+    p = np.array([pr.probabilidade for pr in opcoes], dtype=float)
+    se = np.maximum(np.array([pr.erro_padrao for pr in opcoes], dtype=float), 1e-6)
+    amostras = thompson_sample_vetorizado(p, se)
+
+    # matriz (problemas x maior número de opções), completada com -inf
+    inicios = np.concatenate(([0], np.cumsum(tamanhos)[:-1]))
+    linhas: np.ndarray = np.repeat(np.arange(len(tamanhos)), tamanhos)
+    colunas = np.arange(len(opcoes)) - np.repeat(inicios, tamanhos)
+    matriz = np.full((len(tamanhos), int(tamanhos.max())), -np.inf)
+    matriz[linhas, colunas] = amostras
+    vencedores = inicios + matriz.argmax(axis=1)
+
+    return [
+        PredicaoSimulacao(
+            mensagem=opcoes[idx].mensagem,
+            probabilidade_sorteada=float(amostras[idx]),
+            degradada=opcoes[idx].degradada,
+        )
+        for idx in vencedores
+    ]
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TarefaPeriodica:
+    """
+    Executa `funcao` em uma thread de fundo a cada `intervalo_segundos`.
+    Falhas são registradas no log e não interrompem as execuções seguintes.
+    """
+
+    def __init__(
+        self,
+        nome: str,
+        intervalo_segundos: float,
+        funcao: Callable[[], None],
+        executar_imediatamente: bool = False,
+    ) -> None:
+        self.nome = nome
+        self.intervalo_segundos = intervalo_segundos
+        self._funcao = funcao
+        self._executar_imediatamente = executar_imediatamente
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def iniciar(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._laco, name=self.nome, daemon=True)
+        self._thread.start()
+
+    def parar(self, timeout: Optional[float] = None) -> None:
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _laco(self) -> None:
+        if not self._executar_imediatamente and self._parar.wait(
+            self.intervalo_segundos
+        ):
+            return
+        while not self._parar.is_set():
+            try:
+                self._funcao()
+            except Exception:
+                logger.exception(f"Falha na tarefa periódica {self.nome}")
+            if self._parar.wait(self.intervalo_segundos):
+                return
@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from datetime import UTC, date, datetime
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.agendador import TarefaPeriodica
+from ip_mensageria_alocacao_api.core.bd import consultar
+from ip_mensageria_alocacao_api.core.censo_municipios import (
+    CensoMunicipios,
+    obter_censo_municipios,
+)
+from ip_mensageria_alocacao_api.core.modelos import CidadaoCaracteristicas, CidadaoDados
+
+logger = logging.getLogger(__name__)
+
+# datas são guardadas como dias desde 1970-01-01; nulos com um sentinela
+_EPOCA = date(1970, 1, 1).toordinal()
+_DATA_NULA = np.iinfo(np.int32).min
+
+_QUERY_EXPORTACAO = """
+    SELECT
+        c.id AS cidadao_id,
+        SAFE_CAST(c.cidadao_dt_nascimento AS DATE) AS data_nascimento,
+        c.cidadao_sexo AS sexo,
+        c.cidadao_raca_cor AS raca_cor,
+        c.cidadao_plano_saude_privado AS plano_saude_privado,
+        c.municipio_id_sus
+    FROM `ip_mensageria_camada_ouro.cidadao` c
+"""
+
+
+def _data_para_dias(valor: Optional[date]) -> int:
+    return _DATA_NULA if valor is None else valor.toordinal() - _EPOCA
+
+
+def _codificar(valores: list[Optional[str]]) -> tuple[np.ndarray, np.ndarray]:
+    categorias = sorted({v for v in valores if v is not None})
+    indice = {c: i for i, c in enumerate(categorias)}
+    codigos = np.array(
+        [indice[v] if v is not None else -1 for v in valores],
+        dtype=np.int16,
+    )
+    return np.array(categorias, dtype=str), codigos
+
+
+def hoje_utc() -> date:
+    # CURRENT_DATE() do BigQuery usa UTC
+    return datetime.now(tz=UTC).date()
+
+
+class ArmazemCidadaos:
+    """
+    Cópia colunar das características dos cidadãos, com índice em memória de
+    `cidadao_id` para a linha correspondente. Categorias são guardadas como
+    códigos inteiros e datas como dias desde 1970-01-01.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        data_nascimento: np.ndarray,
+        sexo_categorias: np.ndarray,
+        sexo: np.ndarray,
+        raca_cor_categorias: np.ndarray,
+        raca_cor: np.ndarray,
+        plano_saude_privado: np.ndarray,
+        prop_domicilios_zona_rural: np.ndarray,
+    ) -> None:
+        self.ids = ids
+        self.data_nascimento = data_nascimento
+        self.sexo_categorias = sexo_categorias
+        self.sexo = sexo
+        self.raca_cor_categorias = raca_cor_categorias
+        self.raca_cor = raca_cor
+        self.plano_saude_privado = plano_saude_privado
+        self.prop_domicilios_zona_rural = prop_domicilios_zona_rural
+        self._indice = {str(cidadao_id): i for i, cidadao_id in enumerate(ids)}
+        # mtime do snapshot em disco de onde veio (0.0 se não veio do disco)
+        self.modificado_em = 0.0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, cidadao_id: object) -> bool:
+        return cidadao_id in self._indice
+
+    @classmethod
+    def de_linhas(
+        cls, linhas: Iterable[Any], censo: CensoMunicipios
+    ) -> ArmazemCidadaos:
+        ids: list[str] = []
+        nascimentos: list[int] = []
+        sexos: list[Optional[str]] = []
+        racas_cores: list[Optional[str]] = []
+        planos: list[int] = []
+        municipios: list[Any] = []
+        for linha in linhas:
+            ids.append(str(linha.cidadao_id))
+            nascimentos.append(_data_para_dias(linha.data_nascimento))
+            sexos.append(linha.sexo)
+            racas_cores.append(linha.raca_cor)
+            planos.append(
+                -1
+                if linha.plano_saude_privado is None
+                else int(linha.plano_saude_privado)
+            )
+            municipios.append(linha.municipio_id_sus)
+        sexo_categorias, sexo = _codificar(sexos)
+        raca_cor_categorias, raca_cor = _codificar(racas_cores)
+        return cls(
+            ids=np.array(ids, dtype=str),
+            data_nascimento=np.array(nascimentos, dtype=np.int32),
+            sexo_categorias=sexo_categorias,
+            sexo=sexo,
+            raca_cor_categorias=raca_cor_categorias,
+            raca_cor=raca_cor,
+            plano_saude_privado=np.array(planos, dtype=np.int8),
+            prop_domicilios_zona_rural=censo.proporcoes(municipios),
+        )
+
+    @classmethod
+    def exportar_do_bigquery(cls) -> ArmazemCidadaos:
+        inicio = time.monotonic()
+        linhas = consultar(
+            _QUERY_EXPORTACAO,
+            nome="exportacao_cidadaos",
+            page_size=100_000,
+            timeout=None,
+        )
+        armazem = cls.de_linhas(linhas, obter_censo_municipios())
+        logger.info(
+            f"Armazém de cidadãos exportado: {len(armazem)} cidadãos em "
+            f"{time.monotonic() - inicio:.1f}s"
+        )
+        return armazem
+
+    @classmethod
+    def carregar(cls, caminho: str | Path) -> ArmazemCidadaos:
+        with np.load(caminho, allow_pickle=False) as arquivo:
+            armazem = cls(**{nome: arquivo[nome] for nome in arquivo.files})
+        armazem.modificado_em = Path(caminho).stat().st_mtime
+        return armazem
+
+    def salvar(self, caminho: str | Path) -> None:
+        caminho = Path(caminho)
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        temporario = caminho.with_name(f"{caminho.name}.{os.getpid()}.tmp.npz")
+        np.savez(
+            temporario,
+            ids=self.ids,
+            data_nascimento=self.data_nascimento,
+            sexo_categorias=self.sexo_categorias,
+            sexo=self.sexo,
+            raca_cor_categorias=self.raca_cor_categorias,
+            raca_cor=self.raca_cor,
+            plano_saude_privado=self.plano_saude_privado,
+            prop_domicilios_zona_rural=self.prop_domicilios_zona_rural,
+        )
+        # troca atômica: leitores nunca veem um arquivo pela metade
+        os.replace(temporario, caminho)
+
+    def obter_dados(self, cidadao_id: str) -> Optional[CidadaoDados]:
+        i = self._indice.get(cidadao_id)
+        if i is None:
+            return None
+        nascimento = None
+        if self.data_nascimento[i] != _DATA_NULA:
+            nascimento = date.fromordinal(int(self.data_nascimento[i]) + _EPOCA)
+        prop = float(self.prop_domicilios_zona_rural[i])
+        return CidadaoDados(
+            data_nascimento=nascimento,
+            plano_saude_privado=None
+            if self.plano_saude_privado[i] < 0
+            else bool(self.plano_saude_privado[i]),
+            raca_cor=None
+            if self.raca_cor[i] < 0
+            else str(self.raca_cor_categorias[self.raca_cor[i]]),
+            sexo=None if self.sexo[i] < 0 else str(self.sexo_categorias[self.sexo[i]]),
+            municipio_prop_domicilios_zona_rural=None if np.isnan(prop) else prop,
+        )
+
+    def obter(
+        self,
+        cidadao_id: str,
+        hoje: Optional[date] = None,
+    ) -> Optional[CidadaoCaracteristicas]:
+        dados = self.obter_dados(cidadao_id)
+        return None if dados is None else dados.caracteristicas(hoje or hoje_utc())
+
+
+_armazem: Optional[ArmazemCidadaos] = None
+_tarefa: Optional[TarefaPeriodica] = None
+
+
+def obter_armazem_cidadaos() -> Optional[ArmazemCidadaos]:
+    return _armazem
+
+
+def obter_dados_do_armazem(cidadao_id: str) -> Optional[CidadaoDados]:
+    armazem = _armazem
+    if armazem is None:
+        return None
+    return armazem.obter_dados(cidadao_id)
+
+
+def _snapshot_recente(caminho: Path) -> bool:
+    return (
+        caminho.exists()
+        and time.time() - caminho.stat().st_mtime
+        < configs.ARMAZEM_CIDADAOS_INTERVALO_SEGUNDOS
+    )
+
+
+def atualizar_armazem_cidadaos() -> None:
+    global _armazem
+
+    caminho = Path(configs.ARMAZEM_CIDADAOS_CAMINHO)
+    # outro worker pode ter acabado de exportar: reaproveita o arquivo
+    if _snapshot_recente(caminho) and (
+        _armazem is None or caminho.stat().st_mtime > _armazem.modificado_em
+    ):
+        novo = ArmazemCidadaos.carregar(caminho)
+    else:
+        novo = ArmazemCidadaos.exportar_do_bigquery()
+        novo.salvar(caminho)
+        novo.modificado_em = caminho.stat().st_mtime
+    _armazem = novo
+    logger.info(f"Armazém de cidadãos atualizado: {len(novo)} cidadãos")
+
+
+def iniciar_armazem_cidadaos() -> None:
+    global _armazem, _tarefa
+
+    if not configs.ARMAZEM_CIDADAOS_ATIVO or _tarefa is not None:
+        return
+    caminho = Path(configs.ARMAZEM_CIDADAOS_CAMINHO)
+    if caminho.exists():
+        try:
+            _armazem = ArmazemCidadaos.carregar(caminho)
+            logger.info(f"Armazém de cidadãos carregado: {len(_armazem)} cidadãos")
+        except Exception:
+            logger.exception("Falha ao carregar o armazém de cidadãos do disco")
+    _tarefa = TarefaPeriodica(
+        nome="armazem-cidadaos",
+        intervalo_segundos=configs.ARMAZEM_CIDADAOS_INTERVALO_SEGUNDOS,
+        funcao=atualizar_armazem_cidadaos,
+        executar_imediatamente=not _snapshot_recente(caminho),
+    )
+    _tarefa.iniciar()
+
+
+def parar_armazem_cidadaos() -> None:
+    global _tarefa
+
+    if _tarefa is not None:
+        _tarefa.parar()
+        _tarefa = None
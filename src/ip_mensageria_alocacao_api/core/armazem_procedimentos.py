@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Iterable, Optional, Sequence
+
+import numpy as np
+
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.agendador import TarefaPeriodica
+from ip_mensageria_alocacao_api.core.armazem_cidadaos import hoje_utc
+from ip_mensageria_alocacao_api.core.bd import consultar, parametros_data
+from ip_mensageria_alocacao_api.core.cache import FORA_DA_FONTE_LOCAL
+from ip_mensageria_alocacao_api.core.modelos import LinhaCuidado
+
+logger = logging.getLogger(__name__)
+
+# colunas de `ArmazemProcedimentos.datas`, na ordem
+_FONTES = ("citopatologico", "diabetes", "hipertensao")
+
+# datas são guardadas como dias desde 1970-01-01; nulos com um sentinela
+_EPOCA = date(1970, 1, 1).toordinal()
+_DATA_NULA = np.iinfo(np.int32).min
+
+# Mesmas datas das consultas por cidadão em `auxiliar`, para todos os
+# cidadãos com data a partir de `@desde`. Linhas sem data são omitidas: não
+# alteram o resultado das consultas por cidadão.
+_QUERY_DATAS = """
+    SELECT
+        'citopatologico' AS fonte,
+        cidadao_id,
+        MAX(dt_ultimo_exame) AS data
+    FROM `ip_camada_prata_historico_transmissoes.previne_brasil_citopatologico_mensageria`
+    WHERE dt_ultimo_exame >= @desde
+    GROUP BY cidadao_id
+    UNION ALL
+    SELECT
+        'diabetes' AS fonte,
+        cidadao_id,
+        MAX(GREATEST(
+            dt_solicitacao_hemoglobina_glicada_mais_recente,
+            dt_consulta_mais_recente
+        )) AS data
+    FROM `ip_camada_prata_historico_transmissoes.previne_brasil_diabeticos_mensageria`
+    WHERE GREATEST(
+        dt_solicitacao_hemoglobina_glicada_mais_recente,
+        dt_consulta_mais_recente
+    ) >= @desde
+    GROUP BY cidadao_id
+    UNION ALL
+    SELECT
+        'hipertensao' AS fonte,
+        cidadao_id,
+        MAX(GREATEST(
+            dt_afericao_pressao_mais_recente,
+            dt_consulta_mais_recente
+        )) AS data
+    FROM `ip_camada_prata_historico_transmissoes.previne_brasil_hipertensos_mensageria`
+    WHERE GREATEST(
+        dt_afericao_pressao_mais_recente,
+        dt_consulta_mais_recente
+    ) >= @desde
+    GROUP BY cidadao_id
+"""
+
+
+class ArmazemProcedimentos:
+    """
+    Data do último procedimento de cada cidadão por fonte (citopatológico,
+    diabetes e hipertensão), com os ids em um array ordenado consultado por
+    busca binária e as datas como dias desde 1970-01-01.
+    """
+
+    def __init__(self, ids: np.ndarray, datas: np.ndarray) -> None:
+        self.ids = ids
+        self.datas = datas
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def de_linhas(cls, linhas: Iterable[Any]) -> ArmazemProcedimentos:
+        por_cidadao: dict[str, list[int]] = {}
+        for linha in linhas:
+            if linha.data is None:
+                continue
+            datas = por_cidadao.setdefault(
+                str(linha.cidadao_id), [_DATA_NULA] * len(_FONTES)
+            )
+            coluna = _FONTES.index(linha.fonte)
+            datas[coluna] = max(datas[coluna], linha.data.toordinal() - _EPOCA)
+        ids = np.array(sorted(por_cidadao), dtype=str)
+        datas_array: np.ndarray = np.array(
+            [por_cidadao[cidadao_id] for cidadao_id in ids], dtype=np.int32
+        ).reshape(len(ids), len(_FONTES))
+        return cls(ids=ids, datas=datas_array)
+
+    @classmethod
+    def exportar_do_bigquery(cls, desde: date = date.min) -> ArmazemProcedimentos:
+        linhas = consultar(
+            _QUERY_DATAS,
+            job_config=parametros_data("desde", desde),
+            nome="armazem_procedimentos",
+            page_size=100_000,
+            timeout=None,
+        )
+        return cls.de_linhas(linhas)
+
+    def mesclar(self, delta: ArmazemProcedimentos) -> ArmazemProcedimentos:
+        """Novo armazém com as datas mais recentes entre este e `delta`."""
+        ids = np.union1d(self.ids, delta.ids)
+        datas: np.ndarray = np.full((len(ids), len(_FONTES)), _DATA_NULA, np.int32)
+        for parte in (self, delta):
+            posicoes = np.searchsorted(ids, parte.ids)
+            datas[posicoes] = np.maximum(datas[posicoes], parte.datas)
+        return ArmazemProcedimentos(ids=ids, datas=datas)
+
+    def datas_ultimo_procedimento(
+        self,
+        cidadaos_ids: Sequence[str],
+        linha_cuidado: LinhaCuidado,
+    ) -> dict[str, Optional[date]]:
+        """Mesmo resultado de `auxiliar.obter_datas_ultimo_procedimento`."""
+        resultado: dict[str, Optional[date]] = dict.fromkeys(cidadaos_ids)
+        if not len(self.ids) or not resultado:
+            return resultado
+        chaves = np.array(list(resultado), dtype=str)
+        posicoes = np.minimum(np.searchsorted(self.ids, chaves), len(self.ids) - 1)
+        encontrados = self.ids[posicoes] == chaves
+        datas = self.datas[posicoes]
+        if linha_cuidado == LinhaCuidado.citotopatologico:
+            dias = datas[:, 0]
+        else:
+            # como o INNER JOIN entre diabetes e hipertensão
+            dias = np.where(
+                (datas[:, 1:] != _DATA_NULA).all(axis=1),
+                datas[:, 1:].max(axis=1),
+                _DATA_NULA,
+            )
+        for cidadao_id, encontrado, dia in zip(
+            resultado, encontrados.tolist(), dias.tolist()
+        ):
+            if encontrado and dia != _DATA_NULA:
+                resultado[cidadao_id] = date.fromordinal(dia + _EPOCA)
+        return resultado
+
+
+_armazem: Optional[ArmazemProcedimentos] = None
+_tarefa: Optional[TarefaPeriodica] = None
+_trava = threading.Lock()
+# data (UTC) do início da última sincronização e instante da última
+# exportação completa, em `time.monotonic()`
+_sincronizado_em: Optional[date] = None
+_exportado_em = 0.0
+
+
+def obter_armazem_procedimentos() -> Optional[ArmazemProcedimentos]:
+    return _armazem
+
+
+def data_do_armazem(cidadao_id: str, linha_cuidado: LinhaCuidado) -> Any:
+    """
+    Data do último procedimento segundo o armazém (`None` se não houver),
+    ou `FORA_DA_FONTE_LOCAL` se o armazém não estiver carregado.
+    """
+    armazem = _armazem
+    if armazem is None:
+        return FORA_DA_FONTE_LOCAL
+    return armazem.datas_ultimo_procedimento([cidadao_id], linha_cuidado)[cidadao_id]
+
+
+def sincronizar_armazem_procedimentos() -> None:
+    """
+    Exporta todas as datas na primeira execução e a cada
+    ARMAZEM_PROCEDIMENTOS_EXPORTACAO_COMPLETA_SEGUNDOS; nas demais, busca só
+    as linhas com data a partir da última sincronização (menos a carência
+    para transmissões atrasadas) e as mescla ao armazém atual.
+    """
+    global _armazem, _sincronizado_em, _exportado_em
+
+    with _trava:
+        inicio = time.monotonic()
+        hoje = hoje_utc()
+        atual, sincronizado_em = _armazem, _sincronizado_em
+        if (
+            atual is None
+            or sincronizado_em is None
+            or inicio - _exportado_em
+            >= configs.ARMAZEM_PROCEDIMENTOS_EXPORTACAO_COMPLETA_SEGUNDOS
+        ):
+            novo = ArmazemProcedimentos.exportar_do_bigquery()
+            _exportado_em = inicio
+            operacao = "exportado"
+        else:
+            desde = sincronizado_em - timedelta(
+                days=configs.ARMAZEM_PROCEDIMENTOS_CARENCIA_DIAS
+            )
+            novo = atual.mesclar(ArmazemProcedimentos.exportar_do_bigquery(desde))
+            operacao = f"sincronizado desde {desde}"
+        _armazem = novo
+        _sincronizado_em = hoje
+    logger.info(
+        f"Armazém de procedimentos {operacao}: {len(novo)} cidadãos em "
+        f"{time.monotonic() - inicio:.1f}s"
+    )
+
+
+def iniciar_armazem_procedimentos() -> None:
+    global _tarefa
+
+    if not configs.ARMAZEM_PROCEDIMENTOS_ATIVO or _tarefa is not None:
+        return
+    _tarefa = TarefaPeriodica(
+        nome="armazem-procedimentos",
+        intervalo_segundos=configs.ARMAZEM_PROCEDIMENTOS_INTERVALO_SEGUNDOS,
+        funcao=sincronizar_armazem_procedimentos,
+        executar_imediatamente=True,
+    )
+    _tarefa.iniciar()
+
+
+def parar_armazem_procedimentos() -> None:
+    global _tarefa
+
+    if _tarefa is not None:
+        _tarefa.parar()
+        _tarefa = None
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import re
+from typing import Any, NamedTuple, Optional, Sequence
+
+import numpy as np
+from numpy import dtype, ndarray
+
+from ip_mensageria_alocacao_api.core.modelos import (
+    CidadaoCaracteristicas,
+    DiaSemana,
+    LinhaCuidado,
+    MensagemTipo,
+)
+
+# numéricas do treino, na ordem em que o imputador foi ajustado
+ATRIBUTOS_NUMERICOS = [
+    "municipio_prop_domicilios_zona_rural",
+    "cidadao_plano_saude_privado",
+    "cidadao_idade",
+    "cidadao_tempo_desde_ultimo_procedimento",
+    "mensagem_horario_relativo_12h",
+]
+
+
+class EntradaAtributos(NamedTuple):
+    cidadao_caracteristicas: CidadaoCaracteristicas
+    linha_cuidado: LinhaCuidado
+    tempo_desde_ultimo_procedimento: Optional[int]
+    mensagem_tipo: MensagemTipo
+    mensagem_dia_semana: DiaSemana
+    mensagem_horario: int
+    mensagem_template_embedding: list[float] | ndarray[Any, dtype[Any]]
+    mensagem_midia_embedding: list[float] | ndarray[Any, dtype[Any]]
+
+
+def _posicoes_embedding(indice: dict[str, int], prefixo: str) -> np.ndarray:
+    """Posição na matriz de cada dimensão `<prefixo>{i}`, ou -1 se ausente."""
+    padrao = re.compile(rf"^{prefixo}(\d+)$")
+    dims = [int(m.group(1)) for c in indice if (m := padrao.match(c))]
+    return np.array(
+        [indice.get(f"{prefixo}{i}", -1) for i in range(max(dims, default=-1) + 1)],
+        dtype=int,
+    )
+
+
+def _preencher_embeddings(
+    matriz: np.ndarray,
+    posicoes: np.ndarray,
+    embeddings: Sequence[list[float] | ndarray[Any, dtype[Any]]],
+) -> None:
+    vetores: list[np.ndarray] = [np.asarray(e, dtype=float) for e in embeddings]
+    tamanhos = {len(v) for v in vetores}
+    if len(tamanhos) == 1:
+        k = min(tamanhos.pop(), len(posicoes))
+        validas = posicoes[:k] >= 0
+        if k and validas.any():
+            matriz[:, posicoes[:k][validas]] = np.vstack(vetores)[:, :k][:, validas]
+        return
+    # tamanhos diferentes entre linhas: preenche linha a linha
+    for linha, vetor in enumerate(vetores):
+        k = min(len(vetor), len(posicoes))
+        validas = posicoes[:k] >= 0
+        matriz[linha, posicoes[:k][validas]] = vetor[:k][validas]
+
+
+class PlanoAtributos:
+    """
+    Plano de montagem da matriz de atributos compilado uma única vez a partir
+    dos artefatos do classificador: posições de cada coluna, valores de
+    imputação e colunas categóricas. Produz, para N linhas de uma vez, a mesma
+    matriz que `preparar_atributos_para_predicao` produziria linha a linha.
+    """
+
+    def __init__(
+        self,
+        atributos_colunas: Sequence[str],
+        atributos_categoricos: Sequence[str],
+        valores_imputacao: np.ndarray,
+    ) -> None:
+        self.colunas = list(atributos_colunas)
+        indice = {c: i for i, c in enumerate(self.colunas)}
+        categoricas = set(atributos_categoricos)
+
+        # colunas que não vierem na entrada recebem "MISSING" ou 0.0
+        self._linha_padrao = np.array(
+            ["MISSING" if c in categoricas else 0.0 for c in self.colunas],
+            dtype=object,
+        )
+        self._valores_imputacao = np.asarray(valores_imputacao, dtype=float)
+        self._numericas = [
+            (j, indice[c]) for j, c in enumerate(ATRIBUTOS_NUMERICOS) if c in indice
+        ]
+        self._pos_linha_cuidado = indice.get("linha_cuidado")
+        self._pos_sexo = indice.get("cidadao_sexo")
+        self._pos_raca_cor = indice.get("cidadao_raca_cor")
+        self._pos_dia_semana = indice.get("mensagem_dia_semana")
+        self._pos_mensagem_tipo = indice.get("mensagem_tipo")
+        self._pos_template = _posicoes_embedding(indice, "template_emb_")
+        self._pos_midia = _posicoes_embedding(indice, "midia_emb_")
+
+        # categóricas preenchidas com números precisam virar texto, como o
+        # `astype("string")` do caminho com pandas
+        textuais = {
+            self._pos_linha_cuidado,
+            self._pos_sexo,
+            self._pos_raca_cor,
+            self._pos_dia_semana,
+            self._pos_mensagem_tipo,
+        }
+        self._categoricas_numericas = [
+            indice[c]
+            for c in self.colunas
+            if c in categoricas and indice[c] not in textuais
+        ]
+
+    def montar(self, entradas: Sequence[EntradaAtributos]) -> np.ndarray:
+        n = len(entradas)
+        matriz = np.tile(self._linha_padrao, (n, 1))
+        if n == 0:
+            return matriz
+
+        numericas = np.array(
+            [
+                [
+                    e.cidadao_caracteristicas.municipio_prop_domicilios_zona_rural,
+                    int(bool(e.cidadao_caracteristicas.plano_saude_privado))
+                    if e.cidadao_caracteristicas.plano_saude_privado is not None
+                    else None,
+                    e.cidadao_caracteristicas.idade,
+                    e.tempo_desde_ultimo_procedimento
+                    if e.tempo_desde_ultimo_procedimento is not None
+                    else e.cidadao_caracteristicas.tempo_desde_ultimo_procedimento,
+                    int(e.mensagem_horario) - 12,
+                ]
+                for e in entradas
+            ],
+            dtype=float,
+        )
+        numericas = np.where(np.isnan(numericas), self._valores_imputacao, numericas)
+        for j, pos in self._numericas:
+            matriz[:, pos] = numericas[:, j]
+
+        if self._pos_linha_cuidado is not None:
+            matriz[:, self._pos_linha_cuidado] = [
+                str(e.linha_cuidado.value) for e in entradas
+            ]
+        if self._pos_sexo is not None:
+            matriz[:, self._pos_sexo] = [
+                e.cidadao_caracteristicas.sexo or "MISSING" for e in entradas
+            ]
+        if self._pos_raca_cor is not None:
+            matriz[:, self._pos_raca_cor] = [
+                e.cidadao_caracteristicas.raca_cor or "MISSING" for e in entradas
+            ]
+        if self._pos_dia_semana is not None:
+            matriz[:, self._pos_dia_semana] = [
+                str(e.mensagem_dia_semana.value) for e in entradas
+            ]
+        if self._pos_mensagem_tipo is not None:
+            matriz[:, self._pos_mensagem_tipo] = [
+                str(e.mensagem_tipo.value) for e in entradas
+            ]
+
+        _preencher_embeddings(
+            matriz,
+            self._pos_template,
+            [e.mensagem_template_embedding for e in entradas],
+        )
+        _preencher_embeddings(
+            matriz,
+            self._pos_midia,
+            [e.mensagem_midia_embedding for e in entradas],
+        )
+
+        for pos in self._categoricas_numericas:
+            matriz[:, pos] = [str(v) for v in matriz[:, pos]]
+        return matriz
+
+
+def compilar_plano_atributos(
+    atributos_colunas: Sequence[str],
+    atributos_categoricos: Sequence[str],
+    imputador_numerico: Any,
+) -> Optional[PlanoAtributos]:
+    """
+    Compila o plano de atributos quando o imputador é um `SimpleImputer`
+    (ou equivalente) que apenas substitui NaN por `statistics_`. Para outros
+    imputadores devolve `None`, e a predição segue pelo caminho com pandas.
+    """
+    estatisticas = getattr(imputador_numerico, "statistics_", None)
+    if estatisticas is None or getattr(imputador_numerico, "add_indicator", False):
+        return None
+    estatisticas = np.asarray(estatisticas, dtype=float)
+    if estatisticas.shape != (len(ATRIBUTOS_NUMERICOS),):
+        return None
+    if not np.isfinite(estatisticas).all():
+        return None
+    valores_ausentes = getattr(imputador_numerico, "missing_values", np.nan)
+    if not (isinstance(valores_ausentes, float) and np.isnan(valores_ausentes)):
+        return None
+    nomes = getattr(imputador_numerico, "feature_names_in_", None)
+    if nomes is not None and list(nomes) != ATRIBUTOS_NUMERICOS:
+        return None
+    return PlanoAtributos(atributos_colunas, atributos_categoricos, estatisticas)
@@ -10,7 +10,8 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 
 from ip_mensageria_alocacao_api.core import configs
-from ip_mensageria_alocacao_api.core.bd import make_bq_client
+from ip_mensageria_alocacao_api.core.bd import consultar, parametros_lista
+from ip_mensageria_alocacao_api.core.carregador import CarregadorEmLote
 from ip_mensageria_alocacao_api.core.modelos import TokenDados, UsuarioNaBase
 
 P = ParamSpec("P")
@@ -27,23 +28,37 @@ def obter_hash_senha(password: str) -> str:
     return pwd_context.hash(password)
 
 
-def obter_usuario(usuario_nome: str | None) -> UsuarioNaBase | None:
-    if not usuario_nome:
-        return None
-    query = f"""
+def _carregar_usuarios(usuarios_nomes: list[str]) -> dict[str, UsuarioNaBase]:
+    query = """
         SELECT usuario, senha_hash, desativado
         FROM `ip_mensageria_camada_ouro.usuarios_api_predicao`
-        WHERE usuario = '{usuario_nome}'
+        WHERE usuario IN UNNEST(@usuarios)
     """
-    resultado_query = make_bq_client().query(query).result()
-    if resultado_query.total_rows == 0:
-        return None
-    usuario_linha = next(resultado_query)
-    return UsuarioNaBase(
-        usuario_nome=usuario_linha.usuario,
-        senha_hash=usuario_linha.senha_hash,
-        desativado=usuario_linha.desativado,
+    resultado_query = consultar(
+        query,
+        job_config=parametros_lista("usuarios", usuarios_nomes),
+        nome="usuarios",
     )
+    usuarios: dict[str, UsuarioNaBase] = {}
+    for usuario_linha in resultado_query:
+        usuarios.setdefault(
+            usuario_linha.usuario,
+            UsuarioNaBase(
+                usuario_nome=usuario_linha.usuario,
+                senha_hash=usuario_linha.senha_hash,
+                desativado=usuario_linha.desativado,
+            ),
+        )
+    return usuarios
+
+
+_carregador_usuarios = CarregadorEmLote("usuario", _carregar_usuarios)
+
+
+def obter_usuario(usuario_nome: str | None) -> UsuarioNaBase | None:
+    if not usuario_nome:
+        return None
+    return _carregador_usuarios.carregar(usuario_nome)
 
 
 def autenticar_usuario(usuario_nome: str, password: str) -> bool | UsuarioNaBase:
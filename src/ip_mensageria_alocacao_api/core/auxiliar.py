@@ -1,25 +1,63 @@
 from __future__ import annotations
 
-from functools import lru_cache
+from concurrent.futures import Future
+from datetime import date
 from http import HTTPStatus
-from typing import Any, Optional, Tuple
+from typing import Any, Optional, Sequence, Tuple, cast
 
 import numpy as np
 import pandas as pd
 from catboost import Pool
 from fastapi import HTTPException
-from google.cloud.bigquery.table import RowIterator, _EmptyRowIterator
 from numpy import dtype, ndarray
 from pydantic import AnyUrl
 
-from ip_mensageria_alocacao_api.core.bd import make_bq_client
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.armazem_cidadaos import (
+    hoje_utc,
+    obter_dados_do_armazem,
+)
+from ip_mensageria_alocacao_api.core.armazem_procedimentos import (
+    data_do_armazem,
+    obter_armazem_procedimentos,
+)
+from ip_mensageria_alocacao_api.core.atributos import (
+    ATRIBUTOS_NUMERICOS,
+    EntradaAtributos,
+    PlanoAtributos,
+)
+from ip_mensageria_alocacao_api.core.bd import consultar, parametros_lista
+from ip_mensageria_alocacao_api.core.cache import (
+    FORA_DA_FONTE_LOCAL,
+    FuncaoDerivada,
+    cache_consulta,
+)
+from ip_mensageria_alocacao_api.core.carregador import CarregadorEmLote
+from ip_mensageria_alocacao_api.core.catalogo_embeddings import (
+    midia_embedding_do_catalogo,
+    montar_texto_template,
+    normalizar_uri_midia,
+    obter_catalogo_embeddings,
+    template_embedding_do_catalogo,
+    template_embedding_por_texto_do_catalogo,
+)
+from ip_mensageria_alocacao_api.core.censo_municipios import obter_censo_municipios
 from ip_mensageria_alocacao_api.core.configs import BQ_PROJETO
+from ip_mensageria_alocacao_api.core.embeddings_gerados import gerar_embeddings_textos
+from ip_mensageria_alocacao_api.core.executores import (
+    num_threads_por_modelo,
+    obter_executor_ensemble,
+)
+from ip_mensageria_alocacao_api.core.futuros import concluido, encadear, falho
+from ip_mensageria_alocacao_api.core.indice_cidadaos import cidadao_desconhecido
 from ip_mensageria_alocacao_api.core.modelos import (
     CidadaoCaracteristicas,
+    CidadaoDados,
     Classificador,
     DiaSemana,
     LinhaCuidado,
     MensagemTipo,
+    Template,
 )
 
 
@@ -43,121 +81,323 @@ def beta_from_mean_se(p: float, se: float, eps: float = 1e-6) -> Tuple[float, fl
     return alpha, beta
 
 
-@lru_cache(maxsize=128)
-def obter_caracteristicas_usuario(cidadao_id: str) -> CidadaoCaracteristicas:
-    query = f"""
+def beta_from_mean_se_vetorizado(
+    p: ndarray[Any, dtype[Any]],
+    se: ndarray[Any, dtype[Any]],
+    eps: float = 1e-6,
+) -> Tuple[ndarray[Any, dtype[np.float64]], ndarray[Any, dtype[np.float64]]]:
+    """
+    Versão vetorizada de `beta_from_mean_se`: converte arrays de médias e
+    desvios em arrays de parâmetros (α, β), com as mesmas regras de piso e
+    fallback aplicadas elemento a elemento.
+    """
+    p = np.clip(np.asarray(p, dtype=float), eps, 1 - eps)
+    v = np.maximum(np.asarray(se, dtype=float) ** 2, 1e-5)
+    denom = (p * (1 - p) / v) - 1.0
+    fallback = denom <= 0
+    alpha = np.where(fallback, 1.0 + 9.0 * p, np.maximum(p * denom, eps))
+    beta = np.where(fallback, 1.0 + 9.0 * (1 - p), np.maximum((1 - p) * denom, eps))
+    return alpha, beta
+
+
+def _carregar_caracteristicas_usuarios(
+    cidadaos_ids: list[str],
+) -> dict[str, CidadaoDados]:
+    query = """
         SELECT
-            DATE_DIFF(
-                CURRENT_DATE(),
-                SAFE_CAST(c.cidadao_dt_nascimento AS DATE),
-                YEAR
-            ) AS idade,
+            c.id AS cidadao_id,
+            SAFE_CAST(c.cidadao_dt_nascimento AS DATE) AS data_nascimento,
             c.cidadao_sexo as sexo,
             c.cidadao_raca_cor as raca_cor,
             c.cidadao_plano_saude_privado as plano_saude_privado,
-            m.perc_dom_zona_rural as prop_domicilios_zona_rural
+            c.municipio_id_sus
         FROM `ip_mensageria_camada_ouro.cidadao` c
-        LEFT JOIN `pmai_camada_prata.situacao_domicilios_municipios_censo_2010` m
-        ON c.municipio_id_sus = m.cod_mun_ibge
-        WHERE c.id = '{cidadao_id}'
+        WHERE c.id IN UNNEST(@ids)
     """
-    resultado_query = make_bq_client().query(query).result()
-    assert resultado_query.total_rows == 1
-    cidadao = next(resultado_query)
-    return CidadaoCaracteristicas(
-        idade=cidadao.idade,
-        plano_saude_privado=cidadao.plano_saude_privado,
-        raca_cor=cidadao.raca_cor,
-        sexo=cidadao.sexo,
-        municipio_prop_domicilios_zona_rural=cidadao.prop_domicilios_zona_rural,
-        tempo_desde_ultimo_procedimento=None,
+    linhas = list(
+        consultar(
+            query,
+            job_config=parametros_lista("ids", cidadaos_ids),
+            nome="caracteristicas_usuarios",
+        )
+    )
+    # a proporção rural vem do censo em memória, sem JOIN no BigQuery
+    props = obter_censo_municipios().proporcoes(
+        [cidadao.municipio_id_sus for cidadao in linhas]
     )
+    return {
+        cidadao.cidadao_id: CidadaoDados(
+            data_nascimento=cidadao.data_nascimento,
+            plano_saude_privado=cidadao.plano_saude_privado,
+            raca_cor=cidadao.raca_cor,
+            sexo=cidadao.sexo,
+            municipio_prop_domicilios_zona_rural=None if np.isnan(prop) else prop,
+        )
+        for cidadao, prop in zip(linhas, props.tolist())
+    }
 
 
-@lru_cache(maxsize=128)
-def obter_tempo_desde_ultimo_procedimento(
-    cidadao_id: str,
-    linha_cuidado: LinhaCuidado,
-) -> int:
-    query_cito = f"""
-        SELECT
-            MIN(DATE_DIFF(
-                CURRENT_DATE(),
-                dt_ultimo_exame,
-                DAY
-            )) AS tempo_desde_ultimo_procedimento
-        FROM `ip_camada_prata_historico_transmissoes.previne_brasil_citopatologico_mensageria`
-        WHERE cidadao_id = '{cidadao_id}'
+_carregador_caracteristicas = CarregadorEmLote(
+    "caracteristicas_usuario", _carregar_caracteristicas_usuarios
+)
+
+
+def _exigir_cidadao(cidadao: Optional[CidadaoDados]) -> CidadaoDados:
+    if cidadao is None:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND,
+            detail="Not Found :: Cidadão não encontrado.",
+        )
+    return cidadao
+
+
+def _buscar_dados_cidadao(cidadao_id: str) -> Future[CidadaoDados]:
+    # ids fora do índice nem chegam ao BigQuery
+    futuro: Future[Optional[CidadaoDados]] = (
+        concluido(None)
+        if cidadao_desconhecido(cidadao_id)
+        else _carregador_caracteristicas.submeter(cidadao_id)
+    )
+    return encadear(futuro, _exigir_cidadao)
+
+
+@cache_consulta(
+    nome="dados_cidadao",
+    maxsize=configs.CACHE_CARACTERISTICAS_TAMANHO,
+    ttl_segundos=configs.CACHE_CARACTERISTICAS_TTL_SEGUNDOS,
+    fonte_local=obter_dados_do_armazem,
+    submeter=_buscar_dados_cidadao,
+)
+def obter_dados_cidadao(cidadao_id: str) -> CidadaoDados:
+    return _buscar_dados_cidadao(cidadao_id).result()
+
+
+def _caracteristicas_na_data_atual(dados: CidadaoDados) -> CidadaoCaracteristicas:
+    return dados.caracteristicas(hoje_utc())
+
+
+# a idade é calculada a cada chamada; o cache guarda a data de nascimento
+obter_caracteristicas_usuario = FuncaoDerivada(
+    obter_dados_cidadao, _caracteristicas_na_data_atual
+)
+
+
+def _obter_dados_cidadaos(cidadaos_ids: Sequence[str]) -> dict[str, CidadaoDados]:
+    """
+    Busca em um único job os dados dos cidadãos que ainda não estão em cache
+    e os guarda no cache de `obter_dados_cidadao`. Cidadãos não encontrados
+    ficam de fora do resultado.
     """
+    dados: dict[str, CidadaoDados] = {}
+    faltantes: list[str] = []
+    for cidadao_id in dict.fromkeys(cidadaos_ids):
+        encontrado, cidadao = obter_dados_cidadao.consultar_cache(cidadao_id)
+        if encontrado:
+            dados[cidadao_id] = cast(CidadaoDados, cidadao)
+        elif not cidadao_desconhecido(cidadao_id):
+            faltantes.append(cidadao_id)
+    if faltantes:
+        novos = _carregar_caracteristicas_usuarios(faltantes)
+        for cidadao_id, cidadao in novos.items():
+            obter_dados_cidadao.armazenar(cidadao, cidadao_id)
+        dados.update(novos)
+    return dados
 
-    query_diabetes = f"""
-        SELECT
-            MIN(DATE_DIFF(
-                CURRENT_DATE(),
-                GREATEST(
-                    dt_solicitacao_hemoglobina_glicada_mais_recente,
-                    dt_consulta_mais_recente
-                ),
-                DAY
-            )) AS tempo_desde_ultimo_procedimento
-        FROM `ip_camada_prata_historico_transmissoes.previne_brasil_diabeticos_mensageria`
-        WHERE cidadao_id = '{cidadao_id}'
+
+def antecipar_caracteristicas_usuarios(cidadaos_ids: Sequence[str]) -> int:
     """
+    Guarda no cache os dados dos cidadãos (ver `_obter_dados_cidadaos`).
+    Devolve quantos cidadãos ficaram disponíveis.
+    """
+    return len(_obter_dados_cidadaos(cidadaos_ids))
+
 
-    query_hipertensao = f"""
+def obter_caracteristicas_usuarios(
+    cidadaos_ids: Sequence[str],
+) -> dict[str, CidadaoCaracteristicas]:
+    """
+    Versão em lote de `obter_caracteristicas_usuario`, em um único job para
+    os cidadãos fora do cache. Cidadãos não encontrados ficam de fora.
+    """
+    return {
+        cidadao_id: _caracteristicas_na_data_atual(dados)
+        for cidadao_id, dados in _obter_dados_cidadaos(cidadaos_ids).items()
+    }
+
+
+_QUERY_DATA_CITOPATOLOGICO = """
+    SELECT
+        cidadao_id,
+        MAX(dt_ultimo_exame) AS data_ultimo_procedimento
+    FROM `ip_camada_prata_historico_transmissoes.previne_brasil_citopatologico_mensageria`
+    WHERE cidadao_id IN UNNEST(@ids)
+    GROUP BY cidadao_id
+"""
+
+# Diabetes e hipertensão no mesmo job. GREATEST devolve NULL se o cidadão não
+# estiver nas duas listas, como a combinação feita antes em Python.
+_QUERY_DATA_CRONICOS = """
+    WITH diabetes AS (
         SELECT
-            MIN(DATE_DIFF(
-                CURRENT_DATE(),
-                GREATEST(
-                    dt_afericao_pressao_mais_recente,
-                    dt_consulta_mais_recente
-                ),
-                DAY
-            )) AS tempo_desde_ultimo_procedimento
+            cidadao_id,
+            MAX(GREATEST(
+                dt_solicitacao_hemoglobina_glicada_mais_recente,
+                dt_consulta_mais_recente
+            )) AS data
+        FROM `ip_camada_prata_historico_transmissoes.previne_brasil_diabeticos_mensageria`
+        WHERE cidadao_id IN UNNEST(@ids)
+        GROUP BY cidadao_id
+    ),
+    hipertensao AS (
+        SELECT
+            cidadao_id,
+            MAX(GREATEST(
+                dt_afericao_pressao_mais_recente,
+                dt_consulta_mais_recente
+            )) AS data
         FROM `ip_camada_prata_historico_transmissoes.previne_brasil_hipertensos_mensageria`
-        WHERE cidadao_id = '{cidadao_id}'
-    """
+        WHERE cidadao_id IN UNNEST(@ids)
+        GROUP BY cidadao_id
+    )
+    SELECT
+        d.cidadao_id,
+        GREATEST(d.data, h.data) AS data_ultimo_procedimento
+    FROM diabetes d
+    INNER JOIN hipertensao h
+    USING (cidadao_id)
+"""
 
-    if linha_cuidado == LinhaCuidado.citotopatologico:
-        resultado_query = make_bq_client().query(query_cito).result()
-        assert resultado_query.total_rows == 1
-        tempo_desde_ultimo_procedimento = next(
-            resultado_query
-        ).tempo_desde_ultimo_procedimento
-    elif linha_cuidado == LinhaCuidado.cronicos:
-        resultado_query_diabetes = make_bq_client().query(query_diabetes).result()
-        resultado_query_hipertensao = make_bq_client().query(query_hipertensao).result()
-        if isinstance(resultado_query_diabetes, RowIterator) and isinstance(
-            resultado_query_hipertensao, RowIterator
-        ):
-            tempo_proc_dia = next(
-                resultado_query_diabetes
-            ).tempo_desde_ultimo_procedimento
-            tempo_proc_hiper = next(
-                resultado_query_hipertensao
-            ).tempo_desde_ultimo_procedimento
-            tempo_desde_ultimo_procedimento = None
-            if tempo_proc_dia is not None and tempo_proc_hiper is not None:
-                tempo_desde_ultimo_procedimento = np.minimum(
-                    tempo_proc_dia or np.inf,
-                    tempo_proc_hiper or np.inf,
-                )
-        elif isinstance(resultado_query_diabetes, RowIterator):
-            tempo_desde_ultimo_procedimento = next(
-                resultado_query_diabetes
-            ).tempo_desde_ultimo_procedimento
-        elif isinstance(resultado_query_hipertensao, RowIterator):
-            tempo_desde_ultimo_procedimento = next(
-                resultado_query_hipertensao
-            ).tempo_desde_ultimo_procedimento
-        else:
-            raise ValueError(
-                f"Cidadão não encontrado nas listas de {linha_cuidado.value}."
-            )
-    else:
+
+_QUERIES_DATA = {
+    LinhaCuidado.citotopatologico: _QUERY_DATA_CITOPATOLOGICO,
+    LinhaCuidado.cronicos: _QUERY_DATA_CRONICOS,
+}
+
+
+def _dias_ate_hoje(data: Optional[date]) -> Optional[int]:
+    # DATE_DIFF(CURRENT_DATE(), data, DAY), como no treino
+    return None if data is None else (hoje_utc() - data).days
+
+
+def obter_datas_ultimo_procedimento(
+    cidadaos_ids: Sequence[str],
+    linha_cuidado: LinhaCuidado,
+) -> dict[str, Optional[date]]:
+    """
+    Data do último procedimento de cada cidadão, em um único job do
+    BigQuery. Cidadãos sem registro na linha de cuidado ficam com `None`.
+    """
+    query = _QUERIES_DATA.get(linha_cuidado)
+    if query is None:
         raise ValueError(f"Linha de cuidado {linha_cuidado} não suportada.")
 
-    return tempo_desde_ultimo_procedimento
+    datas: dict[str, Optional[date]] = dict.fromkeys(cidadaos_ids)
+    if not datas:
+        return datas
+    armazem = obter_armazem_procedimentos()
+    if armazem is not None:
+        return armazem.datas_ultimo_procedimento(list(datas), linha_cuidado)
+    linhas = consultar(
+        query,
+        job_config=parametros_lista("ids", list(datas)),
+        nome="datas_ultimo_procedimento",
+    )
+    for linha in linhas:
+        datas[linha.cidadao_id] = linha.data_ultimo_procedimento
+    return datas
+
+
+def obter_tempos_desde_ultimo_procedimento(
+    cidadaos_ids: Sequence[str],
+    linha_cuidado: LinhaCuidado,
+) -> dict[str, Optional[int]]:
+    """Dias desde o último procedimento de cada cidadão (ver `obter_datas_ultimo_procedimento`)."""
+    return {
+        cidadao_id: _dias_ate_hoje(data)
+        for cidadao_id, data in obter_datas_ultimo_procedimento(
+            cidadaos_ids, linha_cuidado
+        ).items()
+    }
+
+
+def _carregar_datas_ultimo_procedimento(
+    chaves: list[tuple[str, LinhaCuidado]],
+) -> dict[tuple[str, LinhaCuidado], Optional[date]]:
+    por_linha_cuidado: dict[LinhaCuidado, list[str]] = {}
+    for cidadao_id, linha_cuidado in chaves:
+        por_linha_cuidado.setdefault(linha_cuidado, []).append(cidadao_id)
+    datas: dict[tuple[str, LinhaCuidado], Optional[date]] = {}
+    for linha_cuidado, cidadaos_ids in por_linha_cuidado.items():
+        for cidadao_id, data in obter_datas_ultimo_procedimento(
+            cidadaos_ids, linha_cuidado
+        ).items():
+            datas[(cidadao_id, linha_cuidado)] = data
+    return datas
+
+
+_carregador_tempos = CarregadorEmLote(
+    "tempo_desde_ultimo_procedimento", _carregar_datas_ultimo_procedimento
+)
+
+
+def _data_do_armazem(cidadao_id: str, linha_cuidado: LinhaCuidado) -> Any:
+    if linha_cuidado not in _QUERIES_DATA:
+        return FORA_DA_FONTE_LOCAL
+    return data_do_armazem(cidadao_id, linha_cuidado)
+
+
+def _buscar_data_ultimo_procedimento(
+    cidadao_id: str,
+    linha_cuidado: LinhaCuidado,
+) -> Future[Optional[date]]:
+    if linha_cuidado not in _QUERIES_DATA:
+        return falho(ValueError(f"Linha de cuidado {linha_cuidado} não suportada."))
+    return _carregador_tempos.submeter((cidadao_id, linha_cuidado))
+
+
+# Com o armazém carregado, ele responde antes do cache: as sincronizações por
+# delta valem de imediato, sem esperar a validade das entradas em cache.
+@cache_consulta(
+    nome="data_ultimo_procedimento",
+    maxsize=configs.CACHE_TEMPOS_TAMANHO,
+    ttl_segundos=configs.CACHE_TEMPOS_TTL_SEGUNDOS,
+    fonte_local=_data_do_armazem,
+    ausente_na_fonte_local=FORA_DA_FONTE_LOCAL,
+    submeter=_buscar_data_ultimo_procedimento,
+)
+def obter_data_ultimo_procedimento(
+    cidadao_id: str,
+    linha_cuidado: LinhaCuidado,
+) -> Optional[date]:
+    return _buscar_data_ultimo_procedimento(cidadao_id, linha_cuidado).result()
+
+
+# os dias são contados a cada chamada; o cache guarda a data
+obter_tempo_desde_ultimo_procedimento = FuncaoDerivada(
+    obter_data_ultimo_procedimento, _dias_ate_hoje
+)
+
+
+def antecipar_tempos_desde_ultimo_procedimento(
+    cidadaos_ids: Sequence[str],
+    linha_cuidado: LinhaCuidado,
+) -> None:
+    """
+    Versão em lote de `obter_data_ultimo_procedimento` para os cidadãos que
+    ainda não estão em cache, guardando os resultados no cache.
+    """
+    faltantes = [
+        cidadao_id
+        for cidadao_id in dict.fromkeys(cidadaos_ids)
+        if not obter_data_ultimo_procedimento.consultar_cache(
+            cidadao_id, linha_cuidado
+        )[0]
+    ]
+    if not faltantes:
+        return
+    datas = obter_datas_ultimo_procedimento(faltantes, linha_cuidado)
+    for cidadao_id, data in datas.items():
+        obter_data_ultimo_procedimento.armazenar(data, cidadao_id, linha_cuidado)
 
 
 def preparar_atributos_para_predicao(
@@ -203,13 +443,7 @@ def preparar_atributos_para_predicao(
     df = pd.DataFrame([row], columns=None)
 
     # imputação numérica como no treino
-    num_cols = [
-        "municipio_prop_domicilios_zona_rural",
-        "cidadao_plano_saude_privado",
-        "cidadao_idade",
-        "cidadao_tempo_desde_ultimo_procedimento",
-        "mensagem_horario_relativo_12h",
-    ]
+    num_cols = ATRIBUTOS_NUMERICOS
     # coerce e imputar
     for c in num_cols:
         df[c] = pd.to_numeric(df[c], errors="coerce")
@@ -232,114 +466,244 @@ def preparar_atributos_para_predicao(
     return df
 
 
-@lru_cache(maxsize=128)
-def obter_template_embedding_por_nome(template_nome: str) -> np.ndarray:
-    resultado_query = (
-        make_bq_client()
-        .query(f"""
-        SELECT embedding
+def montar_matriz_atributos(
+    classificadores: Classificador,
+    entradas: Sequence[EntradaAtributos],
+) -> np.ndarray:
+    """
+    Monta a matriz (linhas x `atributos_colunas`) de todas as entradas de uma
+    vez com o plano de atributos compilado no carregamento dos classificadores.
+    Sem plano, recorre a `preparar_atributos_para_predicao`, que é também a
+    referência para o resultado do plano.
+    """
+    plano = getattr(classificadores, "plano_atributos", None)
+    if isinstance(plano, PlanoAtributos):
+        return plano.montar(entradas)
+    return pd.concat(
+        [
+            preparar_atributos_para_predicao(
+                classificadores=classificadores, **entrada._asdict()
+            )
+            for entrada in entradas
+        ],
+        ignore_index=True,
+    ).to_numpy(dtype=object)
+
+
+def _carregar_templates_por_nome(nomes: list[str]) -> dict[str, np.ndarray]:
+    linhas = consultar(
+        """
+        SELECT template_nome, embedding
         FROM `ip_mensageria_camada_prata.templates_embeddings`
-        WHERE template_nome = '{template_nome}';
-    """)
-        .result()
+        WHERE template_nome IN UNNEST(@nomes)
+        """,
+        job_config=parametros_lista("nomes", nomes),
+        nome="templates_por_nome",
     )
-    if (
-        not isinstance(resultado_query, _EmptyRowIterator)
-        and resultado_query.total_rows > 0
-    ):
-        return np.array(next(resultado_query).embedding, dtype=float)
+    embeddings: dict[str, np.ndarray] = {}
+    for linha in linhas:
+        embeddings.setdefault(
+            linha.template_nome, np.array(linha.embedding, dtype=np.float32)
+        )
+    return embeddings
+
+
+_carregador_templates_por_nome = CarregadorEmLote(
+    "template_embedding_por_nome", _carregar_templates_por_nome
+)
+
+
+def _exigir_template(embedding: Optional[np.ndarray]) -> np.ndarray:
+    if embedding is not None:
+        return embedding
     raise HTTPException(
         status_code=HTTPStatus.NOT_FOUND,
         detail="Not Found :: Template não encontrado. Tente enviar o texto completo por meio do atributo `template` do objeto `Mensagem`.",
     )
 
 
-@lru_cache(maxsize=128)
+def _buscar_template_embedding_por_nome(template_nome: str) -> Future[np.ndarray]:
+    return encadear(
+        _carregador_templates_por_nome.submeter(template_nome), _exigir_template
+    )
+
+
+@cache_consulta(
+    nome="template_por_nome",
+    maxsize=configs.CACHE_EMBEDDINGS_TAMANHO,
+    ttl_segundos=configs.CACHE_EMBEDDINGS_TTL_SEGUNDOS,
+    fonte_local=template_embedding_do_catalogo,
+    submeter=_buscar_template_embedding_por_nome,
+)
+def obter_template_embedding_por_nome(template_nome: str) -> np.ndarray:
+    return _buscar_template_embedding_por_nome(template_nome).result()
+
+
+def _carregar_templates_por_conteudo(textos: list[str]) -> dict[str, np.ndarray]:
+    """Embeddings dos textos já existentes em `templates_embeddings`."""
+    linhas = consultar(
+        """
+        SELECT content, embedding
+        FROM `ip_mensageria_camada_prata.templates_embeddings`
+        WHERE content IN UNNEST(@textos)
+        """,
+        job_config=parametros_lista("textos", textos),
+        nome="templates_por_texto",
+    )
+    embeddings: dict[str, np.ndarray] = {}
+    for linha in linhas:
+        embeddings.setdefault(
+            linha.content, np.array(linha.embedding, dtype=np.float32)
+        )
+    return embeddings
+
+
+# Só a consulta é agrupada entre requisições: a geração dos textos inéditos
+# fica com cada chamador, para que a falha de um texto não derrube os pedidos
+# de outros textos no mesmo lote.
+_carregador_templates_por_texto = CarregadorEmLote(
+    "template_embedding_por_texto", _carregar_templates_por_conteudo
+)
+
+
+def _obter_embeddings_por_conteudo(textos: Sequence[str]) -> dict[str, np.ndarray]:
+    """
+    Embeddings dos textos já existentes em `templates_embeddings`, em um só
+    job; os que não existirem lá são gerados em lote (ver
+    `gerar_embeddings_textos`).
+    """
+    embeddings = _carregar_templates_por_conteudo(list(textos))
+    faltantes = [texto for texto in textos if texto not in embeddings]
+    if faltantes:
+        embeddings.update(gerar_embeddings_textos(faltantes))
+    return embeddings
+
+
+@cache_consulta(
+    nome="template_por_texto",
+    maxsize=configs.CACHE_EMBEDDINGS_TAMANHO,
+    ttl_segundos=configs.CACHE_EMBEDDINGS_TTL_SEGUNDOS,
+    fonte_local=template_embedding_por_texto_do_catalogo,
+)
 def obter_template_embedding_por_texto(
     template_texto: str,
     botao0_texto: Optional[str] = None,
     botao1_texto: Optional[str] = None,
     botao2_texto: Optional[str] = None,
 ) -> np.ndarray:
+    texto = montar_texto_template(
+        template_texto, botao0_texto, botao1_texto, botao2_texto
+    )
+    embedding = _carregador_templates_por_texto.carregar(texto)
+    if embedding is not None:
+        return embedding
+    return gerar_embeddings_textos([texto])[texto]
+
+
+# argumentos de `obter_template_embedding_por_texto`
+ChaveTemplate = tuple[str, Optional[str], Optional[str], Optional[str]]
+
+
+def obter_template_embeddings_por_textos(
+    templates: Sequence[Template],
+) -> list[np.ndarray]:
     """
-    TODO: Substituir por chamada ao seu serviço de embeddings.
-    Enquanto isso, devolve zeros (mesmo d do treino).
+    Versão em lote de `obter_template_embedding_por_texto`: os templates que
+    não estiverem em cache são buscados em um único job e os inéditos são
+    gerados em uma única chamada. Os resultados alimentam o cache da versão
+    unitária.
     """
-    texto = "\n".join(
-        [
-            template_texto,
-            botao0_texto or "",
-            botao1_texto or "",
-            botao2_texto or "",
-        ]
+    chaves: list[ChaveTemplate] = [
+        (t.texto, t.botao0_texto, t.botao1_texto, t.botao2_texto) for t in templates
+    ]
+    resultados: dict[ChaveTemplate, Any] = {}
+    faltantes: dict[str, list[ChaveTemplate]] = {}
+    for chave in dict.fromkeys(chaves):
+        em_cache, embedding = obter_template_embedding_por_texto.consultar_cache(*chave)
+        if em_cache:
+            resultados[chave] = embedding
+        else:
+            faltantes.setdefault(montar_texto_template(*chave), []).append(chave)
+    if faltantes:
+        embeddings = _obter_embeddings_por_conteudo(list(faltantes))
+        for texto, chaves_texto in faltantes.items():
+            for chave in chaves_texto:
+                obter_template_embedding_por_texto.armazenar(embeddings[texto], *chave)
+                resultados[chave] = embeddings[texto]
+    return [resultados[chave] for chave in chaves]
+
+
+def _carregar_midias_por_uri(uris: list[str]) -> dict[str, np.ndarray]:
+    linhas = consultar(
+        """
+        SELECT ref.uri AS uri, embedding
+        FROM `ip_mensageria_camada_prata.templates_midias_embeddings`
+        WHERE ref.uri IN UNNEST(@uris)
+        """,
+        job_config=parametros_lista("uris", uris),
+        nome="midias_por_uri",
     )
-    resultado_query = make_bq_client().query(f"""
-        SELECT embedding
-        FROM `ip_mensageria_camada_prata.templates_embeddings`
-        WHERE content = '{texto}'
-    """)
-    if (
-        isinstance(resultado_query, _EmptyRowIterator)
-        or resultado_query.total_rows == 0
-    ):
-        resultado_query = (
-            make_bq_client()
-            .query(f"""
-            SELECT embedding
-            FROM AI.GENERATE_EMBEDDING(
-                MODEL `modelos.multimodalembedding`,
-                (SELECT '{texto}' as content),
-                STRUCT(128 AS output_dimensionality)
-            );
-        """)
-            .result()
-        )
-        if (
-            isinstance(resultado_query, _EmptyRowIterator)
-            or resultado_query.total_rows == 0
-        ):
-            raise HTTPException(
-                status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
-                detail=(
-                    "Internal Server Error :: Não foi possível obter o embedding.",
-                ),
-            )
-    return np.array(next(resultado_query).embedding, dtype=float)
+    embeddings: dict[str, np.ndarray] = {}
+    for linha in linhas:
+        embeddings.setdefault(linha.uri, np.array(linha.embedding, dtype=np.float32))
+    return embeddings
+
+
+def _carregar_uris_por_url_turn(urls: list[str]) -> dict[str, list[str]]:
+    linhas = consultar(
+        f"""
+        SELECT url_turn, gcs_referencia.uri AS uri
+        FROM `{BQ_PROJETO}.ip_mensageria_camada_bronze.templates_midias`
+        WHERE url_turn IN UNNEST(@urls)
+        """,
+        job_config=parametros_lista("urls", urls),
+        nome="uris_por_url_turn",
+    )
+    # normalizadas aqui, e não com REGEXP_REPLACE em um JOIN da tabela toda
+    uris: dict[str, list[str]] = {}
+    for linha in linhas:
+        if linha.uri:
+            uris.setdefault(linha.url_turn, []).append(normalizar_uri_midia(linha.uri))
+    return uris
+
+
+_carregador_midias_por_uri = CarregadorEmLote(
+    "midia_embedding_por_uri", _carregar_midias_por_uri
+)
+_carregador_uris_por_url_turn = CarregadorEmLote(
+    "midia_uri_por_url_turn", _carregar_uris_por_url_turn
+)
+
 
+def _midia_embedding_por_uris(uris: Sequence[str]) -> Optional[np.ndarray]:
+    catalogo = obter_catalogo_embeddings()
+    for uri in uris:
+        embedding = None if catalogo is None else catalogo.midia_por_url(uri)
+        if embedding is None:
+            embedding = _carregador_midias_por_uri.carregar(uri)
+        if embedding is not None:
+            return embedding
+    return None
 
-@lru_cache(maxsize=128)
+
+@cache_consulta(
+    nome="midia",
+    maxsize=configs.CACHE_EMBEDDINGS_TAMANHO,
+    ttl_segundos=configs.CACHE_EMBEDDINGS_TTL_SEGUNDOS,
+    fonte_local=midia_embedding_do_catalogo,
+)
 def obter_midia_embedding(url: Optional[AnyUrl]) -> np.ndarray:
     if str(url).startswith("gs://"):
-        resultado_query = (
-            make_bq_client()
-            .query(f"""
-            SELECT embedding
-            FROM `ip_mensageria_camada_prata.templates_midias_embeddings`
-            WHERE ref.uri = '{url}'
-        """)
-            .result()
-        )
+        uris = [str(url)]
     elif str(url).startswith("http"):
-        resultado_query = (
-            make_bq_client()
-            .query(f"""
-            SELECT embedding
-            FROM `{BQ_PROJETO}.ip_mensageria_camada_prata.templates_midias_embeddings` e
-            INNER JOIN `{BQ_PROJETO}.ip_mensageria_camada_bronze.templates_midias` t
-                ON REGEXP_REPLACE(t.gcs_referencia.uri, r'ip-mensageria-turn-midias/ip-mensageria-turn-midias/o/', 'ip-mensageria-turn-midias/') = e.ref.uri
-            WHERE t.url_turn = '{url}'
-        """)
-            .result()
-        )
+        uris = _carregador_uris_por_url_turn.carregar(str(url)) or []
     else:
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
             detail="Bad Request :: O schema da URL não é válido.",
         )
-    if (
-        isinstance(resultado_query, _EmptyRowIterator)
-        or resultado_query.total_rows == 0
-    ):
+    embedding = _midia_embedding_por_uris(uris)
+    if embedding is None:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND,
             detail=(
@@ -347,7 +711,7 @@ def obter_midia_embedding(url: Optional[AnyUrl]) -> np.ndarray:
                 "embedding da mídia com a URL fornecida.",
             ),
         )
-    return np.array(next(resultado_query).embedding, dtype=float)
+    return embedding
 
 
 def converter_df_em_pool(df: pd.DataFrame, classificadores: Classificador) -> Pool:
@@ -359,6 +723,48 @@ def converter_df_em_pool(df: pd.DataFrame, classificadores: Classificador) -> Po
     return Pool(df, cat_features=cat_idx)
 
 
+def converter_matriz_em_pool(
+    matriz: np.ndarray,
+    classificadores: Classificador,
+) -> Pool:
+    cat_idx = [
+        classificadores.atributos_colunas.index(c)
+        for c in classificadores.atributos_categoricos
+        if c in classificadores.atributos_colunas
+    ]
+    return Pool(
+        matriz,
+        cat_features=cat_idx,
+        feature_names=list(classificadores.atributos_colunas),
+    )
+
+
+def avaliar_ensemble(pool: Pool, classificadores: Classificador) -> np.ndarray:
+    """
+    Devolve a probabilidade da classe positiva de cada modelo do ensemble
+    para cada linha do `pool`, em uma matriz (modelos x linhas). Os modelos
+    são avaliados em paralelo quando há mais de uma thread configurada; o
+    CatBoost libera o GIL durante a predição.
+    """
+    thread_count = num_threads_por_modelo()
+
+    def prever(modelo: Any) -> np.ndarray:
+        return np.asarray(modelo.predict_proba(pool, thread_count=thread_count))[:, 1]
+
+    executor = obter_executor_ensemble()
+    if executor is None or len(classificadores.modelos) <= 1:
+        return np.array([prever(m) for m in classificadores.modelos], dtype=float)
+    return np.array(list(executor.map(prever, classificadores.modelos)), dtype=float)
+
+
 def thompson_sample(p: float, se: float) -> float:
     a, b = beta_from_mean_se(p, se)
     return float(np.random.beta(a, b))
+
+
+def thompson_sample_vetorizado(
+    p: ndarray[Any, dtype[Any]],
+    se: ndarray[Any, dtype[Any]],
+) -> ndarray[Any, dtype[np.float64]]:
+    a, b = beta_from_mean_se_vetorizado(p, se)
+    return np.random.beta(a, b)
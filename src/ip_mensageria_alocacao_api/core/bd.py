@@ -1,31 +1,198 @@
+import threading
+import time
+from contextvars import ContextVar
+from datetime import date
 from pathlib import Path
+from typing import Optional, Sequence
 
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import bigquery
+from google.cloud.bigquery import QueryJob
+from google.cloud.bigquery.table import RowIterator
 from google.oauth2 import service_account
+from requests.adapters import HTTPAdapter
 
 from ip_mensageria_alocacao_api.core.configs import (
+    BQ_POOL_CONEXOES,
     BQ_PROJETO,
+    BQ_TIMEOUT_API_SEGUNDOS,
+    BQ_TIMEOUT_SEGUNDOS,
     GOOGLE_ARQUIVO_CREDENCIAIS,
 )
 
 _bq_client = None
+_trava_cliente = threading.Lock()
 
 
-def make_bq_client() -> bigquery.Client:
-    global _bq_client
-
-    if _bq_client is not None:
-        return _bq_client
-
+def _criar_sessao_http() -> AuthorizedSession:
     # Em dev/local, pode haver um arquivo de service account montado no container.
     if GOOGLE_ARQUIVO_CREDENCIAIS and Path(GOOGLE_ARQUIVO_CREDENCIAIS).exists():
         credentials = service_account.Credentials.from_service_account_file(
             GOOGLE_ARQUIVO_CREDENCIAIS,
+            scopes=bigquery.Client.SCOPE,
         )
-        _bq_client = bigquery.Client(project=BQ_PROJETO, credentials=credentials)
-
     # No Cloud Run, use Application Default Credentials (Workload Identity).
     else:
-        _bq_client = bigquery.Client(project=BQ_PROJETO)
+        credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+
+    # O pool padrão do requests guarda só 10 conexões: com mais consultas
+    # simultâneas, as excedentes abririam uma conexão TLS nova a cada chamada.
+    sessao = AuthorizedSession(credentials)
+    adaptador = HTTPAdapter(
+        pool_connections=BQ_POOL_CONEXOES,
+        pool_maxsize=BQ_POOL_CONEXOES,
+    )
+    sessao.mount("https://", adaptador)
+    return sessao
+
 
+def make_bq_client() -> bigquery.Client:
+    global _bq_client
+
+    if _bq_client is not None:
+        return _bq_client
+
+    # um único cliente (e pool de conexões) por processo, mesmo se várias
+    # threads chegarem aqui ao mesmo tempo
+    with _trava_cliente:
+        if _bq_client is None:
+            _bq_client = bigquery.Client(
+                project=BQ_PROJETO,
+                _http=_criar_sessao_http(),
+                # consultas curtas rodam sem criar job (jobs.query), em uma
+                # única chamada HTTP
+                default_job_creation_mode="JOB_CREATION_OPTIONAL",
+            )
     return _bq_client
+
+
+def consultar(
+    query: str,
+    job_config: Optional[bigquery.QueryJobConfig] = None,
+    *,
+    nome: Optional[str] = None,
+    page_size: Optional[int] = None,
+    timeout: Optional[float] = BQ_TIMEOUT_SEGUNDOS,
+) -> RowIterator:
+    """
+    Executa `query` com `query_and_wait`: resultados pequenos voltam na
+    própria resposta, sem inserir um job e consultar seu estado depois.
+    `timeout` limita a espera pelo resultado (`None` espera sem limite, para
+    exportações); cada chamada HTTP é limitada por BQ_TIMEOUT_API_SEGUNDOS.
+    Os custos são contabilizados sob `nome` (ver `estatisticas_consultas`).
+    """
+    inicio = time.monotonic()
+    try:
+        resultado = make_bq_client().query_and_wait(
+            query,
+            job_config=job_config,
+            api_timeout=BQ_TIMEOUT_API_SEGUNDOS,
+            wait_timeout=timeout,
+            page_size=page_size,
+        )
+    except Exception:
+        _contabilizar(nome, time.monotonic() - inicio, erro=True)
+        raise
+    registrar_consulta(nome, resultado, time.monotonic() - inicio)
+    return resultado
+
+
+# Endpoint da requisição em andamento. Os executores propagam o contexto
+# para as threads de consulta; consultas agrupadas em lote são atribuídas à
+# requisição que despachou o lote.
+_endpoint_atual: ContextVar[str] = ContextVar("endpoint", default="segundo_plano")
+_custos: dict[tuple[str, str], dict[str, int]] = {}
+_trava_custos = threading.Lock()
+
+
+def definir_endpoint(endpoint: str) -> None:
+    _endpoint_atual.set(endpoint)
+
+
+def _contabilizar(
+    nome: Optional[str],
+    duracao_segundos: float,
+    *,
+    erro: bool = False,
+    job: bool = False,
+    em_cache: bool = False,
+    bytes_processados: int = 0,
+    slot_ms: int = 0,
+) -> None:
+    chave = (nome or "outras", _endpoint_atual.get())
+    with _trava_custos:
+        custos = _custos.setdefault(
+            chave,
+            dict.fromkeys(
+                (
+                    "consultas",
+                    "erros",
+                    "jobs",
+                    "em_cache",
+                    "bytes_processados",
+                    "slot_ms",
+                    "duracao_ms",
+                ),
+                0,
+            ),
+        )
+        custos["consultas"] += 1
+        custos["erros"] += erro
+        custos["jobs"] += job
+        custos["em_cache"] += em_cache
+        custos["bytes_processados"] += bytes_processados
+        custos["slot_ms"] += slot_ms
+        custos["duracao_ms"] += round(duracao_segundos * 1000)
+
+
+def registrar_consulta(
+    nome: Optional[str],
+    resultado: RowIterator | QueryJob,
+    duracao_segundos: float,
+) -> None:
+    """
+    Contabiliza bytes processados, tempo de slot e jobs de uma consulta
+    concluída. Consultas respondidas pelo cache do BigQuery não são cobradas
+    e voltam com 0 bytes processados; só jobs informam `cache_hit`.
+    """
+    bytes_processados = resultado.total_bytes_processed or 0
+    cache_hit = getattr(resultado, "cache_hit", None)
+    _contabilizar(
+        nome,
+        duracao_segundos,
+        # consultas sem job (jobs.query) voltam sem job_id
+        job=resultado.job_id is not None,
+        em_cache=bool(cache_hit) if cache_hit is not None else not bytes_processados,
+        bytes_processados=bytes_processados,
+        slot_ms=resultado.slot_millis or 0,
+    )
+
+
+def estatisticas_consultas() -> dict[str, dict[str, dict[str, int]]]:
+    """Custos acumulados no processo, por consulta e por endpoint."""
+    relatorio: dict[str, dict[str, dict[str, int]]] = {
+        "por_consulta": {},
+        "por_endpoint": {},
+    }
+    with _trava_custos:
+        for (nome, endpoint), custos in _custos.items():
+            for visao, chave in (("por_consulta", nome), ("por_endpoint", endpoint)):
+                total = relatorio[visao].setdefault(chave, dict.fromkeys(custos, 0))
+                for campo, valor in custos.items():
+                    total[campo] += valor
+    return relatorio
+
+
+def parametros_lista(nome: str, valores: Sequence[str]) -> bigquery.QueryJobConfig:
+    """Configuração de job com `@<nome>` como parâmetro ARRAY<STRING>."""
+    return bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter(nome, "STRING", list(valores))]
+    )
+
+
+def parametros_data(nome: str, valor: date) -> bigquery.QueryJobConfig:
+    """Configuração de job com `@<nome>` como parâmetro DATE."""
+    return bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter(nome, "DATE", valor)]
+    )
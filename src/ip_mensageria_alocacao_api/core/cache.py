@@ -0,0 +1,664 @@
+from __future__ import annotations
+
+import functools
+import inspect
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from http import HTTPStatus
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Iterator,
+    NamedTuple,
+    Optional,
+    ParamSpec,
+    Protocol,
+    TypeVar,
+    cast,
+)
+
+from fastapi import HTTPException
+
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.futuros import concluido, encadear, falho
+
+P = ParamSpec("P")
+R = TypeVar("R")
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+    # chamadas que aguardaram uma execução já em andamento para a mesma chave
+    compartilhadas: int = 0
+    # hits de chaves sabidamente inexistentes (ver `Ausencia`)
+    hits_negativos: int = 0
+
+
+# Resposta de uma `fonte_local` para "não sei", quando `None` é um resultado
+# válido da função (ver `ausente_na_fonte_local`).
+FORA_DA_FONTE_LOCAL: Any = object()
+
+
+class Ausencia(NamedTuple):
+    """
+    Entrada de cache para uma chave não encontrada. Guarda o suficiente para
+    recriar a exceção original (404 ou `AssertionError`) sem consultar de novo.
+    """
+
+    status_code: Optional[int]
+    detalhe: Any
+
+    @classmethod
+    def de_excecao(cls, exc: BaseException) -> Optional[Ausencia]:
+        if isinstance(exc, HTTPException) and exc.status_code == HTTPStatus.NOT_FOUND:
+            return cls(exc.status_code, exc.detail)
+        if isinstance(exc, AssertionError):
+            return cls(None, exc.args)
+        return None
+
+    def levantar(self) -> None:
+        if self.status_code is not None:
+            raise HTTPException(status_code=self.status_code, detail=self.detalhe)
+        raise AssertionError(*self.detalhe)
+
+
+class BackendCache(Protocol):
+    """Armazenamento de um cache: chaves em texto, validade em segundos."""
+
+    def obter(self, chave: str) -> tuple[bool, Any]: ...
+
+    def guardar(
+        self, chave: str, valor: Any, ttl_segundos: Optional[float]
+    ) -> None: ...
+
+    def limpar(self) -> None: ...
+
+    def tamanho(self) -> int: ...
+
+
+def _expiracao(ttl_segundos: Optional[float]) -> Optional[float]:
+    return None if ttl_segundos is None else time.time() + ttl_segundos
+
+
+class BackendMemoria:
+    """LRU na memória do processo, com validade por entrada."""
+
+    def __init__(self, maxsize: int) -> None:
+        self._maxsize = maxsize
+        self._entradas: OrderedDict[str, tuple[Any, Optional[float]]] = OrderedDict()
+        self._trava = threading.Lock()
+
+    def obter(self, chave: str) -> tuple[bool, Any]:
+        with self._trava:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                return False, None
+            valor, expira_em = entrada
+            if expira_em is not None and expira_em <= time.time():
+                del self._entradas[chave]
+                return False, None
+            self._entradas.move_to_end(chave)
+            return True, valor
+
+    def guardar(self, chave: str, valor: Any, ttl_segundos: Optional[float]) -> None:
+        with self._trava:
+            self._entradas[chave] = (valor, _expiracao(ttl_segundos))
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self._maxsize:
+                self._entradas.popitem(last=False)
+
+    def exportar(self) -> list[tuple[str, Any, Optional[float]]]:
+        """Entradas válidas como (chave, valor, expira_em), da menos usada à mais."""
+        agora = time.time()
+        with self._trava:
+            return [
+                (chave, valor, expira_em)
+                for chave, (valor, expira_em) in self._entradas.items()
+                if expira_em is None or expira_em > agora
+            ]
+
+    def importar(self, entradas: list[tuple[str, Any, Optional[float]]]) -> int:
+        """Restaura entradas de `exportar`, sem sobrescrever as já presentes."""
+        agora = time.time()
+        importadas = 0
+        with self._trava:
+            # entram como as menos usadas, preservando a ordem do snapshot
+            for chave, valor, expira_em in reversed(entradas):
+                if chave in self._entradas:
+                    continue
+                if expira_em is not None and expira_em <= agora:
+                    continue
+                self._entradas[chave] = (valor, expira_em)
+                self._entradas.move_to_end(chave, last=False)
+                importadas += 1
+            while len(self._entradas) > self._maxsize:
+                self._entradas.popitem(last=False)
+        return importadas
+
+    def limpar(self) -> None:
+        with self._trava:
+            self._entradas.clear()
+
+    def tamanho(self) -> int:
+        with self._trava:
+            return len(self._entradas)
+
+
+class BackendDisco:
+    """
+    Cache em um arquivo SQLite local, compartilhado entre os workers do
+    gunicorn de uma mesma instância. Cada cache usa o seu `nome` como
+    namespace; acima de `maxsize` entradas, as acessadas há mais tempo são
+    removidas.
+
+    Leituras não gravam no arquivo: cada thread tem a sua conexão (o modo WAL
+    permite leituras simultâneas) e os horários de acesso ficam em memória
+    até a próxima gravação, quando são atualizados de uma vez.
+    """
+
+    # remoção de excedentes a cada N gravações, para não pagar a cada uma
+    _INTERVALO_LIMPEZA = 256
+
+    def __init__(self, caminho: str | Path, nome: str, maxsize: int) -> None:
+        self._caminho = Path(caminho)
+        self._caminho.parent.mkdir(parents=True, exist_ok=True)
+        self._nome = nome
+        self._maxsize = maxsize
+        self._gravacoes = 0
+        self._trava = threading.Lock()
+        self._local = threading.local()
+        self._conexoes: list[sqlite3.Connection] = []
+        # chave -> último acesso ainda não gravado
+        self._acessos: dict[str, float] = {}
+        with self._conexao() as conexao:
+            conexao.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache (
+                    nome TEXT NOT NULL,
+                    chave TEXT NOT NULL,
+                    valor BLOB NOT NULL,
+                    expira_em REAL,
+                    acessado_em REAL NOT NULL,
+                    PRIMARY KEY (nome, chave)
+                )
+                """
+            )
+
+    @contextmanager
+    def _conexao(self) -> Iterator[sqlite3.Connection]:
+        conexao = getattr(self._local, "conexao", None)
+        if conexao is None:
+            conexao = sqlite3.connect(self._caminho, timeout=5, check_same_thread=False)
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexao = conexao
+            with self._trava:
+                self._conexoes.append(conexao)
+        with conexao:
+            yield conexao
+
+    def fechar(self) -> None:
+        with self._trava:
+            conexoes, self._conexoes = self._conexoes, []
+        for conexao in conexoes:
+            conexao.close()
+        self._local = threading.local()
+
+    def obter(self, chave: str) -> tuple[bool, Any]:
+        agora = time.time()
+        with self._conexao() as conexao:
+            linha = conexao.execute(
+                "SELECT valor, expira_em FROM cache WHERE nome = ? AND chave = ?",
+                (self._nome, chave),
+            ).fetchone()
+        if linha is None:
+            return False, None
+        valor, expira_em = linha
+        # expiradas são apagadas na próxima limpeza
+        if expira_em is not None and expira_em <= agora:
+            return False, None
+        with self._trava:
+            self._acessos[chave] = agora
+        return True, pickle.loads(valor)
+
+    def guardar(self, chave: str, valor: Any, ttl_segundos: Optional[float]) -> None:
+        dados = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._trava:
+            acessos, self._acessos = self._acessos, {}
+            self._gravacoes += 1
+            limpar = self._gravacoes % self._INTERVALO_LIMPEZA == 0
+        with self._conexao() as conexao:
+            conexao.executemany(
+                "UPDATE cache SET acessado_em = MAX(acessado_em, ?) "
+                "WHERE nome = ? AND chave = ?",
+                [
+                    (instante, self._nome, acessada)
+                    for acessada, instante in acessos.items()
+                ],
+            )
+            conexao.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (self._nome, chave, dados, _expiracao(ttl_segundos), time.time()),
+            )
+            if limpar:
+                self._remover_excedentes(conexao)
+
+    def _remover_excedentes(self, conexao: sqlite3.Connection) -> None:
+        conexao.execute(
+            "DELETE FROM cache WHERE nome = ? AND expira_em <= ?",
+            (self._nome, time.time()),
+        )
+        conexao.execute(
+            """
+            DELETE FROM cache WHERE nome = ? AND chave NOT IN (
+                SELECT chave FROM cache WHERE nome = ?
+                ORDER BY acessado_em DESC LIMIT ?
+            )
+            """,
+            (self._nome, self._nome, self._maxsize),
+        )
+
+    def limpar(self) -> None:
+        with self._trava:
+            self._acessos.clear()
+        with self._conexao() as conexao:
+            conexao.execute("DELETE FROM cache WHERE nome = ?", (self._nome,))
+
+    def tamanho(self) -> int:
+        with self._conexao() as conexao:
+            (total,) = conexao.execute(
+                "SELECT COUNT(*) FROM cache WHERE nome = ?", (self._nome,)
+            ).fetchone()
+        return int(total)
+
+
+class BackendRedis:
+    """
+    Cache em um servidor compatível com Redis (Redis, Valkey, Memorystore ou
+    uma instância local), compartilhado entre workers e instâncias. A
+    capacidade fica a cargo da política `maxmemory` do servidor.
+
+    Requer o pacote `redis`, que não é instalado por padrão.
+    """
+
+    # contar as chaves percorre todo o keyspace: o resultado vale por um tempo
+    _TAMANHO_VALIDADE_SEGUNDOS = 60.0
+
+    def __init__(self, url: str, nome: str, cliente: Any = None) -> None:
+        if cliente is None:
+            try:
+                import redis
+            except ImportError as exc:
+                raise RuntimeError(
+                    "CACHE_BACKEND=redis requer o pacote `redis` instalado"
+                ) from exc
+            cliente = redis.Redis.from_url(url)
+        self._cliente = cliente
+        self._prefixo = f"ip_mensageria:{nome}:"
+        self._tamanho: Optional[tuple[float, int]] = None
+
+    def obter(self, chave: str) -> tuple[bool, Any]:
+        dados = self._cliente.get(self._prefixo + chave)
+        if dados is None:
+            return False, None
+        return True, pickle.loads(dados)
+
+    def guardar(self, chave: str, valor: Any, ttl_segundos: Optional[float]) -> None:
+        dados = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+        if ttl_segundos is None:
+            self._cliente.set(self._prefixo + chave, dados)
+        else:
+            milissegundos = max(1, int(ttl_segundos * 1000))
+            self._cliente.set(self._prefixo + chave, dados, px=milissegundos)
+
+    def limpar(self) -> None:
+        chaves = list(self._cliente.scan_iter(match=self._prefixo + "*"))
+        if chaves:
+            self._cliente.delete(*chaves)
+        self._tamanho = None
+
+    def tamanho(self) -> int:
+        agora = time.monotonic()
+        if self._tamanho is not None:
+            contado_em, tamanho = self._tamanho
+            if agora - contado_em < self._TAMANHO_VALIDADE_SEGUNDOS:
+                return tamanho
+        tamanho = sum(1 for _ in self._cliente.scan_iter(match=self._prefixo + "*"))
+        self._tamanho = (agora, tamanho)
+        return tamanho
+
+
+def criar_backend(nome: str, maxsize: int) -> BackendCache:
+    """Backend configurado em `CACHE_BACKEND` (memoria, disco ou redis)."""
+    if configs.CACHE_BACKEND == "memoria":
+        return BackendMemoria(maxsize)
+    if configs.CACHE_BACKEND == "disco":
+        return BackendDisco(configs.CACHE_DISCO_CAMINHO, nome, maxsize)
+    if configs.CACHE_BACKEND == "redis":
+        return BackendRedis(configs.CACHE_REDIS_URL, nome)
+    raise RuntimeError(f"CACHE_BACKEND desconhecido: {configs.CACHE_BACKEND}")
+
+
+# referências fracas: caches criados fora do nível de módulo (ex.: testes)
+# deixam as estatísticas quando são descartados
+_caches: weakref.WeakSet[FuncaoEmCache] = weakref.WeakSet()
+
+
+class FuncaoEmCache(Generic[P, R]):
+    """
+    Equivalente a `functools.lru_cache`, mas que permite consultar se um
+    resultado já está em cache sem executar a função (ver `consultar_cache`).
+    Os argumentos são normalizados pela assinatura da função, de modo que
+    chamadas posicionais e nomeadas compartilham a mesma entrada.
+
+    As entradas valem por `ttl_segundos` (para sempre, se `None`) e ficam no
+    backend configurado em `CACHE_BACKEND`. Chaves não encontradas (404 ou
+    `AssertionError`) também são guardadas, por `ttl_negativo_segundos`, e
+    voltam a levantar a mesma exceção sem executar a função.
+
+    Se `fonte_local` for informada, ela é consultada antes do cache com os
+    mesmos argumentos; um resultado diferente de `ausente_na_fonte_local`
+    (`None`, por padrão) é devolvido direto, sem ocupar entradas do cache.
+    Para funções que podem devolver `None`, use `FORA_DA_FONTE_LOCAL`.
+
+    Chamadas concorrentes com a mesma chave executam a função uma única vez:
+    as demais aguardam o resultado (ou a exceção) da que chegou primeiro.
+
+    Se `submeter` for informada, ela é a versão da função que devolve um
+    `Future` sem bloquear (ex.: registrando a chave em um `CarregadorEmLote`),
+    e habilita o método `submeter`.
+    """
+
+    def __init__(
+        self,
+        funcao: Callable[P, R],
+        maxsize: int,
+        fonte_local: Callable[..., R | None] | None = None,
+        nome: Optional[str] = None,
+        ttl_segundos: Optional[float] = None,
+        ttl_negativo_segundos: Optional[float] = None,
+        backend: Optional[BackendCache] = None,
+        ausente_na_fonte_local: Any = None,
+        submeter: Optional[Callable[P, Future[R]]] = None,
+    ) -> None:
+        functools.update_wrapper(self, funcao)
+        self._funcao = funcao
+        self._submeter = submeter
+        self._fonte_local = fonte_local
+        self._ausente_na_fonte_local = ausente_na_fonte_local
+        self._assinatura = inspect.signature(funcao)
+        self.nome = nome or funcao.__name__
+        self._maxsize = maxsize
+        self._ttl_segundos = ttl_segundos
+        self._ttl_negativo_segundos = (
+            configs.CACHE_TTL_NEGATIVO_SEGUNDOS
+            if ttl_negativo_segundos is None
+            else ttl_negativo_segundos
+        )
+        self._backend = backend or criar_backend(self.nome, maxsize)
+        self._trava = threading.Lock()
+        self._em_andamento: dict[str, Future[R]] = {}
+        self._hits = 0
+        self._misses = 0
+        self._compartilhadas = 0
+        self._hits_negativos = 0
+        _caches.add(self)
+
+    def _chave(self, args: tuple[Any, ...], kwargs: dict[str, Any]) -> str:
+        argumentos = self._assinatura.bind(*args, **kwargs)
+        argumentos.apply_defaults()
+        return repr(tuple(argumentos.arguments.values()))
+
+    def _buscar(self, chave: str) -> tuple[bool, Any]:
+        try:
+            return self._backend.obter(chave)
+        except Exception:
+            # um cache indisponível não deve derrubar a consulta
+            logger.exception(f"Falha ao ler o cache {self.nome}")
+            return False, None
+
+    def _guardar(self, chave: str, valor: Any, ttl_segundos: Optional[float]) -> None:
+        try:
+            self._backend.guardar(chave, valor, ttl_segundos)
+        except Exception:
+            logger.exception(f"Falha ao gravar no cache {self.nome}")
+
+    def consultar_cache(
+        self, *args: P.args, **kwargs: P.kwargs
+    ) -> tuple[bool, R | None]:
+        if self._fonte_local is not None:
+            local = self._fonte_local(*args, **kwargs)
+            if local is not self._ausente_na_fonte_local:
+                return True, local
+        encontrado, valor = self._buscar(self._chave(args, kwargs))
+        # ausências ficam para `__call__`, que levanta a exceção guardada
+        if not encontrado or isinstance(valor, Ausencia):
+            return False, None
+        with self._trava:
+            self._hits += 1
+        return True, valor
+
+    def __call__(self, *args: P.args, **kwargs: P.kwargs) -> R:
+        if self._fonte_local is not None:
+            local = self._fonte_local(*args, **kwargs)
+            if local is not self._ausente_na_fonte_local:
+                return cast(R, local)
+        chave = self._chave(args, kwargs)
+        encontrado, valor = self._buscar(chave)
+        if encontrado:
+            if isinstance(valor, Ausencia):
+                with self._trava:
+                    self._hits_negativos += 1
+                valor.levantar()
+            with self._trava:
+                self._hits += 1
+            return valor
+
+        with self._trava:
+            futuro = self._em_andamento.get(chave)
+            if futuro is None:
+                futuro = Future()
+                self._em_andamento[chave] = futuro
+                self._misses += 1
+                primeira = True
+            else:
+                self._compartilhadas += 1
+                primeira = False
+        if not primeira:
+            return futuro.result()
+
+        try:
+            resultado = self._funcao(*args, **kwargs)
+        except BaseException as exc:
+            self._finalizar(chave, futuro, None, exc)
+            raise
+        self._finalizar(chave, futuro, resultado, None)
+        return resultado
+
+    @property
+    def submete_sem_bloquear(self) -> bool:
+        return self._submeter is not None
+
+    def submeter(self, *args: P.args, **kwargs: P.kwargs) -> Future[R]:
+        """
+        Como `__call__`, mas devolve um `Future` do resultado em vez de
+        bloquear. Exige a versão `submeter` da função.
+        """
+        assert self._submeter is not None, f"{self.nome} não aceita submeter"
+        if self._fonte_local is not None:
+            local = self._fonte_local(*args, **kwargs)
+            if local is not self._ausente_na_fonte_local:
+                return concluido(cast(R, local))
+        chave = self._chave(args, kwargs)
+        encontrado, valor = self._buscar(chave)
+        if encontrado:
+            if isinstance(valor, Ausencia):
+                with self._trava:
+                    self._hits_negativos += 1
+                try:
+                    valor.levantar()
+                except BaseException as exc:
+                    return falho(exc)
+            with self._trava:
+                self._hits += 1
+            return concluido(valor)
+
+        with self._trava:
+            futuro = self._em_andamento.get(chave)
+            if futuro is not None:
+                self._compartilhadas += 1
+                return futuro
+            futuro = Future()
+            self._em_andamento[chave] = futuro
+            self._misses += 1
+
+        def concluir(interno: Future[R]) -> None:
+            excecao = interno.exception()
+            resultado = interno.result() if excecao is None else None
+            self._finalizar(chave, futuro, resultado, excecao)
+
+        try:
+            interno = self._submeter(*args, **kwargs)
+        except BaseException as exc:
+            self._finalizar(chave, futuro, None, exc)
+            return futuro
+        interno.add_done_callback(concluir)
+        return futuro
+
+    def _finalizar(
+        self,
+        chave: str,
+        futuro: Future[R],
+        resultado: Any,
+        excecao: Optional[BaseException],
+    ) -> None:
+        if excecao is None:
+            self._guardar(chave, resultado, self._ttl_segundos)
+        else:
+            ausencia = Ausencia.de_excecao(excecao)
+            if ausencia is not None:
+                self._guardar(chave, ausencia, self._ttl_negativo_segundos)
+        with self._trava:
+            del self._em_andamento[chave]
+        if excecao is None:
+            futuro.set_result(resultado)
+        else:
+            futuro.set_exception(excecao)
+
+    def armazenar(self, resultado: R, *args: P.args, **kwargs: P.kwargs) -> None:
+        """Guarda `resultado` como se fosse o retorno da chamada com esses argumentos."""
+        self._guardar(self._chave(args, kwargs), resultado, self._ttl_segundos)
+
+    def exportar_entradas(self) -> list[tuple[str, Any, Optional[float]]]:
+        """
+        Entradas para um snapshot. Só o backend em memória é exportado: os
+        demais já sobrevivem ao reinício do processo.
+        """
+        if isinstance(self._backend, BackendMemoria):
+            return self._backend.exportar()
+        return []
+
+    def importar_entradas(
+        self, entradas: list[tuple[str, Any, Optional[float]]]
+    ) -> int:
+        if isinstance(self._backend, BackendMemoria):
+            return self._backend.importar(entradas)
+        return 0
+
+    def cache_info(self) -> CacheInfo:
+        tamanho = self._backend.tamanho()
+        with self._trava:
+            return CacheInfo(
+                self._hits,
+                self._misses,
+                self._maxsize,
+                tamanho,
+                self._compartilhadas,
+                self._hits_negativos,
+            )
+
+    def cache_clear(self) -> None:
+        self._backend.limpar()
+        with self._trava:
+            self._hits = 0
+            self._misses = 0
+            self._compartilhadas = 0
+            self._hits_negativos = 0
+
+
+class FuncaoDerivada(Generic[P, T, R]):
+    """
+    Aplica `derivar` ao resultado de uma `FuncaoEmCache` a cada chamada. Para
+    valores que dependem do momento da consulta (como a idade, a partir da
+    data de nascimento): o cache guarda só o dado estável.
+    """
+
+    def __init__(self, base: FuncaoEmCache[P, T], derivar: Callable[[T], R]) -> None:
+        functools.update_wrapper(self, base)
+        self.base = base
+        self._derivar = derivar
+
+    def consultar_cache(
+        self, *args: P.args, **kwargs: P.kwargs
+    ) -> tuple[bool, R | None]:
+        encontrado, valor = self.base.consultar_cache(*args, **kwargs)
+        if not encontrado:
+            return False, None
+        return True, self._derivar(cast(T, valor))
+
+    def __call__(self, *args: P.args, **kwargs: P.kwargs) -> R:
+        return self._derivar(self.base(*args, **kwargs))
+
+    @property
+    def submete_sem_bloquear(self) -> bool:
+        return self.base.submete_sem_bloquear
+
+    def submeter(self, *args: P.args, **kwargs: P.kwargs) -> Future[R]:
+        return encadear(self.base.submeter(*args, **kwargs), self._derivar)
+
+
+def cache_consulta(
+    maxsize: int = 128,
+    fonte_local: Callable[..., Any] | None = None,
+    nome: Optional[str] = None,
+    ttl_segundos: Optional[float] = None,
+    ttl_negativo_segundos: Optional[float] = None,
+    ausente_na_fonte_local: Any = None,
+    submeter: Optional[Callable[..., Future[Any]]] = None,
+) -> Callable[[Callable[P, R]], FuncaoEmCache[P, R]]:
+    def decorator(funcao: Callable[P, R]) -> FuncaoEmCache[P, R]:
+        return FuncaoEmCache(
+            funcao,
+            maxsize,
+            fonte_local,
+            nome=nome,
+            ttl_segundos=ttl_segundos,
+            ttl_negativo_segundos=ttl_negativo_segundos,
+            ausente_na_fonte_local=ausente_na_fonte_local,
+            submeter=submeter,
+        )
+
+    return decorator
+
+
+def caches_registrados() -> list[FuncaoEmCache]:
+    return sorted(_caches, key=lambda cache: cache.nome)
+
+
+def estatisticas_caches() -> dict[str, dict[str, int]]:
+    return {cache.nome: cache.cache_info()._asdict() for cache in caches_registrados()}
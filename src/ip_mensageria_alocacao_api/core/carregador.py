@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import contextvars
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Generic, Hashable, Optional, TypeVar
+
+from ip_mensageria_alocacao_api.core import configs
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+logger = logging.getLogger(__name__)
+
+_carregadores: list[CarregadorEmLote] = []
+
+
+class CarregadorEmLote(Generic[K, V]):
+    """
+    Agrupa as chaves pedidas por requisições concorrentes dentro de uma janela
+    curta e as busca com uma única chamada a `carregar_lote`, devolvendo a
+    cada chamador o seu resultado (ou `None`, se a chave não foi encontrada).
+
+    As chaves são registradas por `submeter` na thread de quem chama, sem
+    ocupá-la: um timer despacha o lote ao fim de `janela_segundos`, ou assim
+    que ele atinge `max_lote` chaves. Assim o tamanho do lote não fica
+    limitado ao número de threads que aguardam. Pedidos simultâneos da mesma
+    chave compartilham a mesma busca.
+    """
+
+    def __init__(
+        self,
+        nome: str,
+        carregar_lote: Callable[[list[K]], dict[K, V]],
+        janela_segundos: Optional[float] = None,
+        max_lote: Optional[int] = None,
+    ) -> None:
+        self.nome = nome
+        self._carregar_lote = carregar_lote
+        self._janela_segundos = (
+            configs.CARREGADOR_JANELA_MILISSEGUNDOS / 1000
+            if janela_segundos is None
+            else janela_segundos
+        )
+        self._max_lote = max(1, max_lote or configs.CARREGADOR_MAX_LOTE)
+        self._trava = threading.Lock()
+        self._pendentes: dict[K, Future[Optional[V]]] = {}
+        self._despacho_agendado = False
+        self._lotes = 0
+        self._chaves = 0
+        self._pedidos = 0
+        _carregadores.append(self)
+
+    def submeter(self, chave: K) -> Future[Optional[V]]:
+        """`Future` do resultado de `chave`, que entra no lote da janela atual."""
+        with self._trava:
+            self._pedidos += 1
+            futuro = self._pendentes.get(chave)
+            if futuro is not None:
+                return futuro
+            futuro = Future()
+            self._pendentes[chave] = futuro
+            if len(self._pendentes) >= self._max_lote:
+                # lote cheio: despacha sem esperar o fim da janela
+                lote = self._pendentes
+                self._pendentes = {}
+                self._agendar(0.0, self._despachar, lote)
+            elif not self._despacho_agendado:
+                self._despacho_agendado = True
+                self._agendar(self._janela_segundos, self._despachar_janela)
+        return futuro
+
+    def carregar(self, chave: K) -> Optional[V]:
+        return self.submeter(chave).result()
+
+    def _agendar(self, atraso: float, funcao: Callable[..., None], *args: Any) -> None:
+        # no contexto de quem abriu o lote, para a contabilização das
+        # consultas por endpoint
+        contexto = contextvars.copy_context()
+        timer = threading.Timer(atraso, contexto.run, args=(funcao, *args))
+        timer.daemon = True
+        timer.start()
+
+    def _despachar_janela(self) -> None:
+        with self._trava:
+            lote = self._pendentes
+            self._pendentes = {}
+            self._despacho_agendado = False
+        if lote:
+            self._despachar(lote)
+
+    def _despachar(self, lote: dict[K, Future[Optional[V]]]) -> None:
+        chaves = list(lote)
+        for inicio in range(0, len(chaves), self._max_lote):
+            parte = chaves[inicio : inicio + self._max_lote]
+            with self._trava:
+                self._lotes += 1
+                self._chaves += len(parte)
+            try:
+                resultados = self._carregar_lote(parte)
+            except BaseException as exc:
+                for chave in parte:
+                    lote[chave].set_exception(exc)
+                continue
+            for chave in parte:
+                lote[chave].set_result(resultados.get(chave))
+
+    def estatisticas(self) -> dict[str, int]:
+        with self._trava:
+            return {
+                "pedidos": self._pedidos,
+                "chaves": self._chaves,
+                "lotes": self._lotes,
+            }
+
+
+def estatisticas_carregadores() -> dict[str, dict[str, int]]:
+    return {carregador.nome: carregador.estatisticas() for carregador in _carregadores}
@@ -0,0 +1,393 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import unicodedata
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+import numpy as np
+from pydantic import AnyUrl
+
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.agendador import TarefaPeriodica
+from ip_mensageria_alocacao_api.core.bd import make_bq_client, registrar_consulta
+
+logger = logging.getLogger(__name__)
+
+TABELA_TEMPLATES = "ip_mensageria_camada_prata.templates_embeddings"
+TABELA_MIDIAS = "ip_mensageria_camada_prata.templates_midias_embeddings"
+TABELA_MIDIAS_TURN = "ip_mensageria_camada_bronze.templates_midias"
+
+_QUERY_TEMPLATES = f"""
+    SELECT template_nome, content, embedding
+    FROM `{TABELA_TEMPLATES}`
+"""
+
+_QUERY_MIDIAS = f"""
+    SELECT ref.uri AS uri, embedding
+    FROM `{TABELA_MIDIAS}`
+"""
+
+_QUERY_MIDIAS_TURN = f"""
+    SELECT url_turn, gcs_referencia.uri AS uri
+    FROM `{TABELA_MIDIAS_TURN}`
+"""
+
+# trecho duplicado nas URIs gravadas em `templates_midias.gcs_referencia`
+_PREFIXO_DUPLICADO = "ip-mensageria-turn-midias/ip-mensageria-turn-midias/o/"
+_PREFIXO = "ip-mensageria-turn-midias/"
+
+# arquivos do catálogo compartilhado em `CATALOGO_EMBEDDINGS_CAMINHO`
+_ARQUIVO_INDICE = "catalogo.json"
+_ARQUIVO_TRAVA = "catalogo.lock"
+
+
+def montar_texto_template(
+    template_texto: str,
+    botao0_texto: Optional[str] = None,
+    botao1_texto: Optional[str] = None,
+    botao2_texto: Optional[str] = None,
+) -> str:
+    """Texto do template como gravado na coluna `content` dos embeddings."""
+    return "\n".join(
+        [
+            template_texto,
+            botao0_texto or "",
+            botao1_texto or "",
+            botao2_texto or "",
+        ]
+    )
+
+
+def normalizar_uri_midia(uri: str) -> str:
+    """
+    URI de `templates_midias.gcs_referencia` no formato de `ref.uri` dos
+    embeddings de mídias (o antigo `REGEXP_REPLACE` do JOIN).
+    """
+    return uri.replace(_PREFIXO_DUPLICADO, _PREFIXO)
+
+
+def normalizar_texto(texto: str) -> str:
+    """NFC e sem espaços nas pontas de cada linha e do texto como um todo."""
+    linhas = unicodedata.normalize("NFC", texto).splitlines()
+    return "\n".join(linha.strip() for linha in linhas).strip()
+
+
+def hash_conteudo(texto: str) -> str:
+    return hashlib.sha256(normalizar_texto(texto).encode("utf-8")).hexdigest()
+
+
+def _empilhar(embeddings: list[Any]) -> np.ndarray:
+    matriz = np.array(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+    # as linhas são devolvidas como views: ninguém deve alterá-las
+    matriz.flags.writeable = False
+    return matriz
+
+
+def _mapear(caminho: Path, deslocamento: int, forma: tuple[int, int]) -> np.ndarray:
+    if forma[0] * forma[1] == 0:
+        # `np.memmap` não aceita regiões vazias
+        matriz: np.ndarray = np.empty(forma, dtype=np.float32)
+        matriz.flags.writeable = False
+        return matriz
+    return np.memmap(
+        caminho, dtype=np.float32, mode="r", offset=deslocamento, shape=forma
+    )
+
+
+class CatalogoEmbeddings:
+    """
+    Embeddings de templates e de mídias em matrizes float32 contíguas, com
+    índices de chave para linha por `template_nome`, hash do conteúdo do
+    template, `ref.uri` (gs://) e `url_turn` das mídias.
+    """
+
+    def __init__(
+        self,
+        templates: np.ndarray,
+        templates_por_nome: dict[str, int],
+        templates_por_hash: dict[str, int],
+        midias: np.ndarray,
+        midias_por_uri: dict[str, int],
+        midias_por_url_turn: dict[str, int],
+    ) -> None:
+        self.templates = templates
+        self.templates_por_nome = templates_por_nome
+        self.templates_por_hash = templates_por_hash
+        self.midias = midias
+        self.midias_por_uri = midias_por_uri
+        self.midias_por_url_turn = midias_por_url_turn
+
+    @classmethod
+    def de_linhas(
+        cls,
+        linhas_templates: Iterable[Any],
+        linhas_midias: Iterable[Any],
+        linhas_midias_turn: Iterable[Any],
+    ) -> CatalogoEmbeddings:
+        embeddings_templates: list[Any] = []
+        por_nome: dict[str, int] = {}
+        por_hash: dict[str, int] = {}
+        for linha in linhas_templates:
+            i = len(embeddings_templates)
+            embeddings_templates.append(linha.embedding)
+            if linha.template_nome is not None:
+                por_nome.setdefault(linha.template_nome, i)
+            if linha.content is not None:
+                por_hash.setdefault(hash_conteudo(linha.content), i)
+
+        embeddings_midias: list[Any] = []
+        por_uri: dict[str, int] = {}
+        for linha in linhas_midias:
+            if linha.uri is None or linha.uri in por_uri:
+                continue
+            por_uri[linha.uri] = len(embeddings_midias)
+            embeddings_midias.append(linha.embedding)
+
+        por_url_turn: dict[str, int] = {}
+        for linha in linhas_midias_turn:
+            if linha.url_turn is None or linha.uri is None:
+                continue
+            i_midia = por_uri.get(normalizar_uri_midia(linha.uri))
+            if i_midia is not None:
+                por_url_turn.setdefault(linha.url_turn, i_midia)
+
+        return cls(
+            templates=_empilhar(embeddings_templates),
+            templates_por_nome=por_nome,
+            templates_por_hash=por_hash,
+            midias=_empilhar(embeddings_midias),
+            midias_por_uri=por_uri,
+            midias_por_url_turn=por_url_turn,
+        )
+
+    @classmethod
+    def carregar_do_bigquery(cls) -> CatalogoEmbeddings:
+        cliente = make_bq_client()
+        # os três jobs rodam em paralelo no BigQuery
+        jobs = {
+            "catalogo_templates": cliente.query(_QUERY_TEMPLATES),
+            "catalogo_midias": cliente.query(_QUERY_MIDIAS),
+            "catalogo_midias_turn": cliente.query(_QUERY_MIDIAS_TURN),
+        }
+        resultados = [job.result() for job in jobs.values()]
+        for nome, job in jobs.items():
+            # a duração de cada job, não a da espera pelos três
+            duracao = (
+                (job.ended - job.started).total_seconds()
+                if job.started is not None and job.ended is not None
+                else 0.0
+            )
+            registrar_consulta(nome, job, duracao)
+        return cls.de_linhas(*resultados)
+
+    def salvar(self, diretorio: Path, versoes: list[Optional[str]]) -> None:
+        """
+        Grava as duas matrizes em um único arquivo float32 e os índices em
+        `catalogo.json`, que aponta para ele. O índice é trocado por último e
+        de forma atômica: quem já mapeou o arquivo anterior continua lendo-o.
+        """
+        diretorio.mkdir(parents=True, exist_ok=True)
+        nome_dados = f"embeddings-{uuid.uuid4().hex}.f32"
+        temporario = diretorio / f"{nome_dados}.tmp"
+        with open(temporario, "wb") as arquivo:
+            for matriz in (self.templates, self.midias):
+                arquivo.write(np.ascontiguousarray(matriz, dtype=np.float32).tobytes())
+        os.replace(temporario, diretorio / nome_dados)
+
+        indice = {
+            "versoes": versoes,
+            "dados": nome_dados,
+            "templates_forma": list(self.templates.shape),
+            "midias_forma": list(self.midias.shape),
+            "templates_por_nome": self.templates_por_nome,
+            "templates_por_hash": self.templates_por_hash,
+            "midias_por_uri": self.midias_por_uri,
+            "midias_por_url_turn": self.midias_por_url_turn,
+        }
+        temporario = diretorio / f"{_ARQUIVO_INDICE}.tmp"
+        temporario.write_text(json.dumps(indice), encoding="utf-8")
+        os.replace(temporario, diretorio / _ARQUIVO_INDICE)
+
+        for antigo in diretorio.glob("embeddings-*.f32"):
+            if antigo.name != nome_dados:
+                antigo.unlink(missing_ok=True)
+
+    @classmethod
+    def abrir(
+        cls, diretorio: Path
+    ) -> Optional[tuple[CatalogoEmbeddings, list[Optional[str]]]]:
+        """
+        Catálogo gravado por `salvar`, com as matrizes mapeadas do disco em
+        modo somente leitura (as páginas são compartilhadas entre processos),
+        e as versões das tabelas de onde veio. `None` se não houver catálogo.
+        """
+        try:
+            indice = json.loads((diretorio / _ARQUIVO_INDICE).read_text("utf-8"))
+        except FileNotFoundError:
+            return None
+        caminho = diretorio / indice["dados"]
+        forma_templates = tuple(indice["templates_forma"])
+        forma_midias = tuple(indice["midias_forma"])
+        tamanho_templates = forma_templates[0] * forma_templates[1] * 4
+        catalogo = cls(
+            templates=_mapear(caminho, 0, forma_templates),
+            templates_por_nome=indice["templates_por_nome"],
+            templates_por_hash=indice["templates_por_hash"],
+            midias=_mapear(caminho, tamanho_templates, forma_midias),
+            midias_por_uri=indice["midias_por_uri"],
+            midias_por_url_turn=indice["midias_por_url_turn"],
+        )
+        return catalogo, indice["versoes"]
+
+    def template_por_nome(self, template_nome: str) -> Optional[np.ndarray]:
+        i = self.templates_por_nome.get(template_nome)
+        return None if i is None else self.templates[i]
+
+    def template_por_texto(self, texto: str) -> Optional[np.ndarray]:
+        i = self.templates_por_hash.get(hash_conteudo(texto))
+        return None if i is None else self.templates[i]
+
+    def midia_por_url(self, url: str) -> Optional[np.ndarray]:
+        if url.startswith("gs://"):
+            i = self.midias_por_uri.get(url)
+        else:
+            i = self.midias_por_url_turn.get(url)
+        return None if i is None else self.midias[i]
+
+
+_catalogo: Optional[CatalogoEmbeddings] = None
+_versoes_tabelas: Optional[tuple[Optional[datetime], ...]] = None
+_tarefa: Optional[TarefaPeriodica] = None
+_trava = threading.Lock()
+
+
+def obter_catalogo_embeddings() -> Optional[CatalogoEmbeddings]:
+    return _catalogo
+
+
+def _versoes_atuais() -> tuple[Optional[datetime], ...]:
+    cliente = make_bq_client()
+    return tuple(
+        cliente.get_table(f"{configs.BQ_PROJETO}.{tabela}").modified
+        for tabela in (TABELA_TEMPLATES, TABELA_MIDIAS, TABELA_MIDIAS_TURN)
+    )
+
+
+@contextmanager
+def _trava_arquivo(diretorio: Path, operacao: int) -> Iterator[None]:
+    """Trava entre processos (os workers do gunicorn) sobre o diretório."""
+    diretorio.mkdir(parents=True, exist_ok=True)
+    with open(diretorio / _ARQUIVO_TRAVA, "a") as arquivo:
+        fcntl.flock(arquivo, operacao)
+        try:
+            yield
+        finally:
+            fcntl.flock(arquivo, fcntl.LOCK_UN)
+
+
+def _abrir_se_atual(
+    diretorio: Path, versoes: list[Optional[str]]
+) -> Optional[CatalogoEmbeddings]:
+    gravado = CatalogoEmbeddings.abrir(diretorio)
+    if gravado is None or gravado[1] != versoes:
+        return None
+    return gravado[0]
+
+
+def _carregar_compartilhado(
+    diretorio: Path, versoes: tuple[Optional[datetime], ...]
+) -> CatalogoEmbeddings:
+    """
+    Mapeia o catálogo gravado em `diretorio` se ele corresponde às versões
+    atuais das tabelas; senão, um único worker o exporta do BigQuery enquanto
+    os demais aguardam a trava e depois mapeiam o mesmo arquivo.
+    """
+    chave = [None if versao is None else versao.isoformat() for versao in versoes]
+    with _trava_arquivo(diretorio, fcntl.LOCK_SH):
+        catalogo = _abrir_se_atual(diretorio, chave)
+    if catalogo is not None:
+        return catalogo
+    with _trava_arquivo(diretorio, fcntl.LOCK_EX):
+        # outro worker pode ter exportado enquanto aguardávamos a trava
+        catalogo = _abrir_se_atual(diretorio, chave)
+        if catalogo is None:
+            CatalogoEmbeddings.carregar_do_bigquery().salvar(diretorio, chave)
+            catalogo = _abrir_se_atual(diretorio, chave)
+    assert catalogo is not None
+    return catalogo
+
+
+def atualizar_catalogo_embeddings() -> None:
+    """Recarrega o catálogo se alguma das tabelas mudou desde a última carga."""
+    global _catalogo, _versoes_tabelas
+
+    with _trava:
+        versoes = _versoes_atuais()
+        if _catalogo is not None and versoes == _versoes_tabelas:
+            return
+        if configs.CATALOGO_EMBEDDINGS_CAMINHO:
+            _catalogo = _carregar_compartilhado(
+                Path(configs.CATALOGO_EMBEDDINGS_CAMINHO), versoes
+            )
+        else:
+            _catalogo = CatalogoEmbeddings.carregar_do_bigquery()
+        _versoes_tabelas = versoes
+        logger.info(
+            f"Catálogo de embeddings carregado: {len(_catalogo.templates)} "
+            f"templates, {len(_catalogo.midias)} mídias"
+        )
+
+
+def template_embedding_do_catalogo(template_nome: str) -> Optional[np.ndarray]:
+    catalogo = _catalogo
+    return None if catalogo is None else catalogo.template_por_nome(template_nome)
+
+
+def template_embedding_por_texto_do_catalogo(
+    template_texto: str,
+    botao0_texto: Optional[str] = None,
+    botao1_texto: Optional[str] = None,
+    botao2_texto: Optional[str] = None,
+) -> Optional[np.ndarray]:
+    catalogo = _catalogo
+    if catalogo is None:
+        return None
+    return catalogo.template_por_texto(
+        montar_texto_template(template_texto, botao0_texto, botao1_texto, botao2_texto)
+    )
+
+
+def midia_embedding_do_catalogo(url: Optional[AnyUrl]) -> Optional[np.ndarray]:
+    catalogo = _catalogo
+    return None if catalogo is None else catalogo.midia_por_url(str(url))
+
+
+def iniciar_catalogo_embeddings() -> None:
+    global _tarefa
+
+    if not configs.CATALOGO_EMBEDDINGS_ATIVO or _tarefa is not None:
+        return
+    _tarefa = TarefaPeriodica(
+        nome="catalogo-embeddings",
+        intervalo_segundos=configs.CATALOGO_EMBEDDINGS_INTERVALO_SEGUNDOS,
+        funcao=atualizar_catalogo_embeddings,
+        executar_imediatamente=True,
+    )
+    _tarefa.iniciar()
+
+
+def parar_catalogo_embeddings() -> None:
+    global _tarefa
+
+    if _tarefa is not None:
+        _tarefa.parar()
+        _tarefa = None
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Any, Iterable, Optional, Sequence
+
+import numpy as np
+
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.agendador import TarefaPeriodica
+from ip_mensageria_alocacao_api.core.bd import consultar
+
+logger = logging.getLogger(__name__)
+
+_QUERY_CENSO = """
+    SELECT cod_mun_ibge, perc_dom_zona_rural
+    FROM `pmai_camada_prata.situacao_domicilios_municipios_censo_2010`
+"""
+
+
+class CensoMunicipios:
+    """
+    Proporção de domicílios em zona rural por município (Censo 2010), em
+    arrays ordenados pelo código IBGE e consultados por busca binária.
+    """
+
+    def __init__(self, codigos: np.ndarray, prop_zona_rural: np.ndarray) -> None:
+        self.codigos = codigos
+        self.prop_zona_rural = prop_zona_rural
+
+    def __len__(self) -> int:
+        return len(self.codigos)
+
+    @classmethod
+    def de_linhas(cls, linhas: Iterable[Any]) -> CensoMunicipios:
+        props: dict[str, float] = {}
+        for linha in linhas:
+            if linha.cod_mun_ibge is None:
+                continue
+            props.setdefault(
+                str(linha.cod_mun_ibge),
+                np.nan
+                if linha.perc_dom_zona_rural is None
+                else float(linha.perc_dom_zona_rural),
+            )
+        codigos = np.array(sorted(props), dtype=str)
+        return cls(
+            codigos=codigos,
+            prop_zona_rural=np.array(
+                [props[codigo] for codigo in codigos], dtype=np.float64
+            ),
+        )
+
+    @classmethod
+    def carregar_do_bigquery(cls) -> CensoMunicipios:
+        return cls.de_linhas(
+            consultar(_QUERY_CENSO, nome="censo_municipios", timeout=None)
+        )
+
+    def proporcoes(self, municipios: Sequence[Any]) -> np.ndarray:
+        """Proporção de cada município (NaN se nulo ou ausente no censo)."""
+        resultado: np.ndarray = np.full(len(municipios), np.nan, dtype=np.float64)
+        if not len(self.codigos) or not len(municipios):
+            return resultado
+        chaves = np.array(["" if m is None else str(m) for m in municipios], dtype=str)
+        posicoes = np.searchsorted(self.codigos, chaves)
+        posicoes = np.minimum(posicoes, len(self.codigos) - 1)
+        encontrados = self.codigos[posicoes] == chaves
+        resultado[encontrados] = self.prop_zona_rural[posicoes[encontrados]]
+        return resultado
+
+    def proporcao(self, municipio: Any) -> Optional[float]:
+        prop = float(self.proporcoes([municipio])[0])
+        return None if np.isnan(prop) else prop
+
+
+_censo: Optional[CensoMunicipios] = None
+_tarefa: Optional[TarefaPeriodica] = None
+_sincronizado = False
+# serializa as cargas: a tarefa de fundo e a carga sob demanda nunca rodam ao
+# mesmo tempo; as leituras de `_censo` não passam por ela
+_trava = threading.Lock()
+
+
+def _carregar() -> CensoMunicipios:
+    censo = CensoMunicipios.carregar_do_bigquery()
+    logger.info(f"Censo dos municípios carregado: {len(censo)} municípios")
+    return censo
+
+
+def atualizar_censo_municipios() -> None:
+    global _censo
+
+    with _trava:
+        _censo = _carregar()
+
+
+def obter_censo_municipios() -> CensoMunicipios:
+    """Censo em memória, carregado do BigQuery na primeira chamada se preciso."""
+    global _censo
+
+    censo = _censo
+    if censo is not None:
+        return censo
+    # só uma carga por processo: quem chegar durante ela (inclusive a da
+    # tarefa de fundo) espera
+    with _trava:
+        if _censo is None:
+            _censo = _carregar()
+        return _censo
+
+
+def _sincronizar_censo_municipios() -> None:
+    """
+    Na primeira execução, carrega o censo só se nenhuma requisição o carregou
+    antes; nas seguintes, o recarrega.
+    """
+    global _sincronizado
+
+    if _sincronizado:
+        atualizar_censo_municipios()
+    else:
+        obter_censo_municipios()
+        _sincronizado = True
+
+
+def iniciar_censo_municipios() -> None:
+    """Carrega o censo em segundo plano na inicialização e o mantém atualizado."""
+    global _tarefa
+
+    if _tarefa is not None:
+        return
+    _tarefa = TarefaPeriodica(
+        nome="censo-municipios",
+        intervalo_segundos=configs.CENSO_MUNICIPIOS_INTERVALO_SEGUNDOS,
+        funcao=_sincronizar_censo_municipios,
+        executar_imediatamente=True,
+    )
+    _tarefa.iniciar()
+
+
+def parar_censo_municipios() -> None:
+    global _tarefa
+
+    if _tarefa is not None:
+        _tarefa.parar()
+        _tarefa = None
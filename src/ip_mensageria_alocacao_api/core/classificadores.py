@@ -4,18 +4,19 @@ import json
 import logging
 import pickle
 import tempfile
-from pathlib import Path
+import threading
 from typing import Optional
 
 from catboost import CatBoostClassifier
-from google.auth.exceptions import DefaultCredentialsError
-from google.cloud import storage
 from google.cloud.storage.bucket import Bucket
 
 from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.atributos import compilar_plano_atributos
+from ip_mensageria_alocacao_api.core.gcs import make_storage_client, parse_gcs
 from ip_mensageria_alocacao_api.core.modelos import Classificador
 
 _ARTEFATOS: Optional[Classificador] = None
+_trava_artefatos = threading.Lock()
 
 logger = logging.getLogger(__name__)
 
@@ -31,31 +32,6 @@ def _classificador_offline() -> Classificador:
     )
 
 
-def _make_storage_client() -> storage.Client:
-    # Em dev/local, se houver JSON montado, o próprio google lib pega via
-    # GOOGLE_APPLICATION_CREDENTIALS (ou você pode manter sua envvar e exportar).
-    # Em Cloud Run, ADC/Workload Identity funciona automaticamente sem chave JSON.
-    try:
-        if (
-            configs.GOOGLE_ARQUIVO_CREDENCIAIS
-            and Path(configs.GOOGLE_ARQUIVO_CREDENCIAIS).exists()
-        ):
-            return storage.Client.from_service_account_json(
-                configs.GOOGLE_ARQUIVO_CREDENCIAIS
-            )
-        return storage.Client()
-    except DefaultCredentialsError as exc:
-        raise RuntimeError(
-            "Não foi possível autenticar com as credenciais do Google Cloud"
-        ) from exc
-
-
-def _parse_gcs(uri: str) -> tuple[str, str]:
-    assert uri.startswith("gs://")
-    bucket, *path = uri[5:].split("/", 1)
-    return bucket, (path[0] if path else "")
-
-
 def _baixar_blob_como_bytes(bucket: Bucket, path: str) -> bytes:
     blob = bucket.blob(path)
     return blob.download_as_bytes()
@@ -70,14 +46,23 @@ def carregar_classificadores() -> Classificador:
     if _ARTEFATOS is not None:
         return _ARTEFATOS
 
+    # Só um download por processo: quem chegar durante o carregamento espera
+    # por ele em vez de baixar o ensemble de novo.
+    with _trava_artefatos:
+        if _ARTEFATOS is None:
+            _ARTEFATOS = _baixar_classificadores()
+    return _ARTEFATOS
+
+
+def _baixar_classificadores() -> Classificador:
     artefatos_predicao_uri = configs.ARTEFATOS_PREDICAO_URI
     if not artefatos_predicao_uri or not artefatos_predicao_uri.startswith("gs://"):
         raise RuntimeError(
             "Defina a envvar ARTEFATOS_PREDICAO_URI (gs://bucket/prefix)"
         )
 
-    storage_client = _make_storage_client()
-    bucket_name, prefix = _parse_gcs(artefatos_predicao_uri)
+    storage_client = make_storage_client()
+    bucket_name, prefix = parse_gcs(artefatos_predicao_uri)
     bucket = storage_client.bucket(bucket_name)
 
     meta = json.loads(
@@ -120,12 +105,22 @@ def carregar_classificadores() -> Classificador:
             m.load_model(tmp.name)
         modelos.append(m)
 
-    _ARTEFATOS = Classificador(
+    classificadores = Classificador(
         modelos=modelos,
         atributos_colunas=atributos_colunas,
         atributos_categoricos=atributos_categoricos,
         imputador_numerico=imputador_numerico,
         template_embedding_dims=template_embedding_dims,
         midia_embedding_dims=midia_embedding_dims,
+        plano_atributos=compilar_plano_atributos(
+            atributos_colunas,
+            atributos_categoricos,
+            imputador_numerico,
+        ),
     )
-    return _ARTEFATOS
+    if classificadores.plano_atributos is None:
+        logger.warning(
+            "Imputador não suportado pelo plano de atributos; "
+            "usando montagem de atributos com pandas"
+        )
+    return classificadores
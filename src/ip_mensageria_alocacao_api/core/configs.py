@@ -22,3 +22,169 @@ ARTEFATOS_PREDICAO_URI = config("ARTEFATOS_PREDICAO_URI", cast=str)  # gs://buck
 CARREGAR_CLASSIFICADORES_OFFLINE = config(
     "CARREGAR_CLASSIFICADORES_OFFLINE", cast=bool, default=False
 )
+
+# Concorrência.
+# Número de threads para avaliar os modelos do ensemble em paralelo. Se não
+# definido, usa o número de CPUs disponíveis; 1 desativa o paralelismo.
+ENSEMBLE_NUM_THREADS = config("ENSEMBLE_NUM_THREADS", cast=int, default=None)
+# Número máximo de consultas ao BigQuery em paralelo por processo.
+CONSULTAS_NUM_THREADS = config("CONSULTAS_NUM_THREADS", cast=int, default=16)
+# Threads do executor que tira do event loop o trabalho bloqueante das
+# requisições (BigQuery, bcrypt, CatBoost).
+REQUISICOES_NUM_THREADS = config("REQUISICOES_NUM_THREADS", cast=int, default=32)
+# Threads para os prefetches de campanhas (`POST /prefetch`), que rodam em
+# segundo plano sem disputar os pools das requisições.
+PREFETCH_NUM_THREADS = config("PREFETCH_NUM_THREADS", cast=int, default=1)
+
+# Prazo padrão das predições, em milissegundos, contado da chegada da
+# requisição (o chamador pode informar outro em `prazo_ms`). Se as consultas do
+# cidadão não terminarem nele, a predição usa os valores de imputação e é
+# marcada como degradada. Se não definido, espera as consultas sem prazo.
+PREDICAO_PRAZO_MILISSEGUNDOS = config(
+    "PREDICAO_PRAZO_MILISSEGUNDOS", cast=float, default=None
+)
+# Linhas de cada matriz de atributos avaliada pelo ensemble nas predições em
+# lote: lotes maiores são avaliados em partes, limitando a memória por
+# requisição.
+PREDICAO_LINHAS_POR_MATRIZ = config(
+    "PREDICAO_LINHAS_POR_MATRIZ", cast=int, default=10000
+)
+
+# Cliente do BigQuery. Conexões HTTP mantidas abertas: uma por consulta
+# simultânea (pool de consultas, prefetch e folga para as tarefas de fundo).
+BQ_POOL_CONEXOES = config(
+    "BQ_POOL_CONEXOES",
+    cast=int,
+    default=CONSULTAS_NUM_THREADS + PREFETCH_NUM_THREADS + 8,
+)
+# Espera máxima pelo resultado de uma consulta e por cada chamada HTTP.
+BQ_TIMEOUT_SEGUNDOS = config("BQ_TIMEOUT_SEGUNDOS", cast=float, default=30.0)
+BQ_TIMEOUT_API_SEGUNDOS = config("BQ_TIMEOUT_API_SEGUNDOS", cast=float, default=30.0)
+
+# Armazém local de características dos cidadãos (opcional).
+ARMAZEM_CIDADAOS_ATIVO = config("ARMAZEM_CIDADAOS_ATIVO", cast=bool, default=False)
+ARMAZEM_CIDADAOS_CAMINHO = config(
+    "ARMAZEM_CIDADAOS_CAMINHO",
+    cast=str,
+    default="/tmp/ip_mensageria/cidadaos.npz",
+)
+ARMAZEM_CIDADAOS_INTERVALO_SEGUNDOS = config(
+    "ARMAZEM_CIDADAOS_INTERVALO_SEGUNDOS", cast=int, default=6 * 60 * 60
+)
+
+# Armazém local das datas do último procedimento (opcional). Exporta tudo na
+# inicialização e a cada EXPORTACAO_COMPLETA_SEGUNDOS; entre elas, sincroniza
+# só as linhas com data recente. A carência cobre transmissões atrasadas.
+ARMAZEM_PROCEDIMENTOS_ATIVO = config(
+    "ARMAZEM_PROCEDIMENTOS_ATIVO", cast=bool, default=False
+)
+ARMAZEM_PROCEDIMENTOS_INTERVALO_SEGUNDOS = config(
+    "ARMAZEM_PROCEDIMENTOS_INTERVALO_SEGUNDOS", cast=int, default=15 * 60
+)
+ARMAZEM_PROCEDIMENTOS_CARENCIA_DIAS = config(
+    "ARMAZEM_PROCEDIMENTOS_CARENCIA_DIAS", cast=int, default=30
+)
+ARMAZEM_PROCEDIMENTOS_EXPORTACAO_COMPLETA_SEGUNDOS = config(
+    "ARMAZEM_PROCEDIMENTOS_EXPORTACAO_COMPLETA_SEGUNDOS",
+    cast=int,
+    default=24 * 60 * 60,
+)
+
+# Índice dos ids de cidadãos conhecidos (opcional). Ids fora dele recebem 404
+# sem consulta ao BigQuery; cidadãos cadastrados depois da última atualização
+# só são reconhecidos na atualização seguinte.
+INDICE_CIDADAOS_ATIVO = config("INDICE_CIDADAOS_ATIVO", cast=bool, default=False)
+INDICE_CIDADAOS_INTERVALO_SEGUNDOS = config(
+    "INDICE_CIDADAOS_INTERVALO_SEGUNDOS", cast=int, default=60 * 60
+)
+
+# Proporção de domicílios rurais por município (Censo 2010), mantida em
+# memória. A tabela é estática; a recarga periódica só cobre correções.
+CENSO_MUNICIPIOS_INTERVALO_SEGUNDOS = config(
+    "CENSO_MUNICIPIOS_INTERVALO_SEGUNDOS", cast=int, default=24 * 60 * 60
+)
+
+# Catálogo de embeddings de templates e mídias em memória (opcional; ative com
+# CATALOGO_EMBEDDINGS_ATIVO=true). Cada worker carrega as tabelas inteiras na
+# inicialização. O intervalo é o de verificação de mudanças nas tabelas; a
+# recarga só ocorre se elas mudarem.
+CATALOGO_EMBEDDINGS_ATIVO = config(
+    "CATALOGO_EMBEDDINGS_ATIVO", cast=bool, default=False
+)
+CATALOGO_EMBEDDINGS_INTERVALO_SEGUNDOS = config(
+    "CATALOGO_EMBEDDINGS_INTERVALO_SEGUNDOS", cast=int, default=5 * 60
+)
+# Diretório onde o catálogo é gravado como um arquivo float32 mapeado em
+# memória por todos os workers da instância, que assim compartilham uma única
+# cópia dos embeddings. Se não definido, cada worker mantém a sua.
+CATALOGO_EMBEDDINGS_CAMINHO = config(
+    "CATALOGO_EMBEDDINGS_CAMINHO", cast=str, default=None
+)
+
+# Tabela onde são persistidos os embeddings gerados para textos livres de
+# templates, compartilhada entre instâncias (criada se não existir).
+EMBEDDINGS_GERADOS_TABELA = config(
+    "EMBEDDINGS_GERADOS_TABELA",
+    cast=str,
+    default="ip_mensageria_camada_prata.templates_embeddings_gerados",
+)
+
+# Agrupamento de consultas ao BigQuery: chaves pedidas por requisições
+# concorrentes dentro da janela são buscadas em um único job (0 desativa a
+# espera, mas pedidos simultâneos ainda são agrupados).
+CARREGADOR_JANELA_MILISSEGUNDOS = config(
+    "CARREGADOR_JANELA_MILISSEGUNDOS", cast=float, default=5.0
+)
+CARREGADOR_MAX_LOTE = config("CARREGADOR_MAX_LOTE", cast=int, default=1000)
+
+# Cache das consultas ao BigQuery. Backends: "memoria" (por processo),
+# "disco" (SQLite local, compartilhado entre os workers da instância) ou
+# "redis" (servidor compatível com Redis; requer o pacote `redis`).
+CACHE_BACKEND = config("CACHE_BACKEND", cast=str, default="memoria")
+CACHE_DISCO_CAMINHO = config(
+    "CACHE_DISCO_CAMINHO", cast=str, default="/tmp/ip_mensageria/cache.sqlite"
+)
+CACHE_REDIS_URL = config(
+    "CACHE_REDIS_URL", cast=str, default="redis://localhost:6379/0"
+)
+# Validade das chaves não encontradas (404), para que voltem a ser buscadas
+# assim que forem criadas no BigQuery.
+CACHE_TTL_NEGATIVO_SEGUNDOS = config(
+    "CACHE_TTL_NEGATIVO_SEGUNDOS", cast=float, default=5 * 60
+)
+# Snapshot dos caches em memória (diretório local ou prefixo gs://), gravado
+# periodicamente e no encerramento de cada worker, um arquivo por worker, e
+# restaurado na inicialização com as entradas de todos os arquivos. Se não
+# definido, os caches começam vazios a cada instância. Os arquivos são JSON
+# comprimido com tipos fixos (não pickle), então lê-los não executa código;
+# ainda assim, o conteúdo restaurado é servido como resposta das consultas, e
+# só a conta de serviço da API deve poder gravar nesse local.
+CACHE_SNAPSHOT_URI = config("CACHE_SNAPSHOT_URI", cast=str, default=None)
+CACHE_SNAPSHOT_INTERVALO_SEGUNDOS = config(
+    "CACHE_SNAPSHOT_INTERVALO_SEGUNDOS", cast=int, default=15 * 60
+)
+# Cada worker regrava o seu arquivo a cada intervalo; os que não são regravados
+# há mais que isto (de workers e instâncias encerrados) são apagados na
+# restauração, sem serem lidos.
+CACHE_SNAPSHOT_RETENCAO_SEGUNDOS = config(
+    "CACHE_SNAPSHOT_RETENCAO_SEGUNDOS", cast=int, default=24 * 60 * 60
+)
+# Capacidade e validade por tipo de consulta. A de características comporta a
+# base de cidadãos ativos de um município grande. Os caches guardam datas (de
+# nascimento, do último procedimento), e não idades ou dias, que são
+# calculados a cada predição: a validade só precisa acompanhar a atualização
+# das tabelas.
+CACHE_CARACTERISTICAS_TAMANHO = config(
+    "CACHE_CARACTERISTICAS_TAMANHO", cast=int, default=100_000
+)
+CACHE_CARACTERISTICAS_TTL_SEGUNDOS = config(
+    "CACHE_CARACTERISTICAS_TTL_SEGUNDOS", cast=float, default=24 * 60 * 60
+)
+CACHE_TEMPOS_TAMANHO = config("CACHE_TEMPOS_TAMANHO", cast=int, default=100_000)
+CACHE_TEMPOS_TTL_SEGUNDOS = config(
+    "CACHE_TEMPOS_TTL_SEGUNDOS", cast=float, default=24 * 60 * 60
+)
+CACHE_EMBEDDINGS_TAMANHO = config("CACHE_EMBEDDINGS_TAMANHO", cast=int, default=10_000)
+CACHE_EMBEDDINGS_TTL_SEGUNDOS = config(
+    "CACHE_EMBEDDINGS_TTL_SEGUNDOS", cast=float, default=24 * 60 * 60
+)
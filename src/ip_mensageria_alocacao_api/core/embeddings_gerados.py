@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import UTC, datetime
+from http import HTTPStatus
+from typing import Sequence
+
+import numpy as np
+from fastapi import HTTPException
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.bd import (
+    consultar,
+    make_bq_client,
+    parametros_lista,
+)
+from ip_mensageria_alocacao_api.core.catalogo_embeddings import hash_conteudo
+
+logger = logging.getLogger(__name__)
+
+_ESQUEMA = [
+    bigquery.SchemaField("content_hash", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("content", "STRING"),
+    bigquery.SchemaField("embedding", "FLOAT64", mode="REPEATED"),
+    bigquery.SchemaField("gerado_em", "TIMESTAMP"),
+]
+
+_QUERY_GERAR = """
+    SELECT content, embedding
+    FROM AI.GENERATE_EMBEDDING(
+        MODEL `modelos.multimodalembedding`,
+        (SELECT content FROM UNNEST(@textos) AS content),
+        STRUCT(128 AS output_dimensionality)
+    )
+"""
+
+_tabela_garantida = False
+_trava = threading.Lock()
+
+
+def _tabela() -> str:
+    return f"{configs.BQ_PROJETO}.{configs.EMBEDDINGS_GERADOS_TABELA}"
+
+
+def _consultar_persistidos(hashes: Sequence[str]) -> dict[str, np.ndarray]:
+    try:
+        linhas = consultar(
+            f"""
+            SELECT content_hash, embedding
+            FROM `{_tabela()}`
+            WHERE content_hash IN UNNEST(@hashes)
+            """,
+            job_config=parametros_lista("hashes", hashes),
+            nome="embeddings_persistidos",
+        )
+        persistidos: dict[str, np.ndarray] = {}
+        for linha in linhas:
+            persistidos.setdefault(
+                linha.content_hash, np.array(linha.embedding, dtype=np.float32)
+            )
+        return persistidos
+    except NotFound:
+        # tabela ainda não criada: nada foi persistido
+        return {}
+
+
+def _gerar(textos_por_hash: dict[str, str]) -> dict[str, np.ndarray]:
+    # a geração pelo modelo pode passar do limite das consultas comuns
+    linhas = consultar(
+        _QUERY_GERAR,
+        job_config=parametros_lista("textos", list(textos_por_hash.values())),
+        nome="gerar_embeddings",
+        timeout=None,
+    )
+    return {
+        hash_conteudo(linha.content): np.array(linha.embedding, dtype=np.float32)
+        for linha in linhas
+        if linha.embedding
+    }
+
+
+def _persistir(
+    textos_por_hash: dict[str, str],
+    embeddings: dict[str, np.ndarray],
+) -> None:
+    global _tabela_garantida
+
+    cliente = make_bq_client()
+    try:
+        with _trava:
+            if not _tabela_garantida:
+                cliente.create_table(
+                    bigquery.Table(_tabela(), schema=_ESQUEMA), exists_ok=True
+                )
+                _tabela_garantida = True
+        gerado_em = datetime.now(tz=UTC).isoformat()
+        erros = cliente.insert_rows_json(
+            _tabela(),
+            [
+                {
+                    "content_hash": chave,
+                    "content": textos_por_hash[chave],
+                    "embedding": embedding.tolist(),
+                    "gerado_em": gerado_em,
+                }
+                for chave, embedding in embeddings.items()
+            ],
+        )
+        if erros:
+            logger.warning(f"Falha ao persistir embeddings gerados: {erros}")
+    except Exception:
+        # a persistência é um atalho para as próximas instâncias: uma falha
+        # aqui não deve derrubar a requisição que já tem o embedding
+        logger.exception("Falha ao persistir embeddings gerados")
+
+
+def gerar_embeddings_textos(textos: Sequence[str]) -> dict[str, np.ndarray]:
+    """
+    Embeddings de textos livres de templates, chaveados pelo texto recebido.
+    Reaproveita os já persistidos (pelo hash do texto normalizado) e gera os
+    demais com uma única chamada a `AI.GENERATE_EMBEDDING`, gravando-os para
+    as próximas instâncias. O modelo recebe o texto como enviado, igual ao
+    `content` de `templates_embeddings`; a normalização só define a chave.
+    """
+    hashes = {texto: hash_conteudo(texto) for texto in textos}
+    textos_por_hash: dict[str, str] = {}
+    for texto, chave in hashes.items():
+        textos_por_hash.setdefault(chave, texto)
+    if not textos_por_hash:
+        return {}
+
+    embeddings = _consultar_persistidos(list(textos_por_hash))
+    a_gerar = {
+        chave: texto
+        for chave, texto in textos_por_hash.items()
+        if chave not in embeddings
+    }
+    if a_gerar:
+        logger.info(f"Gerando embeddings para {len(a_gerar)} textos")
+        gerados = _gerar(a_gerar)
+        if gerados:
+            _persistir(a_gerar, gerados)
+        embeddings.update(gerados)
+
+    if any(chave not in embeddings for chave in textos_por_hash):
+        raise HTTPException(
+            status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
+            detail="Internal Server Error :: Não foi possível obter o embedding.",
+        )
+    return {texto: embeddings[chave] for texto, chave in hashes.items()}
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional, ParamSpec, TypeVar, cast
+
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.cache import FuncaoDerivada, FuncaoEmCache
+from ip_mensageria_alocacao_api.core.futuros import concluido
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+class ExecutorMonitorado(ThreadPoolExecutor):
+    """
+    `ThreadPoolExecutor` que contabiliza tarefas aguardando na fila e em
+    execução, para dimensionar a concorrência do serviço. As tarefas rodam no
+    contexto (`contextvars`) de quem as submeteu, como em `asyncio.to_thread`.
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str) -> None:
+        super().__init__(
+            max_workers=max_workers,
+            thread_name_prefix=thread_name_prefix,
+        )
+        self.nome = thread_name_prefix
+        self._trava_contadores = threading.Lock()
+        self._na_fila = 0
+        self._em_execucao = 0
+        self._concluidas = 0
+
+    def submit(
+        self,
+        fn: Callable[..., R],
+        /,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Future[R]:
+        with self._trava_contadores:
+            self._na_fila += 1
+        try:
+            contexto = contextvars.copy_context()
+            return super().submit(contexto.run, self._executar, fn, *args, **kwargs)
+        except BaseException:
+            with self._trava_contadores:
+                self._na_fila -= 1
+            raise
+
+    def _executar(self, fn: Callable[..., R], *args: Any, **kwargs: Any) -> R:
+        with self._trava_contadores:
+            self._na_fila -= 1
+            self._em_execucao += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._trava_contadores:
+                self._em_execucao -= 1
+                self._concluidas += 1
+
+    def estatisticas(self) -> dict[str, int]:
+        with self._trava_contadores:
+            return {
+                "threads": self._max_workers,
+                "na_fila": self._na_fila,
+                "em_execucao": self._em_execucao,
+                "concluidas": self._concluidas,
+            }
+
+
+_executor_ensemble: Optional[ExecutorMonitorado] = None
+_executor_consultas: Optional[ExecutorMonitorado] = None
+_executor_requisicoes: Optional[ExecutorMonitorado] = None
+_executor_prefetch: Optional[ExecutorMonitorado] = None
+_trava = threading.Lock()
+
+
+def _num_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def num_threads_ensemble() -> int:
+    if configs.ENSEMBLE_NUM_THREADS:
+        return max(1, configs.ENSEMBLE_NUM_THREADS)
+    return _num_cpus()
+
+
+def num_threads_por_modelo() -> int:
+    """
+    Threads que o CatBoost pode usar em cada `predict_proba`, de forma que
+    modelos avaliados em paralelo não disputem mais núcleos do que existem.
+    """
+    return max(1, _num_cpus() // num_threads_ensemble())
+
+
+def obter_executor_ensemble() -> Optional[ExecutorMonitorado]:
+    global _executor_ensemble
+
+    if num_threads_ensemble() <= 1:
+        return None
+    if _executor_ensemble is not None:
+        return _executor_ensemble
+    with _trava:
+        if _executor_ensemble is None:
+            _executor_ensemble = ExecutorMonitorado(
+                max_workers=num_threads_ensemble(),
+                thread_name_prefix="ensemble",
+            )
+    return _executor_ensemble
+
+
+def obter_executor_consultas() -> ExecutorMonitorado:
+    global _executor_consultas
+
+    if _executor_consultas is not None:
+        return _executor_consultas
+    with _trava:
+        if _executor_consultas is None:
+            _executor_consultas = ExecutorMonitorado(
+                max_workers=max(1, configs.CONSULTAS_NUM_THREADS),
+                thread_name_prefix="consultas",
+            )
+    return _executor_consultas
+
+
+def obter_executor_requisicoes() -> ExecutorMonitorado:
+    global _executor_requisicoes
+
+    if _executor_requisicoes is not None:
+        return _executor_requisicoes
+    with _trava:
+        if _executor_requisicoes is None:
+            _executor_requisicoes = ExecutorMonitorado(
+                max_workers=max(1, configs.REQUISICOES_NUM_THREADS),
+                thread_name_prefix="requisicoes",
+            )
+    return _executor_requisicoes
+
+
+def obter_executor_prefetch() -> ExecutorMonitorado:
+    global _executor_prefetch
+
+    if _executor_prefetch is not None:
+        return _executor_prefetch
+    with _trava:
+        if _executor_prefetch is None:
+            _executor_prefetch = ExecutorMonitorado(
+                max_workers=max(1, configs.PREFETCH_NUM_THREADS),
+                thread_name_prefix="prefetch",
+            )
+    return _executor_prefetch
+
+
+async def executar_bloqueante(
+    funcao: Callable[P, R],
+    *args: P.args,
+    **kwargs: P.kwargs,
+) -> R:
+    """
+    Executa uma função bloqueante (BigQuery, bcrypt, CatBoost) no executor de
+    requisições, liberando o event loop para atender outras requisições.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        obter_executor_requisicoes(),
+        functools.partial(funcao, *args, **kwargs),
+    )
+
+
+def estatisticas_executores() -> dict[str, dict[str, int]]:
+    return {
+        executor.nome: executor.estatisticas()
+        for executor in (
+            _executor_requisicoes,
+            _executor_consultas,
+            _executor_ensemble,
+            _executor_prefetch,
+        )
+        if executor is not None
+    }
+
+
+def submeter_consulta(
+    funcao: Callable[P, R],
+    *args: P.args,
+    **kwargs: P.kwargs,
+) -> Future[R]:
+    """
+    Executa uma consulta no pool de consultas. Se a função tiver cache e o
+    resultado já estiver nele, devolve um `Future` concluído sem ocupar o pool.
+    Funções com cache que agrupam as chaves em um `CarregadorEmLote` nem
+    passam pelo pool: a chave é registrada aqui e o lote é despachado pelo
+    carregador.
+    """
+    if isinstance(funcao, (FuncaoEmCache, FuncaoDerivada)):
+        if funcao.submete_sem_bloquear:
+            return cast(Future[R], funcao.submeter(*args, **kwargs))
+        encontrado, valor = funcao.consultar_cache(*args, **kwargs)
+        if encontrado:
+            return concluido(cast(R, valor))
+    return obter_executor_consultas().submit(funcao, *args, **kwargs)
+
+
+def calcular_prazo(
+    prazo_milissegundos: Optional[float] = None,
+    inicio: Optional[float] = None,
+) -> Optional[float]:
+    """
+    Instante, em `time.monotonic()`, em que vence um prazo de
+    `prazo_milissegundos` (PREDICAO_PRAZO_MILISSEGUNDOS se não informado)
+    contado a partir de `inicio`, ou de agora. `None` quando não há prazo.
+    """
+    if prazo_milissegundos is None:
+        prazo_milissegundos = configs.PREDICAO_PRAZO_MILISSEGUNDOS
+    if not prazo_milissegundos:
+        return None
+    if inicio is None:
+        inicio = time.monotonic()
+    return inicio + prazo_milissegundos / 1000
+
+
+def aguardar(futuro: Future[R], prazo: Optional[float]) -> R:
+    """
+    Resultado de `futuro`, esperando no máximo até `prazo` (ver
+    `calcular_prazo`); depois dele, levanta `TimeoutError`. A consulta segue
+    no pool e seu resultado ainda entra no cache.
+    """
+    if prazo is None:
+        return futuro.result()
+    return futuro.result(timeout=max(0.0, prazo - time.monotonic()))
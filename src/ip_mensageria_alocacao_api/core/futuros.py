@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from concurrent.futures import Future
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def concluido(valor: R) -> Future[R]:
+    futuro: Future[R] = Future()
+    futuro.set_result(valor)
+    return futuro
+
+
+def falho(excecao: BaseException) -> Future[R]:
+    futuro: Future[R] = Future()
+    futuro.set_exception(excecao)
+    return futuro
+
+
+def encadear(futuro: Future[T], funcao: Callable[[T], R]) -> Future[R]:
+    """
+    `Future` do resultado de `futuro` transformado por `funcao`, sem bloquear
+    quem chama. Exceções de `futuro` ou de `funcao` passam adiante.
+    """
+    derivado: Future[R] = Future()
+
+    def concluir(origem: Future[T]) -> None:
+        try:
+            derivado.set_result(funcao(origem.result()))
+        except BaseException as exc:
+            derivado.set_exception(exc)
+
+    futuro.add_done_callback(concluir)
+    return derivado
@@ -0,0 +1,32 @@
+from pathlib import Path
+
+from google.auth.exceptions import DefaultCredentialsError
+from google.cloud import storage
+
+from ip_mensageria_alocacao_api.core import configs
+
+
+def make_storage_client() -> storage.Client:
+    # Em dev/local, se houver JSON montado, o próprio google lib pega via
+    # GOOGLE_APPLICATION_CREDENTIALS (ou você pode manter sua envvar e exportar).
+    # Em Cloud Run, ADC/Workload Identity funciona automaticamente sem chave JSON.
+    try:
+        if (
+            configs.GOOGLE_ARQUIVO_CREDENCIAIS
+            and Path(configs.GOOGLE_ARQUIVO_CREDENCIAIS).exists()
+        ):
+            return storage.Client.from_service_account_json(
+                configs.GOOGLE_ARQUIVO_CREDENCIAIS
+            )
+        return storage.Client()
+    except DefaultCredentialsError as exc:
+        raise RuntimeError(
+            "Não foi possível autenticar com as credenciais do Google Cloud"
+        ) from exc
+
+
+def parse_gcs(uri: str) -> tuple[str, str]:
+    """Bucket e caminho de uma URI `gs://bucket/caminho`."""
+    assert uri.startswith("gs://")
+    bucket, *path = uri[5:].split("/", 1)
+    return bucket, (path[0] if path else "")
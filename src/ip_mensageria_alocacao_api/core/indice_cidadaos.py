@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.agendador import TarefaPeriodica
+from ip_mensageria_alocacao_api.core.bd import consultar
+
+logger = logging.getLogger(__name__)
+
+_QUERY_IDS = """
+    SELECT DISTINCT id AS cidadao_id
+    FROM `ip_mensageria_camada_ouro.cidadao`
+"""
+
+
+class IndiceCidadaos:
+    """
+    Ids de todos os cidadãos conhecidos, em um array ordenado consultado por
+    busca binária. Serve para recusar ids inexistentes sem ir ao BigQuery.
+    """
+
+    def __init__(self, ids: np.ndarray) -> None:
+        self.ids = ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, cidadao_id: object) -> bool:
+        return bool(self.conhecidos([str(cidadao_id)])[0])
+
+    @classmethod
+    def de_ids(cls, ids: Iterable[object]) -> IndiceCidadaos:
+        return cls(np.unique(np.array([str(i) for i in ids], dtype=str)))
+
+    @classmethod
+    def exportar_do_bigquery(cls) -> IndiceCidadaos:
+        inicio = time.monotonic()
+        linhas = consultar(
+            _QUERY_IDS, nome="indice_cidadaos", page_size=100_000, timeout=None
+        )
+        indice = cls.de_ids(linha.cidadao_id for linha in linhas)
+        logger.info(
+            f"Índice de cidadãos exportado: {len(indice)} ids em "
+            f"{time.monotonic() - inicio:.1f}s"
+        )
+        return indice
+
+    def conhecidos(self, cidadaos_ids: Sequence[str]) -> np.ndarray:
+        """Máscara booleana dos ids presentes no índice."""
+        if not len(self.ids) or not len(cidadaos_ids):
+            return np.zeros(len(cidadaos_ids), dtype=bool)
+        chaves = np.array(cidadaos_ids, dtype=str)
+        posicoes = np.minimum(np.searchsorted(self.ids, chaves), len(self.ids) - 1)
+        return self.ids[posicoes] == chaves
+
+
+_indice: Optional[IndiceCidadaos] = None
+_tarefa: Optional[TarefaPeriodica] = None
+
+
+def obter_indice_cidadaos() -> Optional[IndiceCidadaos]:
+    return _indice
+
+
+def cidadao_desconhecido(cidadao_id: str) -> bool:
+    """
+    `True` só quando o índice está carregado e não contém o id. Sem índice,
+    nada é recusado e a consulta segue para o BigQuery.
+    """
+    indice = _indice
+    return indice is not None and cidadao_id not in indice
+
+
+def atualizar_indice_cidadaos() -> None:
+    global _indice
+
+    # sempre da tabela de cidadãos, e não dos ids do armazém local: este só é
+    # atualizado a cada ARMAZEM_CIDADAOS_INTERVALO_SEGUNDOS e recusaria os
+    # cidadãos cadastrados desde então
+    novo = IndiceCidadaos.exportar_do_bigquery()
+    _indice = novo
+    logger.info(f"Índice de cidadãos atualizado: {len(novo)} ids")
+
+
+def iniciar_indice_cidadaos() -> None:
+    global _tarefa
+
+    if not configs.INDICE_CIDADAOS_ATIVO or _tarefa is not None:
+        return
+    _tarefa = TarefaPeriodica(
+        nome="indice-cidadaos",
+        intervalo_segundos=configs.INDICE_CIDADAOS_INTERVALO_SEGUNDOS,
+        funcao=atualizar_indice_cidadaos,
+        executar_imediatamente=True,
+    )
+    _tarefa.iniciar()
+
+
+def parar_indice_cidadaos() -> None:
+    global _tarefa
+
+    if _tarefa is not None:
+        _tarefa.parar()
+        _tarefa = None
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from datetime import date, datetime
 from enum import StrEnum
 from typing import Any, Literal, Optional
 
@@ -13,25 +14,54 @@ class Classificador(BaseModel):
     imputador_numerico: Any
     template_embedding_dims: int
     midia_embedding_dims: int
+    plano_atributos: Any = None
+
+
+RacaCor = Literal[
+    "Amarela",
+    "Branca",
+    "Indígena",
+    "Parda",
+    "Preta",
+]
+Sexo = Literal["Feminino", "Masculino"]
 
 
 class CidadaoCaracteristicas(BaseModel):
     idade: Optional[int]
     plano_saude_privado: Optional[bool]
-    raca_cor: Optional[
-        Literal[
-            "Amarela",
-            "Branca",
-            "Indígena",
-            "Parda",
-            "Preta",
-        ]
-    ]
-    sexo: Optional[Literal["Feminino", "Masculino"]]
+    raca_cor: Optional[RacaCor]
+    sexo: Optional[Sexo]
     tempo_desde_ultimo_procedimento: Optional[int]
     municipio_prop_domicilios_zona_rural: Optional[float]
 
 
+class CidadaoDados(BaseModel):
+    """
+    Dados do cidadão que não mudam com a data da consulta, e por isso podem
+    ficar em cache indefinidamente. A idade é calculada em `caracteristicas`.
+    """
+
+    data_nascimento: Optional[date]
+    plano_saude_privado: Optional[bool]
+    raca_cor: Optional[RacaCor]
+    sexo: Optional[Sexo]
+    municipio_prop_domicilios_zona_rural: Optional[float]
+
+    def caracteristicas(self, hoje: date) -> CidadaoCaracteristicas:
+        return CidadaoCaracteristicas(
+            # mesmo critério de DATE_DIFF(..., YEAR) usado no treino
+            idade=None
+            if self.data_nascimento is None
+            else hoje.year - self.data_nascimento.year,
+            plano_saude_privado=self.plano_saude_privado,
+            raca_cor=self.raca_cor,
+            sexo=self.sexo,
+            municipio_prop_domicilios_zona_rural=self.municipio_prop_domicilios_zona_rural,
+            tempo_desde_ultimo_procedimento=None,
+        )
+
+
 class DiaSemana(StrEnum):
     segunda = "Monday"
     terca = "Tuesday"
@@ -65,11 +95,43 @@ class Predicao(BaseModel):
     mensagem: Mensagem
     probabilidade: float
     erro_padrao: float
+    # prevista sem os dados do cidadão, que não chegaram no prazo
+    degradada: bool = False
+
+
+class PredicaoLote(BaseModel):
+    cidadao_id: str
+    mensagem: Mensagem
+    probabilidade: Optional[float] = Field(None)
+    erro_padrao: Optional[float] = Field(None)
+    erro: Optional[str] = Field(None)
+    degradada: bool = False
 
 
 class PredicaoSimulacao(BaseModel):
     mensagem: Mensagem
     probabilidade_sorteada: float
+    degradada: bool = False
+
+
+class PrefetchRequisicao(BaseModel):
+    cidadaos_ids: list[str]
+    linha_cuidado: LinhaCuidado
+    mensagens: list[Mensagem] = Field(default_factory=list)
+
+
+class PrefetchProgresso(BaseModel):
+    id: str
+    estado: Literal["pendente", "executando", "concluido", "falhou"] = "pendente"
+    cidadaos_total: int
+    cidadaos_carregados: int = 0
+    cidadaos_nao_encontrados: int = 0
+    mensagens_total: int
+    mensagens_carregadas: int = 0
+    mensagens_com_erro: int = 0
+    erro: Optional[str] = Field(None)
+    criado_em: datetime
+    concluido_em: Optional[datetime] = Field(None)
 
 
 class Template(BaseModel):
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import UTC, datetime
+from typing import Optional
+
+import numpy as np
+from fastapi import HTTPException
+
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.auxiliar import (
+    antecipar_caracteristicas_usuarios,
+    antecipar_tempos_desde_ultimo_procedimento,
+    obter_midia_embedding,
+    obter_template_embedding_por_nome,
+    obter_template_embeddings_por_textos,
+)
+from ip_mensageria_alocacao_api.core.executores import (
+    obter_executor_prefetch,
+    submeter_consulta,
+)
+from ip_mensageria_alocacao_api.core.modelos import (
+    Mensagem,
+    PrefetchProgresso,
+    PrefetchRequisicao,
+)
+
+logger = logging.getLogger(__name__)
+
+# progresso dos prefetches mais recentes deste processo
+_MAX_PREFETCHES = 100
+
+_prefetches: OrderedDict[str, PrefetchProgresso] = OrderedDict()
+_trava = threading.Lock()
+
+
+def _atualizar(progresso: PrefetchProgresso, **campos: object) -> None:
+    with _trava:
+        for campo, valor in campos.items():
+            setattr(progresso, campo, valor)
+
+
+def _antecipar_cidadaos(
+    requisicao: PrefetchRequisicao,
+    progresso: PrefetchProgresso,
+) -> None:
+    ids = list(dict.fromkeys(requisicao.cidadaos_ids))
+    tamanho_lote = max(1, configs.CARREGADOR_MAX_LOTE)
+    for inicio in range(0, len(ids), tamanho_lote):
+        lote = ids[inicio : inicio + tamanho_lote]
+        encontrados = antecipar_caracteristicas_usuarios(lote)
+        antecipar_tempos_desde_ultimo_procedimento(lote, requisicao.linha_cuidado)
+        _atualizar(
+            progresso,
+            cidadaos_carregados=progresso.cidadaos_carregados + encontrados,
+            cidadaos_nao_encontrados=(
+                progresso.cidadaos_nao_encontrados + len(lote) - encontrados
+            ),
+        )
+
+
+def _submeter_embeddings(mensagem: Mensagem) -> list[Future[np.ndarray]]:
+    futuros = []
+    if mensagem.template_nome:
+        futuros.append(
+            submeter_consulta(obter_template_embedding_por_nome, mensagem.template_nome)
+        )
+    if mensagem.midia_url:
+        futuros.append(submeter_consulta(obter_midia_embedding, mensagem.midia_url))
+    return futuros
+
+
+def _antecipar_mensagens(
+    mensagens: list[Mensagem],
+    progresso: PrefetchProgresso,
+) -> None:
+    templates = [m.template for m in mensagens if not m.template_nome and m.template]
+    erro_templates = False
+    if templates:
+        try:
+            obter_template_embeddings_por_textos(templates)
+        except HTTPException as exc:
+            logger.warning(f"Prefetch: falha ao obter templates por texto: {exc!r}")
+            erro_templates = True
+
+    # os embeddings por nome e por mídia seguem pelos carregadores em lote
+    futuros = [_submeter_embeddings(mensagem) for mensagem in mensagens]
+    for mensagem, futuros_mensagem in zip(mensagens, futuros):
+        if mensagem.template_nome:
+            ok = True
+        else:
+            ok = mensagem.template is not None and not erro_templates
+        for futuro in futuros_mensagem:
+            try:
+                futuro.result()
+            except HTTPException as exc:
+                logger.warning(f"Prefetch: falha ao obter embedding: {exc!r}")
+                ok = False
+        if ok:
+            _atualizar(
+                progresso, mensagens_carregadas=progresso.mensagens_carregadas + 1
+            )
+        else:
+            _atualizar(progresso, mensagens_com_erro=progresso.mensagens_com_erro + 1)
+
+
+def _executar(requisicao: PrefetchRequisicao, progresso: PrefetchProgresso) -> None:
+    _atualizar(progresso, estado="executando")
+    try:
+        mensagens = list(
+            {m.model_dump_json(): m for m in requisicao.mensagens}.values()
+        )
+        _antecipar_mensagens(mensagens, progresso)
+        _antecipar_cidadaos(requisicao, progresso)
+    except Exception as exc:
+        logger.exception(f"Falha no prefetch {progresso.id}")
+        _atualizar(
+            progresso,
+            estado="falhou",
+            erro=str(exc),
+            concluido_em=datetime.now(tz=UTC),
+        )
+        return
+    _atualizar(progresso, estado="concluido", concluido_em=datetime.now(tz=UTC))
+    logger.info(
+        f"Prefetch {progresso.id} concluído: {progresso.cidadaos_carregados} "
+        f"cidadãos e {progresso.mensagens_carregadas} mensagens em cache"
+    )
+
+
+def iniciar_prefetch(requisicao: PrefetchRequisicao) -> PrefetchProgresso:
+    """
+    Agenda em segundo plano a carga, em lotes, dos dados dos cidadãos e dos
+    embeddings das mensagens de uma campanha para os caches das consultas.
+    """
+    mensagens_unicas = {m.model_dump_json() for m in requisicao.mensagens}
+    progresso = PrefetchProgresso(
+        id=uuid.uuid4().hex,
+        cidadaos_total=len(set(requisicao.cidadaos_ids)),
+        mensagens_total=len(mensagens_unicas),
+        criado_em=datetime.now(tz=UTC),
+    )
+    with _trava:
+        _prefetches[progresso.id] = progresso
+        while len(_prefetches) > _MAX_PREFETCHES:
+            _prefetches.popitem(last=False)
+    obter_executor_prefetch().submit(_executar, requisicao, progresso)
+    return obter_progresso_prefetch(progresso.id) or progresso
+
+
+def obter_progresso_prefetch(prefetch_id: str) -> Optional[PrefetchProgresso]:
+    with _trava:
+        progresso = _prefetches.get(prefetch_id)
+        return None if progresso is None else progresso.model_copy()
@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import base64
+import gzip
+import json
+import logging
+import math
+import os
+import socket
+import time
+from datetime import date
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.agendador import TarefaPeriodica
+from ip_mensageria_alocacao_api.core.cache import Ausencia, caches_registrados
+from ip_mensageria_alocacao_api.core.gcs import make_storage_client, parse_gcs
+from ip_mensageria_alocacao_api.core.modelos import CidadaoDados
+
+logger = logging.getLogger(__name__)
+
+# JSON comprimido, e não pickle: o snapshot vem de um armazenamento externo e
+# carregá-lo não pode executar código. Só os tipos abaixo são aceitos.
+_VERSAO_FORMATO = 2
+_EXTENSAO = ".json.gz"
+# snapshots da versão 1, em pickle: apagados na restauração sem serem lidos
+_EXTENSAO_PICKLE = ".pkl"
+_MODELOS = {modelo.__name__: modelo for modelo in (CidadaoDados,)}
+
+_tarefa: Optional[TarefaPeriodica] = None
+
+Entrada = tuple[str, Any, Optional[float]]
+
+
+def _codificar(valor: Any) -> Any:
+    """Converte um valor em cache para JSON, marcando os tipos não nativos."""
+    if valor is None or isinstance(valor, (bool, int, float, str)):
+        return valor
+    if isinstance(valor, Ausencia):
+        return {
+            "$tipo": "ausencia",
+            "status_code": valor.status_code,
+            "detalhe": _codificar(valor.detalhe),
+        }
+    if isinstance(valor, tuple):
+        return {"$tipo": "tuple", "itens": [_codificar(item) for item in valor]}
+    if isinstance(valor, list):
+        return [_codificar(item) for item in valor]
+    if isinstance(valor, dict) and all(isinstance(chave, str) for chave in valor):
+        if "$tipo" in valor:
+            raise TypeError("Dicionário com a chave reservada '$tipo'")
+        return {chave: _codificar(item) for chave, item in valor.items()}
+    if type(valor) is date:
+        return {"$tipo": "date", "valor": valor.isoformat()}
+    if isinstance(valor, np.ndarray) and valor.dtype.kind in "biuf":
+        return {
+            "$tipo": "ndarray",
+            "dtype": valor.dtype.str,
+            "forma": list(valor.shape),
+            "dados": base64.b64encode(np.ascontiguousarray(valor).tobytes()).decode(),
+        }
+    if _MODELOS.get(type(valor).__name__) is type(valor):
+        return {
+            "$tipo": "modelo",
+            "nome": type(valor).__name__,
+            "valor": valor.model_dump(mode="json"),
+        }
+    raise TypeError(f"Tipo não suportado no snapshot: {type(valor).__name__}")
+
+
+def _decodificar(objeto: dict[str, Any]) -> Any:
+    """Inverso de `_codificar`, aplicado a cada objeto JSON (object_hook)."""
+    tipo = objeto.get("$tipo")
+    if tipo is None:
+        return objeto
+    if tipo == "ausencia":
+        return Ausencia(objeto["status_code"], objeto["detalhe"])
+    if tipo == "tuple":
+        return tuple(objeto["itens"])
+    if tipo == "date":
+        return date.fromisoformat(objeto["valor"])
+    if tipo == "ndarray":
+        dados = base64.b64decode(objeto["dados"])
+        dtype = np.dtype(objeto["dtype"])
+        if dtype.kind not in "biuf":
+            raise ValueError(f"dtype não suportado no snapshot: {dtype}")
+        return np.frombuffer(dados, dtype=dtype).reshape(objeto["forma"]).copy()
+    if tipo == "modelo":
+        return _MODELOS[objeto["nome"]].model_validate(objeto["valor"])
+    raise ValueError(f"Tipo desconhecido no snapshot: {tipo}")
+
+
+def _serializar(snapshot: dict[str, Any]) -> bytes:
+    return gzip.compress(json.dumps(snapshot).encode())
+
+
+def _desserializar(dados: bytes) -> dict[str, Any]:
+    return json.loads(gzip.decompress(dados), object_hook=_decodificar)
+
+
+def _escritor() -> str:
+    # cada worker de cada instância grava o seu arquivo: com um único arquivo,
+    # o último a gravar apagaria as entradas dos demais
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _gravar(uri: str, dados: bytes) -> None:
+    if uri.startswith("gs://"):
+        bucket, caminho = parse_gcs(uri)
+        make_storage_client().bucket(bucket).blob(caminho).upload_from_string(dados)
+        return
+    destino = Path(uri)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    temporario = destino.with_name(f"{destino.name}.{os.getpid()}.tmp")
+    temporario.write_bytes(dados)
+    os.replace(temporario, destino)
+
+
+def _listar(prefixo: str) -> list[tuple[str, float]]:
+    """
+    URIs dos snapshots gravados sob `prefixo`, de todos os escritores, com o
+    instante (epoch) da última gravação de cada um.
+    """
+    extensoes = (_EXTENSAO, _EXTENSAO_PICKLE)
+    if prefixo.startswith("gs://"):
+        bucket, caminho = parse_gcs(prefixo)
+        blobs = make_storage_client().list_blobs(bucket, prefix=f"{caminho}/")
+        return [
+            (f"gs://{bucket}/{blob.name}", blob.updated.timestamp())
+            for blob in blobs
+            if blob.name.endswith(extensoes)
+        ]
+    diretorio = Path(prefixo)
+    return [
+        (str(caminho), caminho.stat().st_mtime)
+        for caminho in sorted(diretorio.glob("*"))
+        if caminho.name.endswith(extensoes)
+    ]
+
+
+def _ler(uri: str) -> Optional[bytes]:
+    if uri.startswith("gs://"):
+        bucket, caminho = parse_gcs(uri)
+        blob = make_storage_client().bucket(bucket).blob(caminho)
+        return blob.download_as_bytes() if blob.exists() else None
+    origem = Path(uri)
+    return origem.read_bytes() if origem.exists() else None
+
+
+def _remover(uri: str) -> None:
+    if uri.startswith("gs://"):
+        bucket, caminho = parse_gcs(uri)
+        make_storage_client().bucket(bucket).blob(caminho).delete()
+        return
+    Path(uri).unlink(missing_ok=True)
+
+
+def salvar_snapshot_caches(uri: Optional[str] = None) -> int:
+    """
+    Grava as entradas válidas dos caches em memória deste processo em um
+    arquivo próprio sob `uri` (diretório local ou prefixo gs://). Devolve o
+    número de entradas gravadas.
+    """
+    uri = uri or configs.CACHE_SNAPSHOT_URI
+    assert uri, "Defina CACHE_SNAPSHOT_URI"
+    caches: dict[str, list[Any]] = {}
+    total = 0
+    for cache in caches_registrados():
+        entradas = caches[cache.nome] = []
+        for chave, valor, expira_em in cache.exportar_entradas():
+            try:
+                entradas.append([chave, _codificar(valor), expira_em])
+            except TypeError:
+                logger.warning(
+                    f"Entrada do cache {cache.nome} fora do snapshot", exc_info=True
+                )
+        total += len(entradas)
+    snapshot = {"versao": _VERSAO_FORMATO, "criado_em": time.time(), "caches": caches}
+    destino = f"{uri.rstrip('/')}/{_escritor()}{_EXTENSAO}"
+    _gravar(destino, _serializar(snapshot))
+    logger.info(f"Snapshot dos caches gravado em {destino}: {total} entradas")
+    return total
+
+
+def _mesclar(snapshots: list[dict[str, list[Entrada]]]) -> dict[str, list[Entrada]]:
+    """
+    Une os snapshots de vários escritores. Para uma chave presente em mais de
+    um, fica a entrada que vence por último; as entradas são ordenadas pela
+    validade, de modo que as mais recentes sejam as últimas a sair do cache.
+    """
+    agora = time.time()
+    por_cache: dict[str, dict[str, Entrada]] = {}
+    for caches in snapshots:
+        for nome, entradas in caches.items():
+            mescladas = por_cache.setdefault(nome, {})
+            for entrada in entradas:
+                chave, _, expira_em = entrada
+                if expira_em is not None and expira_em <= agora:
+                    continue
+                atual = mescladas.get(chave)
+                if atual is None or _validade(entrada) > _validade(atual):
+                    mescladas[chave] = entrada
+    return {
+        nome: sorted(mescladas.values(), key=_validade)
+        for nome, mescladas in por_cache.items()
+    }
+
+
+def _validade(entrada: Entrada) -> float:
+    return math.inf if entrada[2] is None else entrada[2]
+
+
+def restaurar_snapshot_caches(uri: Optional[str] = None) -> int:
+    """
+    Preenche os caches em memória com os snapshots de todos os escritores sob
+    `uri`, descartando as entradas já expiradas. Snapshots sem nenhuma
+    entrada válida ou não regravados há mais de CACHE_SNAPSHOT_RETENCAO_SEGUNDOS
+    (de workers que não existem mais) são apagados, assim como os do formato
+    anterior, em pickle, que não são lidos. Devolve o número de entradas
+    restauradas.
+    """
+    uri = uri or configs.CACHE_SNAPSHOT_URI
+    assert uri, "Defina CACHE_SNAPSHOT_URI"
+    limite = time.time() - configs.CACHE_SNAPSHOT_RETENCAO_SEGUNDOS
+    snapshots: list[dict[str, list[Entrada]]] = []
+    for origem, gravado_em in _listar(uri.rstrip("/")):
+        if gravado_em < limite or origem.endswith(_EXTENSAO_PICKLE):
+            _remover(origem)
+            continue
+        dados = _ler(origem)
+        if dados is None:
+            continue
+        try:
+            snapshot = _desserializar(dados)
+            if snapshot.get("versao") != _VERSAO_FORMATO:
+                raise ValueError(f"Versão {snapshot.get('versao')}")
+            entradas = {
+                nome: [(chave, valor, expira_em) for chave, valor, expira_em in lista]
+                for nome, lista in snapshot["caches"].items()
+            }
+        except (OSError, ValueError, KeyError):
+            logger.warning(f"Snapshot dos caches em {origem} ilegível", exc_info=True)
+            continue
+        validos = _mesclar([entradas])
+        if not any(validos.values()):
+            _remover(origem)
+            continue
+        snapshots.append(validos)
+    if not snapshots:
+        logger.info(f"Nenhum snapshot dos caches em {uri}")
+        return 0
+    caches = _mesclar(snapshots)
+    total = 0
+    for cache in caches_registrados():
+        total += cache.importar_entradas(caches.get(cache.nome, []))
+    logger.info(
+        f"Snapshot dos caches restaurado de {uri} ({len(snapshots)} arquivos): "
+        f"{total} entradas"
+    )
+    return total
+
+
+def _salvar_periodicamente() -> None:
+    salvar_snapshot_caches()
+
+
+def iniciar_snapshot_caches() -> None:
+    """Restaura o snapshot e passa a gravá-lo periodicamente."""
+    global _tarefa
+
+    if not configs.CACHE_SNAPSHOT_URI or _tarefa is not None:
+        return
+    try:
+        restaurar_snapshot_caches()
+    except Exception:
+        # sem snapshot, a instância apenas começa com os caches vazios
+        logger.exception("Falha ao restaurar o snapshot dos caches")
+    _tarefa = TarefaPeriodica(
+        nome="snapshot-caches",
+        intervalo_segundos=configs.CACHE_SNAPSHOT_INTERVALO_SEGUNDOS,
+        funcao=_salvar_periodicamente,
+    )
+    _tarefa.iniciar()
+
+
+def parar_snapshot_caches() -> None:
+    """Interrompe as gravações periódicas e grava um último snapshot."""
+    global _tarefa
+
+    if _tarefa is None:
+        return
+    _tarefa.parar()
+    _tarefa = None
+    try:
+        salvar_snapshot_caches()
+    except Exception:
+        logger.exception("Falha ao gravar o snapshot dos caches")
@@ -1,14 +1,68 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
 from ip_mensageria_alocacao_api import routes
+from ip_mensageria_alocacao_api.core.armazem_cidadaos import (
+    iniciar_armazem_cidadaos,
+    parar_armazem_cidadaos,
+)
+from ip_mensageria_alocacao_api.core.armazem_procedimentos import (
+    iniciar_armazem_procedimentos,
+    parar_armazem_procedimentos,
+)
+from ip_mensageria_alocacao_api.core.catalogo_embeddings import (
+    iniciar_catalogo_embeddings,
+    parar_catalogo_embeddings,
+)
+from ip_mensageria_alocacao_api.core.censo_municipios import (
+    iniciar_censo_municipios,
+    parar_censo_municipios,
+)
 from ip_mensageria_alocacao_api.core.classificadores import carregar_classificadores
+from ip_mensageria_alocacao_api.core.indice_cidadaos import (
+    iniciar_indice_cidadaos,
+    parar_indice_cidadaos,
+)
+from ip_mensageria_alocacao_api.core.snapshot_cache import (
+    iniciar_snapshot_caches,
+    parar_snapshot_caches,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Censo dos municípios, usado nas características dos cidadãos
+    iniciar_censo_municipios()
+    # Armazém local de cidadãos (opcional, ver ARMAZEM_CIDADAOS_ATIVO)
+    iniciar_armazem_cidadaos()
+    # Índice de ids conhecidos, para recusar ids inexistentes (opcional, ver
+    # INDICE_CIDADAOS_ATIVO)
+    iniciar_indice_cidadaos()
+    # Datas do último procedimento em memória, sincronizadas por delta (opcional,
+    # ver ARMAZEM_PROCEDIMENTOS_*)
+    iniciar_armazem_procedimentos()
+    # Catálogo de embeddings de templates e mídias (ver CATALOGO_EMBEDDINGS_*)
+    iniciar_catalogo_embeddings()
+    # Caches restaurados antes de a instância receber tráfego; o último
+    # snapshot é gravado no encerramento gracioso do worker (SIGTERM, ver
+    # STOPSIGNAL no Dockerfile e CACHE_SNAPSHOT_URI)
+    iniciar_snapshot_caches()
+    yield
+    parar_snapshot_caches()
+    parar_catalogo_embeddings()
+    parar_armazem_procedimentos()
+    parar_indice_cidadaos()
+    parar_armazem_cidadaos()
+    parar_censo_municipios()
 
 
 def create_app(carregar_classificadores_na_inicializacao: bool = True) -> FastAPI:
     """Create a FastAPI application."""
 
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
 
     # Set all CORS enabled origins
     app.add_middleware(
@@ -1,14 +1,18 @@
 import logging
+import time
 from datetime import timedelta
 from http import HTTPStatus
-from typing import Sequence
+from typing import Any, Optional, Sequence
 
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
 from fastapi.security import OAuth2PasswordRequestForm
 
 from ip_mensageria_alocacao_api.apis import (
     alocar_entre_mensagens,
+    alocar_entre_mensagens_em_lote,
+    prever_e_alocar_entre_mensagens,
     prever_probabilidade_mensagem_ser_efetiva,
+    prever_probabilidades_mensagens_em_lote,
 )
 from ip_mensageria_alocacao_api.core import configs
 from ip_mensageria_alocacao_api.core.autenticacao import (
@@ -16,20 +20,65 @@ from ip_mensageria_alocacao_api.core.autenticacao import (
     criar_token_acesso,
     obter_usuario_atual_via_api_key,
 )
+from ip_mensageria_alocacao_api.core.bd import (
+    definir_endpoint,
+    estatisticas_consultas,
+)
+from ip_mensageria_alocacao_api.core.cache import estatisticas_caches
+from ip_mensageria_alocacao_api.core.carregador import estatisticas_carregadores
 from ip_mensageria_alocacao_api.core.classificadores import carregar_classificadores
+from ip_mensageria_alocacao_api.core.executores import (
+    calcular_prazo,
+    estatisticas_executores,
+    executar_bloqueante,
+)
 from ip_mensageria_alocacao_api.core.modelos import (
+    Classificador,
     LinhaCuidado,
     Mensagem,
     MensagemTipo,
     Predicao,
+    PredicaoLote,
     PredicaoSimulacao,
+    PrefetchProgresso,
+    PrefetchRequisicao,
     Token,
     UsuarioNaBase,
 )
+from ip_mensageria_alocacao_api.core.prefetch import (
+    iniciar_prefetch,
+    obter_progresso_prefetch,
+)
+
+
+async def _iniciar_requisicao(request: Request) -> None:
+    # assíncrona para rodar no contexto da requisição: as consultas feitas
+    # por ela são contabilizadas sob a rota
+    definir_endpoint(request.scope["route"].path)
+    # dependências do router rodam antes das da rota: o prazo da requisição
+    # conta a partir daqui, com a autenticação dentro dele
+    request.state.inicio = time.monotonic()
 
-router = APIRouter()
+
+router = APIRouter(dependencies=[Depends(_iniciar_requisicao)])
 logger = logging.getLogger(__name__)
 
+# Prazo da requisição informado pelo chamador, em milissegundos; se omitido,
+# vale PREDICAO_PRAZO_MILISSEGUNDOS.
+_PRAZO_MS = Query(
+    None,
+    gt=0,
+    description="Prazo para as consultas dos dados do cidadão, em milissegundos. "
+    "Vencido o prazo, a predição usa valores padrão e volta com `degradada`.",
+)
+
+
+async def _prazo_da_requisicao(
+    request: Request,
+    prazo_ms: Optional[float] = _PRAZO_MS,
+) -> Optional[float]:
+    return calcular_prazo(prazo_ms, inicio=request.state.inicio)
+
 
 @router.get("/")
 async def index() -> dict[str, str]:
@@ -43,7 +92,11 @@ async def index() -> dict[str, str]:
 async def login_para_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
 ) -> dict[str, str]:
-    user = autenticar_usuario(form_data.username, form_data.password)
+    user = await executar_bloqueante(
+        autenticar_usuario,
+        form_data.username,
+        form_data.password,
+    )
 
     if not user:
         raise HTTPException(
@@ -62,20 +115,12 @@ async def login_para_token(
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@router.post("/prever_efetividade_mensagem", response_model=Predicao)
-async def prever_efetividade_mensagem(
-    cidadao_id: str,
-    linha_cuidado: LinhaCuidado,
-    mensagem_tipo: MensagemTipo,
-    mensagem: Mensagem,
-    request: Request,
-    usuario: UsuarioNaBase = Depends(obter_usuario_atual_via_api_key),
-) -> Predicao:
+async def _obter_classificadores(request: Request) -> Classificador:
     try:
-        classificadores = request.app.state.classificadores
+        return request.app.state.classificadores
     except AttributeError:
         try:
-            classificadores = carregar_classificadores()
+            classificadores = await executar_bloqueante(carregar_classificadores)
         except RuntimeError as exc:
             logger.exception("Falha ao carregar classificadores")
             raise HTTPException(
@@ -90,13 +135,53 @@ async def prever_efetividade_mensagem(
             ) from exc
 
         request.app.state.classificadores = classificadores
+        return classificadores
+
 
-    return prever_probabilidade_mensagem_ser_efetiva(
+@router.post("/prever_efetividade_mensagem", response_model=Predicao)
+async def prever_efetividade_mensagem(
+    cidadao_id: str,
+    linha_cuidado: LinhaCuidado,
+    mensagem_tipo: MensagemTipo,
+    mensagem: Mensagem,
+    request: Request,
+    prazo: Optional[float] = Depends(_prazo_da_requisicao),
+    usuario: UsuarioNaBase = Depends(obter_usuario_atual_via_api_key),
+) -> Predicao:
+    classificadores = await _obter_classificadores(request)
+    return await executar_bloqueante(
+        prever_probabilidade_mensagem_ser_efetiva,
         cidadao_id=cidadao_id,
         linha_cuidado=linha_cuidado,
         mensagem_tipo=mensagem_tipo,
         mensagem=mensagem,
         classificadores=classificadores,
+        prazo=prazo,
+    )
+
+
+@router.post(
+    "/prever_efetividade_mensagens/lote",
+    response_model=list[PredicaoLote],
+)
+async def prever_efetividade_mensagens_em_lote(
+    linha_cuidado: LinhaCuidado,
+    mensagem_tipo: MensagemTipo,
+    request: Request,
+    cidadaos_ids: list[str] = Body(...),
+    mensagens: list[Mensagem] = Body(...),
+    prazo: Optional[float] = Depends(_prazo_da_requisicao),
+    usuario: UsuarioNaBase = Depends(obter_usuario_atual_via_api_key),
+) -> list[PredicaoLote]:
+    classificadores = await _obter_classificadores(request)
+    return await executar_bloqueante(
+        prever_probabilidades_mensagens_em_lote,
+        cidadaos_ids=cidadaos_ids,
+        linha_cuidado=linha_cuidado,
+        mensagem_tipo=mensagem_tipo,
+        mensagens=mensagens,
+        classificadores=classificadores,
+        prazo=prazo,
     )
 
 
@@ -106,3 +191,86 @@ async def alocar(
     usuario: UsuarioNaBase = Depends(obter_usuario_atual_via_api_key),
 ) -> PredicaoSimulacao:
     return alocar_entre_mensagens(predicoes)
+
+
+@router.post("/alocar/lote", response_model=list[PredicaoSimulacao])
+async def alocar_em_lote(
+    problemas: Sequence[Sequence[Predicao]],
+    usuario: UsuarioNaBase = Depends(obter_usuario_atual_via_api_key),
+) -> list[PredicaoSimulacao]:
+    if not problemas or any(len(predicoes) == 0 for predicoes in problemas):
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail="Bad Request :: Cada problema de alocação precisa de ao menos uma predição.",
+        )
+    return await executar_bloqueante(alocar_entre_mensagens_em_lote, problemas)
+
+
+@router.post("/prever_e_alocar", response_model=PredicaoSimulacao)
+async def prever_e_alocar(
+    cidadao_id: str,
+    linha_cuidado: LinhaCuidado,
+    mensagem_tipo: MensagemTipo,
+    mensagens: list[Mensagem],
+    request: Request,
+    prazo: Optional[float] = Depends(_prazo_da_requisicao),
+    usuario: UsuarioNaBase = Depends(obter_usuario_atual_via_api_key),
+) -> PredicaoSimulacao:
+    if not mensagens:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail="Bad Request :: Nenhuma mensagem candidata informada.",
+        )
+    classificadores = await _obter_classificadores(request)
+    return await executar_bloqueante(
+        prever_e_alocar_entre_mensagens,
+        cidadao_id=cidadao_id,
+        linha_cuidado=linha_cuidado,
+        mensagem_tipo=mensagem_tipo,
+        mensagens=mensagens,
+        classificadores=classificadores,
+        prazo=prazo,
+    )
+
+
+@router.post(
+    "/prefetch",
+    response_model=PrefetchProgresso,
+    status_code=HTTPStatus.ACCEPTED,
+)
+async def prefetch(
+    requisicao: PrefetchRequisicao,
+    usuario: UsuarioNaBase = Depends(obter_usuario_atual_via_api_key),
+) -> PrefetchProgresso:
+    if not requisicao.cidadaos_ids and not requisicao.mensagens:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail="Bad Request :: Nenhum cidadão ou mensagem informado.",
+        )
+    return iniciar_prefetch(requisicao)
+
+
+@router.get("/prefetch/{prefetch_id}", response_model=PrefetchProgresso)
+async def progresso_prefetch(
+    prefetch_id: str,
+    usuario: UsuarioNaBase = Depends(obter_usuario_atual_via_api_key),
+) -> PrefetchProgresso:
+    progresso = obter_progresso_prefetch(prefetch_id)
+    if progresso is None:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND,
+            detail="Not Found :: Prefetch não encontrado neste processo.",
+        )
+    return progresso
+
+
+@router.get("/estatisticas")
+async def estatisticas(
+    usuario: UsuarioNaBase = Depends(obter_usuario_atual_via_api_key),
+) -> dict[str, Any]:
+    return {
+        "executores": estatisticas_executores(),
+        "carregadores": estatisticas_carregadores(),
+        "caches": estatisticas_caches(),
+        "consultas_bigquery": estatisticas_consultas(),
+    }
@@ -0,0 +1,39 @@
+import threading
+
+from ip_mensageria_alocacao_api.core.agendador import TarefaPeriodica
+
+
+def test_tarefa_periodica_executa_e_para():
+    executou = threading.Event()
+    tarefa = TarefaPeriodica(
+        nome="teste",
+        intervalo_segundos=60,
+        funcao=executou.set,
+        executar_imediatamente=True,
+    )
+    tarefa.iniciar()
+    assert executou.wait(5)
+    tarefa.parar(timeout=5)
+    assert tarefa._thread is None
+
+
+def test_tarefa_periodica_continua_apos_falha():
+    execucoes = []
+    terminou = threading.Event()
+
+    def funcao():
+        execucoes.append(1)
+        if len(execucoes) == 1:
+            raise RuntimeError("falha")
+        terminou.set()
+
+    tarefa = TarefaPeriodica(
+        nome="teste",
+        intervalo_segundos=0.01,
+        funcao=funcao,
+        executar_imediatamente=True,
+    )
+    tarefa.iniciar()
+    assert terminou.wait(5)
+    tarefa.parar(timeout=5)
+    assert len(execucoes) >= 2
@@ -1,3 +1,4 @@
+import threading
 from unittest.mock import Mock, patch
 
 import numpy as np
@@ -6,14 +7,20 @@ from fastapi import HTTPException
 
 from ip_mensageria_alocacao_api.apis import (
     alocar_entre_mensagens,
+    alocar_entre_mensagens_em_lote,
+    prever_e_alocar_entre_mensagens,
     prever_probabilidade_mensagem_ser_efetiva,
+    prever_probabilidades_mensagens_em_lote,
 )
+from ip_mensageria_alocacao_api.core import configs
+from ip_mensageria_alocacao_api.core.executores import calcular_prazo
 from ip_mensageria_alocacao_api.core.modelos import (
     DiaSemana,
     LinhaCuidado,
     Mensagem,
     MensagemTipo,
     Predicao,
+    PredicaoLote,
     PredicaoSimulacao,
     Template,
 )
@@ -83,11 +90,11 @@ def sample_mensagem_sem_template():
 @patch("ip_mensageria_alocacao_api.apis.obter_caracteristicas_usuario")
 @patch("ip_mensageria_alocacao_api.apis.obter_tempo_desde_ultimo_procedimento")
 @patch("ip_mensageria_alocacao_api.apis.obter_template_embedding_por_nome")
-@patch("ip_mensageria_alocacao_api.apis.preparar_atributos_para_predicao")
-@patch("ip_mensageria_alocacao_api.apis.converter_df_em_pool")
+@patch("ip_mensageria_alocacao_api.apis.montar_matriz_atributos")
+@patch("ip_mensageria_alocacao_api.apis.converter_matriz_em_pool")
 def test_prever_probabilidade_com_template_nome(
     mock_converter,
-    mock_preparar,
+    mock_montar,
     mock_obter_template,
     mock_obter_tempo,
     mock_obter_caracteristicas,
@@ -98,7 +105,7 @@ def test_prever_probabilidade_com_template_nome(
     mock_obter_caracteristicas.return_value = mock_cidadao_caracteristicas
     mock_obter_tempo.return_value = 10
     mock_obter_template.return_value = np.array([0.1, 0.2, 0.3])
-    mock_preparar.return_value = Mock()
+    mock_montar.return_value = Mock()
     mock_converter.return_value = Mock()
 
     result = prever_probabilidade_mensagem_ser_efetiva(
@@ -117,11 +124,11 @@ def test_prever_probabilidade_com_template_nome(
 @patch("ip_mensageria_alocacao_api.apis.obter_caracteristicas_usuario")
 @patch("ip_mensageria_alocacao_api.apis.obter_tempo_desde_ultimo_procedimento")
 @patch("ip_mensageria_alocacao_api.apis.obter_template_embedding_por_texto")
-@patch("ip_mensageria_alocacao_api.apis.preparar_atributos_para_predicao")
-@patch("ip_mensageria_alocacao_api.apis.converter_df_em_pool")
+@patch("ip_mensageria_alocacao_api.apis.montar_matriz_atributos")
+@patch("ip_mensageria_alocacao_api.apis.converter_matriz_em_pool")
 def test_prever_probabilidade_com_template(
     mock_converter,
-    mock_preparar,
+    mock_montar,
     mock_obter_template,
     mock_obter_tempo,
     mock_obter_caracteristicas,
@@ -132,7 +139,7 @@ def test_prever_probabilidade_com_template(
     mock_obter_caracteristicas.return_value = mock_cidadao_caracteristicas
     mock_obter_tempo.return_value = 10
     mock_obter_template.return_value = np.array([0.1, 0.2, 0.3])
-    mock_preparar.return_value = Mock()
+    mock_montar.return_value = Mock()
     mock_converter.return_value = Mock()
 
     result = prever_probabilidade_mensagem_ser_efetiva(
@@ -169,9 +176,361 @@ def test_prever_probabilidade_sem_template(
     assert exc_info.value.status_code == 400
 
 
-@patch("ip_mensageria_alocacao_api.apis.thompson_sample")
+@pytest.fixture
+def consulta_lenta():
+    """Libera ao fim do teste as consultas que esperam por ela."""
+    liberar = threading.Event()
+    yield liberar
+    liberar.set()
+
+
+@patch("ip_mensageria_alocacao_api.apis.obter_caracteristicas_usuario")
+@patch("ip_mensageria_alocacao_api.apis.obter_tempo_desde_ultimo_procedimento")
+@patch("ip_mensageria_alocacao_api.apis.obter_template_embedding_por_nome")
+@patch("ip_mensageria_alocacao_api.apis.montar_matriz_atributos")
+@patch("ip_mensageria_alocacao_api.apis.converter_matriz_em_pool")
+def test_prever_probabilidade_degradada_apos_prazo(
+    mock_converter,
+    mock_montar,
+    mock_obter_template,
+    mock_obter_tempo,
+    mock_obter_caracteristicas,
+    mock_classificadores,
+    mock_cidadao_caracteristicas,
+    sample_mensagem,
+    consulta_lenta,
+):
+    mock_obter_caracteristicas.side_effect = lambda cidadao_id: (
+        consulta_lenta.wait(5) and mock_cidadao_caracteristicas
+    )
+    mock_obter_tempo.return_value = 10
+    mock_obter_template.return_value = np.array([0.1, 0.2, 0.3])
+    mock_montar.return_value = Mock()
+    mock_converter.return_value = Mock()
+
+    result = prever_probabilidade_mensagem_ser_efetiva(
+        cidadao_id="123",
+        linha_cuidado=LinhaCuidado.cronicos,
+        mensagem_tipo=MensagemTipo.mensagem_inicial,
+        mensagem=sample_mensagem,
+        classificadores=mock_classificadores,
+        prazo=calcular_prazo(50),
+    )
+
+    assert result.degradada
+    assert result.probabilidade == pytest.approx(0.75)
+    # atributos do cidadão ficam para a imputação
+    entrada = mock_montar.call_args.args[1][0]
+    assert entrada.cidadao_caracteristicas.idade is None
+    assert entrada.tempo_desde_ultimo_procedimento == 10
+
+
+@patch("ip_mensageria_alocacao_api.apis.obter_caracteristicas_usuario")
+@patch("ip_mensageria_alocacao_api.apis.obter_tempo_desde_ultimo_procedimento")
+@patch("ip_mensageria_alocacao_api.apis.obter_template_embedding_por_nome")
+def test_prever_probabilidade_sem_embedding_no_prazo(
+    mock_obter_template,
+    mock_obter_tempo,
+    mock_obter_caracteristicas,
+    mock_classificadores,
+    mock_cidadao_caracteristicas,
+    sample_mensagem,
+    consulta_lenta,
+):
+    mock_obter_caracteristicas.return_value = mock_cidadao_caracteristicas
+    mock_obter_tempo.return_value = 10
+    mock_obter_template.side_effect = lambda nome: consulta_lenta.wait(5)
+
+    with pytest.raises(HTTPException) as exc_info:
+        prever_probabilidade_mensagem_ser_efetiva(
+            cidadao_id="123",
+            linha_cuidado=LinhaCuidado.cronicos,
+            mensagem_tipo=MensagemTipo.mensagem_inicial,
+            mensagem=sample_mensagem,
+            classificadores=mock_classificadores,
+            prazo=calcular_prazo(50),
+        )
+    assert exc_info.value.status_code == 504
+
+
+@patch("ip_mensageria_alocacao_api.apis.obter_caracteristicas_usuarios")
+@patch("ip_mensageria_alocacao_api.apis.obter_tempos_desde_ultimo_procedimento")
+@patch("ip_mensageria_alocacao_api.apis.obter_template_embedding_por_nome")
+@patch("ip_mensageria_alocacao_api.apis.montar_matriz_atributos")
+@patch("ip_mensageria_alocacao_api.apis.converter_matriz_em_pool")
+def test_prever_probabilidades_em_lote_uma_chamada_por_modelo(
+    mock_converter,
+    mock_montar,
+    mock_obter_template,
+    mock_obter_tempos,
+    mock_obter_caracteristicas,
+    mock_classificadores,
+    mock_cidadao_caracteristicas,
+    sample_mensagem,
+):
+    mock_obter_caracteristicas.side_effect = lambda ids: dict.fromkeys(
+        ids, mock_cidadao_caracteristicas
+    )
+    mock_obter_tempos.side_effect = lambda ids, linha_cuidado: dict.fromkeys(ids, 10)
+    mock_obter_template.return_value = np.array([0.1, 0.2, 0.3])
+    mock_montar.side_effect = lambda classificadores, entradas: np.ones(
+        (len(entradas), 1)
+    )
+    mock_converter.side_effect = lambda matriz, classificadores: matriz
+    mock_classificadores.modelos[0].predict_proba.side_effect = lambda pool, **kwargs: (
+        np.tile([0.3, 0.7], (len(pool), 1))
+    )
+    mock_classificadores.modelos[1].predict_proba.side_effect = lambda pool, **kwargs: (
+        np.tile([0.2, 0.8], (len(pool), 1))
+    )
+    outra_mensagem = sample_mensagem.model_copy(update={"horario": 15})
+
+    result = prever_probabilidades_mensagens_em_lote(
+        cidadaos_ids=["1", "2", "3"],
+        linha_cuidado=LinhaCuidado.cronicos,
+        mensagem_tipo=MensagemTipo.mensagem_inicial,
+        mensagens=[sample_mensagem, outra_mensagem],
+        classificadores=mock_classificadores,
+    )
+
+    assert len(result) == 6
+    assert all(isinstance(r, PredicaoLote) for r in result)
+    assert [r.cidadao_id for r in result] == ["1", "1", "2", "2", "3", "3"]
+    assert all(r.probabilidade == pytest.approx(0.75) for r in result)
+    assert all(r.erro is None for r in result)
+    for modelo in mock_classificadores.modelos:
+        assert modelo.predict_proba.call_count == 1
+    assert mock_converter.call_count == 1
+    mock_obter_caracteristicas.assert_called_once_with(["1", "2", "3"])
+    mock_obter_tempos.assert_called_once_with(["1", "2", "3"], LinhaCuidado.cronicos)
+
+
+@patch("ip_mensageria_alocacao_api.apis.obter_caracteristicas_usuarios")
+@patch("ip_mensageria_alocacao_api.apis.obter_tempos_desde_ultimo_procedimento")
+@patch("ip_mensageria_alocacao_api.apis.obter_template_embedding_por_nome")
+@patch("ip_mensageria_alocacao_api.apis.montar_matriz_atributos")
+@patch("ip_mensageria_alocacao_api.apis.converter_matriz_em_pool")
+def test_prever_probabilidades_em_lote_erros_por_linha(
+    mock_converter,
+    mock_montar,
+    mock_obter_template,
+    mock_obter_tempos,
+    mock_obter_caracteristicas,
+    mock_classificadores,
+    mock_cidadao_caracteristicas,
+    sample_mensagem,
+    sample_mensagem_sem_template,
+):
+    # cidadãos não encontrados ficam de fora do resultado
+    mock_obter_caracteristicas.side_effect = lambda ids: {
+        c: mock_cidadao_caracteristicas for c in ids if c != "desconhecido"
+    }
+    mock_obter_tempos.side_effect = lambda ids, linha_cuidado: dict.fromkeys(ids, 10)
+    mock_obter_template.return_value = np.array([0.1, 0.2, 0.3])
+    mock_montar.side_effect = lambda classificadores, entradas: np.ones(
+        (len(entradas), 1)
+    )
+    mock_converter.side_effect = lambda matriz, classificadores: matriz
+
+    result = prever_probabilidades_mensagens_em_lote(
+        cidadaos_ids=["1", "desconhecido"],
+        linha_cuidado=LinhaCuidado.cronicos,
+        mensagem_tipo=MensagemTipo.mensagem_inicial,
+        mensagens=[sample_mensagem, sample_mensagem_sem_template],
+        classificadores=mock_classificadores,
+    )
+
+    assert len(result) == 4
+    assert result[0].erro is None
+    assert result[0].probabilidade == pytest.approx(0.75)
+    assert "template" in result[1].erro
+    assert result[1].probabilidade is None
+    assert "Cidadão não encontrado" in result[2].erro
+    assert "Cidadão não encontrado" in result[3].erro
+    assert len(mock_montar.call_args.args[1]) == 1
+
+
+@patch("ip_mensageria_alocacao_api.apis.obter_caracteristicas_usuarios")
+@patch("ip_mensageria_alocacao_api.apis.obter_tempos_desde_ultimo_procedimento")
+@patch("ip_mensageria_alocacao_api.apis.obter_template_embedding_por_nome")
+@patch("ip_mensageria_alocacao_api.apis.montar_matriz_atributos")
+@patch("ip_mensageria_alocacao_api.apis.converter_matriz_em_pool")
+def test_prever_probabilidades_em_lote_degrada_cidadaos_lentos(
+    mock_converter,
+    mock_montar,
+    mock_obter_template,
+    mock_obter_tempos,
+    mock_obter_caracteristicas,
+    mock_classificadores,
+    mock_cidadao_caracteristicas,
+    sample_mensagem,
+    consulta_lenta,
+    monkeypatch,
+):
+    def caracteristicas(ids):
+        if "lento" in ids:
+            consulta_lenta.wait(5)
+        return dict.fromkeys(ids, mock_cidadao_caracteristicas)
+
+    # um cidadão por job: só a parte do cidadão lento é degradada
+    monkeypatch.setattr(configs, "CARREGADOR_MAX_LOTE", 1)
+    mock_obter_caracteristicas.side_effect = caracteristicas
+    mock_obter_tempos.side_effect = lambda ids, linha_cuidado: dict.fromkeys(ids, 10)
+    mock_obter_template.return_value = np.array([0.1, 0.2, 0.3])
+    mock_montar.side_effect = lambda classificadores, entradas: np.ones(
+        (len(entradas), 1)
+    )
+    mock_converter.side_effect = lambda matriz, classificadores: matriz
+    for modelo in mock_classificadores.modelos:
+        modelo.predict_proba.side_effect = lambda pool, **kwargs: np.tile(
+            [0.3, 0.7], (len(pool), 1)
+        )
+
+    result = prever_probabilidades_mensagens_em_lote(
+        cidadaos_ids=["1", "lento"],
+        linha_cuidado=LinhaCuidado.cronicos,
+        mensagem_tipo=MensagemTipo.mensagem_inicial,
+        mensagens=[sample_mensagem],
+        classificadores=mock_classificadores,
+        prazo=calcular_prazo(50),
+    )
+
+    assert [r.degradada for r in result] == [False, True]
+    assert all(r.erro is None for r in result)
+    assert all(r.probabilidade == pytest.approx(0.7) for r in result)
+
+
+@patch("ip_mensageria_alocacao_api.apis.obter_caracteristicas_usuarios")
+@patch("ip_mensageria_alocacao_api.apis.obter_tempos_desde_ultimo_procedimento")
+@patch("ip_mensageria_alocacao_api.apis.obter_template_embedding_por_nome")
+@patch("ip_mensageria_alocacao_api.apis.montar_matriz_atributos")
+@patch("ip_mensageria_alocacao_api.apis.converter_matriz_em_pool")
+def test_prever_probabilidades_em_lote_em_partes(
+    mock_converter,
+    mock_montar,
+    mock_obter_template,
+    mock_obter_tempos,
+    mock_obter_caracteristicas,
+    mock_classificadores,
+    mock_cidadao_caracteristicas,
+    sample_mensagem,
+    monkeypatch,
+):
+    monkeypatch.setattr(configs, "CARREGADOR_MAX_LOTE", 2)
+    monkeypatch.setattr(configs, "PREDICAO_LINHAS_POR_MATRIZ", 3)
+    mock_obter_caracteristicas.side_effect = lambda ids: dict.fromkeys(
+        ids, mock_cidadao_caracteristicas
+    )
+    mock_obter_tempos.side_effect = lambda ids, linha_cuidado: dict.fromkeys(ids, 10)
+    mock_obter_template.return_value = np.array([0.1, 0.2, 0.3])
+    mock_montar.side_effect = lambda classificadores, entradas: np.ones(
+        (len(entradas), 1)
+    )
+    mock_converter.side_effect = lambda matriz, classificadores: matriz
+    for modelo in mock_classificadores.modelos:
+        modelo.predict_proba.side_effect = lambda pool, **kwargs: np.tile(
+            [0.3, 0.7], (len(pool), 1)
+        )
+
+    result = prever_probabilidades_mensagens_em_lote(
+        cidadaos_ids=["1", "2", "3", "4", "5"],
+        linha_cuidado=LinhaCuidado.cronicos,
+        mensagem_tipo=MensagemTipo.mensagem_inicial,
+        mensagens=[sample_mensagem],
+        classificadores=mock_classificadores,
+    )
+
+    assert len(result) == 5
+    assert all(r.probabilidade == pytest.approx(0.7) for r in result)
+    # um job por parte de até CARREGADOR_MAX_LOTE cidadãos
+    assert sorted(c.args[0] for c in mock_obter_caracteristicas.call_args_list) == [
+        ["1", "2"],
+        ["3", "4"],
+        ["5"],
+    ]
+    assert mock_obter_tempos.call_count == 3
+    # matrizes de até PREDICAO_LINHAS_POR_MATRIZ linhas
+    assert [len(c.args[1]) for c in mock_montar.call_args_list] == [3, 2]
+
+
+@patch("ip_mensageria_alocacao_api.apis.obter_caracteristicas_usuario")
+@patch("ip_mensageria_alocacao_api.apis.obter_tempo_desde_ultimo_procedimento")
+@patch("ip_mensageria_alocacao_api.apis.obter_template_embedding_por_nome")
+@patch("ip_mensageria_alocacao_api.apis.montar_matriz_atributos")
+@patch("ip_mensageria_alocacao_api.apis.converter_matriz_em_pool")
+def test_prever_e_alocar_deduplica_e_descarta_invalidas(
+    mock_converter,
+    mock_montar,
+    mock_obter_template,
+    mock_obter_tempo,
+    mock_obter_caracteristicas,
+    mock_classificadores,
+    mock_cidadao_caracteristicas,
+    sample_mensagem,
+    sample_mensagem_sem_template,
+):
+    mock_obter_caracteristicas.return_value = mock_cidadao_caracteristicas
+    mock_obter_tempo.return_value = 10
+    mock_obter_template.return_value = np.array([0.1, 0.2, 0.3])
+    mock_montar.side_effect = lambda classificadores, entradas: np.array(
+        [[e.mensagem_horario] for e in entradas], dtype=float
+    )
+    mock_converter.side_effect = lambda matriz, classificadores: matriz
+    for modelo in mock_classificadores.modelos:
+        modelo.predict_proba.side_effect = lambda pool, **kwargs: np.column_stack(
+            [1 - pool[:, 0] / 100, pool[:, 0] / 100]
+        )
+    tarde = sample_mensagem.model_copy(update={"horario": 15})
+
+    result = prever_e_alocar_entre_mensagens(
+        cidadao_id="123",
+        linha_cuidado=LinhaCuidado.cronicos,
+        mensagem_tipo=MensagemTipo.mensagem_inicial,
+        mensagens=[
+            sample_mensagem,
+            tarde,
+            sample_mensagem,
+            sample_mensagem_sem_template,
+        ],
+        classificadores=mock_classificadores,
+    )
+
+    assert isinstance(result, PredicaoSimulacao)
+    assert result.mensagem in (sample_mensagem, tarde)
+    assert mock_obter_caracteristicas.call_count == 1
+    # duplicada e inválida descartadas
+    assert len(mock_montar.call_args.args[1]) == 2
+    for modelo in mock_classificadores.modelos:
+        assert modelo.predict_proba.call_count == 1
+    assert not result.degradada
+
+
+@patch("ip_mensageria_alocacao_api.apis.obter_caracteristicas_usuario")
+@patch("ip_mensageria_alocacao_api.apis.obter_tempo_desde_ultimo_procedimento")
+def test_prever_e_alocar_sem_mensagens_validas(
+    mock_obter_tempo,
+    mock_obter_caracteristicas,
+    mock_classificadores,
+    mock_cidadao_caracteristicas,
+    sample_mensagem_sem_template,
+):
+    mock_obter_caracteristicas.return_value = mock_cidadao_caracteristicas
+    mock_obter_tempo.return_value = 10
+
+    with pytest.raises(HTTPException) as exc_info:
+        prever_e_alocar_entre_mensagens(
+            cidadao_id="123",
+            linha_cuidado=LinhaCuidado.cronicos,
+            mensagem_tipo=MensagemTipo.mensagem_inicial,
+            mensagens=[sample_mensagem_sem_template],
+            classificadores=mock_classificadores,
+        )
+    assert exc_info.value.status_code == 400
+
+
+@patch("ip_mensageria_alocacao_api.apis.thompson_sample_vetorizado")
 def test_alocar_entre_mensagens(mock_thompson):
-    mock_thompson.side_effect = [0.5, 0.8, 0.3]  # amostras
+    mock_thompson.return_value = np.array([0.5, 0.8, 0.3])  # amostras
 
     mensagens = [
         Mensagem(dia_semana=DiaSemana.segunda, horario=10, template_nome="t1"),
@@ -195,3 +554,34 @@ def test_alocar_entre_mensagens(mock_thompson):
 def test_alocar_entre_mensagens_listas_vazias():
     with pytest.raises(AssertionError):
         alocar_entre_mensagens(predicoes=[])
+
+
+@patch("ip_mensageria_alocacao_api.apis.thompson_sample_vetorizado")
+def test_alocar_entre_mensagens_em_lote(mock_thompson):
+    mock_thompson.return_value = np.array([0.5, 0.8, 0.3, 0.9, 0.1, 0.2])
+
+    mensagens = [
+        Mensagem(dia_semana=DiaSemana.segunda, horario=h, template_nome=f"t{h}")
+        for h in range(6)
+    ]
+    predicoes = [
+        Predicao(mensagem=m, probabilidade=0.5, erro_padrao=0.1) for m in mensagens
+    ]
+
+    result = alocar_entre_mensagens_em_lote(
+        [predicoes[:3], predicoes[3:4], predicoes[4:]]
+    )
+
+    assert mock_thompson.call_count == 1
+    assert [r.mensagem for r in result] == [mensagens[1], mensagens[3], mensagens[5]]
+    assert [r.probabilidade_sorteada for r in result] == [0.8, 0.9, 0.2]
+
+
+def test_alocar_entre_mensagens_em_lote_problema_vazio():
+    predicao = Predicao(
+        mensagem=Mensagem(dia_semana=DiaSemana.segunda, horario=10, template_nome="t"),
+        probabilidade=0.5,
+        erro_padrao=0.1,
+    )
+    with pytest.raises(AssertionError):
+        alocar_entre_mensagens_em_lote([[predicao], []])
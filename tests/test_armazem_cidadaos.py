@@ -0,0 +1,108 @@
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+from ip_mensageria_alocacao_api.core import armazem_cidadaos
+from ip_mensageria_alocacao_api.core.armazem_cidadaos import ArmazemCidadaos
+from ip_mensageria_alocacao_api.core.censo_municipios import CensoMunicipios
+from ip_mensageria_alocacao_api.core.modelos import CidadaoCaracteristicas
+
+
+def _linha(cidadao_id, data_nascimento, sexo, raca_cor, plano, municipio):
+    return SimpleNamespace(
+        cidadao_id=cidadao_id,
+        data_nascimento=data_nascimento,
+        sexo=sexo,
+        raca_cor=raca_cor,
+        plano_saude_privado=plano,
+        municipio_id_sus=municipio,
+    )
+
+
+@pytest.fixture
+def armazem():
+    censo = CensoMunicipios.de_linhas(
+        [
+            SimpleNamespace(cod_mun_ibge="210000", perc_dom_zona_rural=0.25),
+            SimpleNamespace(cod_mun_ibge="220000", perc_dom_zona_rural=0.5),
+        ]
+    )
+    return ArmazemCidadaos.de_linhas(
+        [
+            _linha("1", date(1980, 12, 31), "Feminino", "Parda", False, "210000"),
+            _linha("2", None, None, None, None, None),
+            _linha("3", date(2000, 1, 1), "Masculino", "Branca", True, "220000"),
+        ],
+        censo,
+    )
+
+
+def test_obter_converte_linha(armazem):
+    assert armazem.obter("1", hoje=date(2025, 1, 1)) == CidadaoCaracteristicas(
+        idade=45,
+        plano_saude_privado=False,
+        raca_cor="Parda",
+        sexo="Feminino",
+        municipio_prop_domicilios_zona_rural=0.25,
+        tempo_desde_ultimo_procedimento=None,
+    )
+    assert armazem.obter("3", hoje=date(2025, 1, 1)).plano_saude_privado is True
+
+
+def test_obter_preserva_nulos(armazem):
+    assert armazem.obter("2") == CidadaoCaracteristicas(
+        idade=None,
+        plano_saude_privado=None,
+        raca_cor=None,
+        sexo=None,
+        municipio_prop_domicilios_zona_rural=None,
+        tempo_desde_ultimo_procedimento=None,
+    )
+
+
+def test_obter_id_ausente(armazem):
+    assert armazem.obter("9") is None
+    assert "9" not in armazem
+    assert len(armazem) == 3
+
+
+def test_salvar_e_carregar(armazem, tmp_path):
+    caminho = tmp_path / "sub" / "cidadaos.npz"
+    armazem.salvar(caminho)
+    carregado = ArmazemCidadaos.carregar(caminho)
+    assert carregado.modificado_em > 0
+    for cidadao_id in ("1", "2", "3"):
+        assert carregado.obter(cidadao_id, hoje=date(2025, 1, 1)) == armazem.obter(
+            cidadao_id, hoje=date(2025, 1, 1)
+        )
+
+
+def test_atualizar_reaproveita_snapshot_recente(armazem, tmp_path, monkeypatch):
+    caminho = tmp_path / "cidadaos.npz"
+    armazem.salvar(caminho)
+    monkeypatch.setattr(armazem_cidadaos.configs, "ARMAZEM_CIDADAOS_CAMINHO", caminho)
+    monkeypatch.setattr(armazem_cidadaos, "_armazem", None)
+
+    def falhar():
+        raise AssertionError("não deveria exportar")
+
+    monkeypatch.setattr(ArmazemCidadaos, "exportar_do_bigquery", falhar)
+    armazem_cidadaos.atualizar_armazem_cidadaos()
+    assert armazem_cidadaos.obter_dados_do_armazem("1") is not None
+    assert armazem_cidadaos.obter_dados_do_armazem("9") is None
+
+
+def test_atualizar_exporta_quando_sem_snapshot(armazem, tmp_path, monkeypatch):
+    caminho = tmp_path / "cidadaos.npz"
+    monkeypatch.setattr(armazem_cidadaos.configs, "ARMAZEM_CIDADAOS_CAMINHO", caminho)
+    monkeypatch.setattr(armazem_cidadaos, "_armazem", None)
+    monkeypatch.setattr(ArmazemCidadaos, "exportar_do_bigquery", lambda: armazem)
+    armazem_cidadaos.atualizar_armazem_cidadaos()
+    assert caminho.exists()
+    assert armazem_cidadaos.obter_armazem_cidadaos() is armazem
+
+
+def test_sem_armazem_devolve_none(monkeypatch):
+    monkeypatch.setattr(armazem_cidadaos, "_armazem", None)
+    assert armazem_cidadaos.obter_dados_do_armazem("1") is None
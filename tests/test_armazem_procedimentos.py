@@ -0,0 +1,124 @@
+from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import pytest
+
+from ip_mensageria_alocacao_api.core import armazem_procedimentos, auxiliar
+from ip_mensageria_alocacao_api.core.armazem_procedimentos import (
+    ArmazemProcedimentos,
+)
+from ip_mensageria_alocacao_api.core.modelos import LinhaCuidado
+
+
+def _linha(fonte, cidadao_id, data):
+    return SimpleNamespace(fonte=fonte, cidadao_id=cidadao_id, data=data)
+
+
+@pytest.fixture
+def armazem():
+    return ArmazemProcedimentos.de_linhas(
+        [
+            _linha("citopatologico", "1", date(2025, 3, 1)),
+            _linha("diabetes", "2", date(2025, 1, 10)),
+            _linha("hipertensao", "2", date(2025, 2, 20)),
+            _linha("diabetes", "3", date(2025, 4, 1)),
+            _linha("citopatologico", "4", None),
+        ]
+    )
+
+
+def test_citopatologico(armazem):
+    assert armazem.datas_ultimo_procedimento(
+        ["1", "2", "9"], LinhaCuidado.citotopatologico
+    ) == {"1": date(2025, 3, 1), "2": None, "9": None}
+
+
+def test_cronicos_exige_diabetes_e_hipertensao(armazem):
+    # "3" só tem diabetes: sem data, como no INNER JOIN da consulta
+    assert armazem.datas_ultimo_procedimento(
+        ["2", "3", "1"], LinhaCuidado.cronicos
+    ) == {"2": date(2025, 2, 20), "3": None, "1": None}
+
+
+def test_linhas_sem_data_sao_ignoradas(armazem):
+    assert list(armazem.ids) == ["1", "2", "3"]
+
+
+def test_armazem_vazio():
+    vazio = ArmazemProcedimentos.de_linhas([])
+    assert len(vazio) == 0
+    assert vazio.datas_ultimo_procedimento(["1"], LinhaCuidado.cronicos) == {"1": None}
+
+
+def test_mesclar_mantem_datas_mais_recentes(armazem):
+    delta = ArmazemProcedimentos.de_linhas(
+        [
+            _linha("citopatologico", "1", date(2025, 5, 2)),
+            _linha("hipertensao", "3", date(2025, 3, 1)),
+            _linha("citopatologico", "0", date(2025, 5, 3)),
+            # mais antiga que a já conhecida
+            _linha("hipertensao", "2", date(2024, 12, 1)),
+        ]
+    )
+    mesclado = armazem.mesclar(delta)
+    assert list(mesclado.ids) == ["0", "1", "2", "3"]
+    assert mesclado.datas_ultimo_procedimento(
+        ["0", "1"], LinhaCuidado.citotopatologico
+    ) == {"0": date(2025, 5, 3), "1": date(2025, 5, 2)}
+    assert mesclado.datas_ultimo_procedimento(["2", "3"], LinhaCuidado.cronicos) == {
+        "2": date(2025, 2, 20),
+        "3": date(2025, 4, 1),
+    }
+
+
+def test_sincronizar_exporta_e_depois_busca_delta(armazem, monkeypatch):
+    delta = ArmazemProcedimentos.de_linhas(
+        [_linha("citopatologico", "5", date(2025, 6, 1))]
+    )
+    exportar = Mock(side_effect=[armazem, delta])
+    monkeypatch.setattr(ArmazemProcedimentos, "exportar_do_bigquery", exportar)
+    monkeypatch.setattr(armazem_procedimentos, "hoje_utc", lambda: date(2025, 6, 2))
+    monkeypatch.setattr(armazem_procedimentos, "_armazem", None)
+    monkeypatch.setattr(armazem_procedimentos, "_sincronizado_em", None)
+    monkeypatch.setattr(
+        armazem_procedimentos.configs, "ARMAZEM_PROCEDIMENTOS_CARENCIA_DIAS", 3
+    )
+
+    armazem_procedimentos.sincronizar_armazem_procedimentos()
+    armazem_procedimentos.sincronizar_armazem_procedimentos()
+
+    assert exportar.call_args_list[0].args == ()
+    assert exportar.call_args_list[1].args == (date(2025, 6, 2) - timedelta(days=3),)
+    atual = armazem_procedimentos.obter_armazem_procedimentos()
+    assert list(atual.ids) == ["1", "2", "3", "5"]
+
+
+def test_auxiliar_usa_armazem_sem_bigquery(armazem, monkeypatch):
+    consultar = Mock()
+    monkeypatch.setattr(auxiliar, "consultar", consultar)
+    monkeypatch.setattr(armazem_procedimentos, "_armazem", armazem)
+
+    assert auxiliar.obter_datas_ultimo_procedimento(
+        ["1", "2"], LinhaCuidado.citotopatologico
+    ) == {"1": date(2025, 3, 1), "2": None}
+    assert auxiliar.obter_data_ultimo_procedimento("2", LinhaCuidado.cronicos) == date(
+        2025, 2, 20
+    )
+    consultar.assert_not_called()
+
+
+def test_armazem_responde_antes_do_cache(armazem, monkeypatch):
+    obter = auxiliar.obter_data_ultimo_procedimento
+    obter.cache_clear()
+    monkeypatch.setattr(armazem_procedimentos, "_armazem", None)
+    obter.armazenar(date(2024, 1, 1), "1", LinhaCuidado.citotopatologico)
+    obter.armazenar(date(2024, 1, 1), "4", LinhaCuidado.citotopatologico)
+
+    monkeypatch.setattr(armazem_procedimentos, "_armazem", armazem)
+
+    # o armazém prevalece sobre o cache, inclusive quando não há data
+    assert obter("1", LinhaCuidado.citotopatologico) == date(2025, 3, 1)
+    assert obter("4", LinhaCuidado.citotopatologico) is None
+    assert obter.consultar_cache("4", LinhaCuidado.citotopatologico) == (True, None)
+    obter.cache_clear()
@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.impute import SimpleImputer
+
+from ip_mensageria_alocacao_api.core import auxiliar, modelos
+from ip_mensageria_alocacao_api.core.atributos import (
+    ATRIBUTOS_NUMERICOS,
+    EntradaAtributos,
+    PlanoAtributos,
+    compilar_plano_atributos,
+)
+
+TEMPLATE_DIMS = 3
+MIDIA_DIMS = 2
+
+
+def _colunas():
+    colunas = [
+        "linha_cuidado",
+        "cidadao_sexo",
+        "cidadao_raca_cor",
+        "mensagem_dia_semana",
+        "municipio_prop_domicilios_zona_rural",
+        "cidadao_plano_saude_privado",
+        "cidadao_idade",
+        "cidadao_tempo_desde_ultimo_procedimento",
+        "mensagem_horario_relativo_12h",
+        "mensagem_tipo",
+        "coluna_numerica_ausente",
+        "coluna_categorica_ausente",
+    ]
+    colunas += [f"template_emb_{i}" for i in range(TEMPLATE_DIMS)]
+    colunas += [f"midia_emb_{i}" for i in range(MIDIA_DIMS)]
+    return colunas
+
+
+@pytest.fixture
+def imputador():
+    treino = pd.DataFrame(
+        [[0.1, 1, 30, 100, 2], [0.3, 0, 50, 300, -2], [np.nan, 1, 40, np.nan, 0]],
+        columns=ATRIBUTOS_NUMERICOS,
+    )
+    return SimpleImputer(strategy="median").fit(treino)
+
+
+@pytest.fixture
+def classificadores(imputador):
+    colunas = _colunas()
+    categoricos = [
+        "linha_cuidado",
+        "cidadao_sexo",
+        "cidadao_raca_cor",
+        "mensagem_dia_semana",
+        "mensagem_tipo",
+        "cidadao_plano_saude_privado",
+        "coluna_categorica_ausente",
+    ]
+    return modelos.Classificador(
+        modelos=[],
+        atributos_colunas=colunas,
+        atributos_categoricos=categoricos,
+        imputador_numerico=imputador,
+        template_embedding_dims=TEMPLATE_DIMS,
+        midia_embedding_dims=MIDIA_DIMS,
+        plano_atributos=compilar_plano_atributos(colunas, categoricos, imputador),
+    )
+
+
+@pytest.fixture
+def entradas():
+    completo = modelos.CidadaoCaracteristicas(
+        idade=30,
+        plano_saude_privado=True,
+        raca_cor="Parda",
+        sexo="Feminino",
+        tempo_desde_ultimo_procedimento=120,
+        municipio_prop_domicilios_zona_rural=0.12,
+    )
+    vazio = modelos.CidadaoCaracteristicas(
+        idade=None,
+        plano_saude_privado=None,
+        raca_cor=None,
+        sexo=None,
+        tempo_desde_ultimo_procedimento=None,
+        municipio_prop_domicilios_zona_rural=None,
+    )
+    return [
+        EntradaAtributos(
+            cidadao_caracteristicas=completo,
+            linha_cuidado=modelos.LinhaCuidado.citotopatologico,
+            tempo_desde_ultimo_procedimento=None,
+            mensagem_tipo=modelos.MensagemTipo.mensagem_inicial,
+            mensagem_dia_semana=modelos.DiaSemana.segunda,
+            mensagem_horario=15,
+            mensagem_template_embedding=np.array([0.1, 0.2, 0.3], dtype=np.float32),
+            mensagem_midia_embedding=[0.4, 0.5],
+        ),
+        EntradaAtributos(
+            cidadao_caracteristicas=vazio,
+            linha_cuidado=modelos.LinhaCuidado.cronicos,
+            tempo_desde_ultimo_procedimento=7,
+            mensagem_tipo=modelos.MensagemTipo.segundo_lembrete,
+            mensagem_dia_semana=modelos.DiaSemana.domingo,
+            mensagem_horario=8,
+            mensagem_template_embedding=[0.7, 0.8, 0.9],
+            mensagem_midia_embedding=np.zeros(MIDIA_DIMS),
+        ),
+        EntradaAtributos(
+            cidadao_caracteristicas=vazio,
+            linha_cuidado=modelos.LinhaCuidado.cronicos,
+            tempo_desde_ultimo_procedimento=None,
+            mensagem_tipo=modelos.MensagemTipo.primeiro_lembrete,
+            mensagem_dia_semana=modelos.DiaSemana.quarta,
+            mensagem_horario=12,
+            mensagem_template_embedding=[0.7, 0.8, 0.9],
+            mensagem_midia_embedding=[1.0, 2.0],
+        ),
+    ]
+
+
+def _referencia_pandas(classificadores, entradas):
+    return pd.concat(
+        [
+            auxiliar.preparar_atributos_para_predicao(
+                classificadores=classificadores, **entrada._asdict()
+            )
+            for entrada in entradas
+        ],
+        ignore_index=True,
+    ).to_numpy(dtype=object)
+
+
+def test_plano_produz_mesmos_atributos_que_pandas(classificadores, entradas):
+    assert isinstance(classificadores.plano_atributos, PlanoAtributos)
+
+    matriz = classificadores.plano_atributos.montar(entradas)
+    referencia = _referencia_pandas(classificadores, entradas)
+
+    assert matriz.shape == referencia.shape
+    for linha_plano, linha_ref in zip(matriz, referencia):
+        assert list(linha_plano) == list(linha_ref)
+        assert [type(v) is str for v in linha_plano] == [
+            type(v) is str for v in linha_ref
+        ]
+
+
+def test_plano_embeddings_de_tamanhos_diferentes(classificadores, entradas):
+    entradas = [
+        entradas[0],
+        entradas[1]._replace(mensagem_template_embedding=[0.5]),
+    ]
+    matriz = classificadores.plano_atributos.montar(entradas)
+    referencia = _referencia_pandas(classificadores, entradas)
+    assert [list(linha) for linha in matriz] == [list(linha) for linha in referencia]
+
+
+def test_montar_matriz_atributos_sem_plano_usa_pandas(classificadores, entradas):
+    sem_plano = classificadores.model_copy(update={"plano_atributos": None})
+    matriz = auxiliar.montar_matriz_atributos(sem_plano, entradas)
+    assert [list(linha) for linha in matriz] == [
+        list(linha) for linha in classificadores.plano_atributos.montar(entradas)
+    ]
+
+
+def test_compilar_plano_imputador_nao_suportado(imputador):
+    colunas = _colunas()
+    assert compilar_plano_atributos(colunas, [], {"imputer": "ok"}) is None
+    com_indicador = SimpleImputer(add_indicator=True).fit(
+        pd.DataFrame([[np.nan, 1, 2, 3, 4]], columns=ATRIBUTOS_NUMERICOS)
+    )
+    assert compilar_plano_atributos(colunas, [], com_indicador) is None
@@ -41,15 +41,7 @@ def test_obter_usuario_success(monkeypatch):
     mock_row.senha_hash = "hashed"
     mock_row.desativado = False
     mock_result = MockResult([mock_row])
-    mock_query_job = Mock()
-    mock_query_job.result.return_value = mock_result
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query_job
-    monkeypatch.setattr(
-        autenticacao,
-        "make_bq_client",
-        Mock(return_value=mock_client),
-    )
+    monkeypatch.setattr(autenticacao, "consultar", Mock(return_value=mock_result))
 
     user = autenticacao.obter_usuario("testuser")
     assert user.usuario_nome == "testuser"
@@ -59,15 +51,7 @@ def test_obter_usuario_success(monkeypatch):
 
 def test_obter_usuario_not_found(monkeypatch):
     mock_result = MockResult([])
-    mock_query_job = Mock()
-    mock_query_job.result.return_value = mock_result
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query_job
-    monkeypatch.setattr(
-        autenticacao,
-        "make_bq_client",
-        Mock(return_value=mock_client),
-    )
+    monkeypatch.setattr(autenticacao, "consultar", Mock(return_value=mock_result))
 
     user = autenticacao.obter_usuario("nonexistent")
     assert user is None
@@ -84,15 +68,7 @@ def test_autenticar_usuario_success(monkeypatch):
     mock_row.senha_hash = autenticacao.obter_hash_senha("password")
     mock_row.desativado = False
     mock_result = MockResult([mock_row])
-    mock_query_job = Mock()
-    mock_query_job.result.return_value = mock_result
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query_job
-    monkeypatch.setattr(
-        autenticacao,
-        "make_bq_client",
-        Mock(return_value=mock_client),
-    )
+    monkeypatch.setattr(autenticacao, "consultar", Mock(return_value=mock_result))
 
     user = autenticacao.autenticar_usuario("testuser", "password")
     assert user.usuario_nome == "testuser"
@@ -104,15 +80,7 @@ def test_autenticar_usuario_wrong_password(monkeypatch):
     mock_row.senha_hash = autenticacao.obter_hash_senha("password")
     mock_row.desativado = False
     mock_result = MockResult([mock_row])
-    mock_query_job = Mock()
-    mock_query_job.result.return_value = mock_result
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query_job
-    monkeypatch.setattr(
-        autenticacao,
-        "make_bq_client",
-        Mock(return_value=mock_client),
-    )
+    monkeypatch.setattr(autenticacao, "consultar", Mock(return_value=mock_result))
 
     user = autenticacao.autenticar_usuario("testuser", "wrong")
     assert user is False
@@ -120,15 +88,7 @@ def test_autenticar_usuario_wrong_password(monkeypatch):
 
 def test_autenticar_usuario_nao_encontrado(monkeypatch):
     mock_result = MockResult([])
-    mock_query_job = Mock()
-    mock_query_job.result.return_value = mock_result
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query_job
-    monkeypatch.setattr(
-        autenticacao,
-        "make_bq_client",
-        Mock(return_value=mock_client),
-    )
+    monkeypatch.setattr(autenticacao, "consultar", Mock(return_value=mock_result))
 
     user = autenticacao.autenticar_usuario("nonexistent", "password")
     assert user is False
@@ -156,15 +116,7 @@ async def test_login_para_token_successo(monkeypatch):
     mock_row.senha_hash = autenticacao.obter_hash_senha("password")
     mock_row.desativado = False
     mock_result = MockResult([mock_row])
-    mock_query_job = Mock()
-    mock_query_job.result.return_value = mock_result
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query_job
-    monkeypatch.setattr(
-        autenticacao,
-        "make_bq_client",
-        Mock(return_value=mock_client),
-    )
+    monkeypatch.setattr(autenticacao, "consultar", Mock(return_value=mock_result))
 
     from fastapi.security import OAuth2PasswordRequestForm
 
@@ -179,15 +131,7 @@ async def test_login_para_token_successo(monkeypatch):
 async def test_login_para_token_falha(monkeypatch):
     # Mock the query to return no user
     mock_result = MockResult([])
-    mock_query_job = Mock()
-    mock_query_job.result.return_value = mock_result
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query_job
-    monkeypatch.setattr(
-        autenticacao,
-        "make_bq_client",
-        Mock(return_value=mock_client),
-    )
+    monkeypatch.setattr(autenticacao, "consultar", Mock(return_value=mock_result))
 
     from fastapi.security import OAuth2PasswordRequestForm
 
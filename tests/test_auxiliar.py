@@ -1,12 +1,17 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
 from unittest.mock import Mock, patch
 
 import numpy as np
 import pandas as pd
 import pytest
 from fastapi import HTTPException
-from google.cloud.bigquery.table import RowIterator, _EmptyRowIterator
+from google.cloud.bigquery.table import _EmptyRowIterator
 
-from ip_mensageria_alocacao_api.core import auxiliar, modelos
+from ip_mensageria_alocacao_api.core import auxiliar, indice_cidadaos, modelos
+from ip_mensageria_alocacao_api.core.censo_municipios import CensoMunicipios
+from ip_mensageria_alocacao_api.core.indice_cidadaos import IndiceCidadaos
 
 
 class MockResult:
@@ -61,6 +66,24 @@ def test_beta_from_mean_se_consistency():
     assert beta > 0
 
 
+def test_beta_from_mean_se_vetorizado_equivale_escalar():
+    p = np.array([0.0, 0.2, 0.5, 0.5, 0.999, 1.0])
+    se = np.array([0.1, 0.05, 1e-10, 10.0, 0.01, 0.1])
+    alpha, beta = auxiliar.beta_from_mean_se_vetorizado(p, se)
+    for i in range(len(p)):
+        esperado = auxiliar.beta_from_mean_se(float(p[i]), float(se[i]))
+        assert (alpha[i], beta[i]) == pytest.approx(esperado)
+
+
+def test_thompson_sample_vetorizado_shape_and_range():
+    p = np.full(1000, 0.3)
+    se = np.full(1000, 0.1)
+    samples = auxiliar.thompson_sample_vetorizado(p, se)
+    assert samples.shape == (1000,)
+    assert ((samples >= 0.0) & (samples <= 1.0)).all()
+    assert samples.mean() == pytest.approx(0.3, abs=0.02)
+
+
 def test_thompson_sample_range_and_distribution():
     p = 0.3
     se = 0.1
@@ -151,6 +174,56 @@ def test_converter_df_em_pool_uses_cat_indices(monkeypatch: pytest.MonkeyPatch):
     assert captured["cat_features"] == [atributos_colunas.index("catcol")]
 
 
+def test_converter_matriz_em_pool_uses_cat_indices_and_names(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    atributos_colunas = ["num1", "catcol", "num2"]
+    artefato = DummyClassificador(
+        atributos_colunas, ["catcol"], template_dims=0, midia_dims=0
+    )
+    matriz = np.array([[1.0, "A", 2.0]], dtype=object)
+
+    captured = {}
+
+    def fake_Pool(data, cat_features=None, feature_names=None):
+        captured["data"] = data
+        captured["cat_features"] = cat_features
+        captured["feature_names"] = feature_names
+        return "POOL_OBJ"
+
+    monkeypatch.setattr(auxiliar, "Pool", fake_Pool)
+
+    assert auxiliar.converter_matriz_em_pool(matriz, artefato) == "POOL_OBJ"
+    assert captured["data"] is matriz
+    assert captured["cat_features"] == [1]
+    assert captured["feature_names"] == atributos_colunas
+
+
+@pytest.mark.parametrize("num_threads", [1, 4])
+def test_avaliar_ensemble_matriz_modelos_por_linhas(monkeypatch, num_threads):
+    from ip_mensageria_alocacao_api.core import configs, executores
+
+    monkeypatch.setattr(configs, "ENSEMBLE_NUM_THREADS", num_threads)
+    monkeypatch.setattr(executores, "_executor_ensemble", None)
+    monkeypatch.setattr(executores, "_num_cpus", lambda: 4)
+
+    modelos = []
+    for p in (0.1, 0.2, 0.3):
+        modelo = Mock()
+        modelo.predict_proba.return_value = np.array([[1 - p, p], [1 - p, p]])
+        modelos.append(modelo)
+    classificadores = Mock(modelos=modelos)
+
+    ps = auxiliar.avaliar_ensemble("POOL_OBJ", classificadores)
+
+    assert ps.shape == (3, 2)
+    assert ps[:, 0] == pytest.approx([0.1, 0.2, 0.3])
+    for modelo in modelos:
+        modelo.predict_proba.assert_called_once_with(
+            "POOL_OBJ", thread_count=4 // num_threads
+        )
+
+
 @pytest.fixture
 def mock_query_result():
     class MockRow:
@@ -169,41 +242,53 @@ def mock_query_result():
     return MockQueryResult
 
 
-@patch("ip_mensageria_alocacao_api.core.auxiliar.make_bq_client")
-def test_obter_caracteristicas_usuario(mock_make_bq_client):
+@pytest.fixture
+def censo(monkeypatch):
+    censo = CensoMunicipios.de_linhas(
+        [
+            Mock(cod_mun_ibge="210005", perc_dom_zona_rural=0.12),
+            Mock(cod_mun_ibge="210010", perc_dom_zona_rural=0.3),
+        ]
+    )
+    monkeypatch.setattr(auxiliar, "obter_censo_municipios", lambda: censo)
+    return censo
+
+
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_caracteristicas_usuario(mock_consultar, censo):
+    hoje = auxiliar.hoje_utc()
     mock_row = Mock(
-        idade=30,
+        cidadao_id="123",
+        data_nascimento=date(hoje.year - 30, 12, 31),
         sexo="Feminino",
         raca_cor="Parda",
         plano_saude_privado=True,
-        prop_domicilios_zona_rural=0.12,
+        municipio_id_sus="210005",
     )
     mock_result = MockResult([mock_row])
-    mock_query = Mock()
-    mock_query.result.return_value = mock_result
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query
-    mock_make_bq_client.return_value = mock_client
+    mock_consultar.return_value = mock_result
 
     result = auxiliar.obter_caracteristicas_usuario("123")
 
     assert isinstance(result, modelos.CidadaoCaracteristicas)
+    # mesmo critério de DATE_DIFF(..., YEAR)
     assert result.idade == 30
     assert result.sexo == "Feminino"
     assert result.raca_cor == "Parda"
     assert result.plano_saude_privado
     assert result.municipio_prop_domicilios_zona_rural == 0.12
+    # sem JOIN com o censo no BigQuery
+    assert "censo" not in mock_consultar.call_args.args[0]
 
 
-@patch("ip_mensageria_alocacao_api.core.auxiliar.make_bq_client")
-def test_obter_tempo_desde_ultimo_procedimento_citotopatologico(mock_make_bq_client):
-    mock_row = Mock(tempo_desde_ultimo_procedimento=10)
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_tempo_desde_ultimo_procedimento_citotopatologico(mock_consultar):
+    mock_row = Mock(
+        cidadao_id="123",
+        data_ultimo_procedimento=auxiliar.hoje_utc() - timedelta(days=10),
+    )
     mock_result = MockResult([mock_row])
-    mock_query = Mock()
-    mock_query.result.return_value = mock_result
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query
-    mock_make_bq_client.return_value = mock_client
+    mock_consultar.return_value = mock_result
 
     result = auxiliar.obter_tempo_desde_ultimo_procedimento(
         "123", modelos.LinhaCuidado.citotopatologico
@@ -212,120 +297,316 @@ def test_obter_tempo_desde_ultimo_procedimento_citotopatologico(mock_make_bq_cli
     assert result == 10
 
 
-@patch("ip_mensageria_alocacao_api.core.auxiliar.make_bq_client")
-def test_obter_tempo_desde_ultimo_procedimento_cronicos(mock_make_bq_client):
-    mock_result_diabetes = MockResult([Mock(tempo_desde_ultimo_procedimento=20)])
-    mock_result_hipertensao = MockResult([Mock(tempo_desde_ultimo_procedimento=15)])
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_tempo_desde_ultimo_procedimento_cronicos(mock_consultar):
+    mock_consultar.return_value = MockResult(
+        [
+            Mock(
+                cidadao_id="123",
+                data_ultimo_procedimento=auxiliar.hoje_utc() - timedelta(days=15),
+            )
+        ]
+    )
+
+    result = auxiliar.obter_tempo_desde_ultimo_procedimento(
+        "123", modelos.LinhaCuidado.cronicos
+    )
+
+    assert result == 15
+    # diabetes e hipertensão em um único job
+    assert mock_consultar.call_count == 1
+    query = mock_consultar.call_args.args[0]
+    assert "GREATEST(d.data, h.data)" in query
+    assert "diabeticos" in query
+    assert "hipertensos" in query
+
+
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_tempos_desde_ultimo_procedimento_em_lote(mock_consultar):
+    mock_consultar.return_value = MockResult(
+        [
+            Mock(
+                cidadao_id="1",
+                data_ultimo_procedimento=auxiliar.hoje_utc() - timedelta(days=10),
+            ),
+            Mock(
+                cidadao_id="3",
+                data_ultimo_procedimento=auxiliar.hoje_utc() - timedelta(days=30),
+            ),
+        ]
+    )
+
+    result = auxiliar.obter_tempos_desde_ultimo_procedimento(
+        ["1", "2", "3", "1"], modelos.LinhaCuidado.citotopatologico
+    )
+
+    assert result == {"1": 10, "2": None, "3": 30}
+    assert mock_consultar.call_count == 1
+    job_config = mock_consultar.call_args.kwargs["job_config"]
+    assert job_config.query_parameters[0].values == ["1", "2", "3"]
+
+
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_antecipar_dados_de_cidadaos_preenche_caches(mock_consultar, censo):
+    caracteristicas = Mock(
+        cidadao_id="p1",
+        data_nascimento=date(auxiliar.hoje_utc().year - 40, 1, 1),
+        sexo="Masculino",
+        raca_cor="Branca",
+        plano_saude_privado=False,
+        municipio_id_sus="210010",
+    )
+    mock_consultar.side_effect = [
+        MockResult([caracteristicas]),
+        MockResult(
+            [
+                Mock(
+                    cidadao_id="p1",
+                    data_ultimo_procedimento=auxiliar.hoje_utc() - timedelta(days=7),
+                )
+            ]
+        ),
+    ]
+    linha_cuidado = modelos.LinhaCuidado.citotopatologico
+
+    assert auxiliar.antecipar_caracteristicas_usuarios(["p1", "p2", "p1"]) == 1
+    auxiliar.antecipar_tempos_desde_ultimo_procedimento(["p1", "p2"], linha_cuidado)
+
+    assert mock_consultar.call_count == 2
+    assert auxiliar.obter_caracteristicas_usuario("p1").idade == 40
+    assert (
+        auxiliar.obter_caracteristicas_usuario(
+            "p1"
+        ).municipio_prop_domicilios_zona_rural
+        == 0.3
+    )
+    assert auxiliar.obter_tempo_desde_ultimo_procedimento("p1", linha_cuidado) == 7
+    assert auxiliar.obter_tempo_desde_ultimo_procedimento("p2", linha_cuidado) is None
+    assert mock_consultar.call_count == 2
+
+    # já em cache: nada a buscar
+    auxiliar.antecipar_tempos_desde_ultimo_procedimento(["p1"], linha_cuidado)
+    assert list(auxiliar.obter_caracteristicas_usuarios(["p1"])) == ["p1"]
+    assert mock_consultar.call_count == 2
 
-    mock_query_diabetes = Mock()
-    mock_query_diabetes.result.return_value = mock_result_diabetes
 
-    mock_query_hipertensao = Mock()
-    mock_query_hipertensao.result.return_value = mock_result_hipertensao
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_caracteristicas_cidadao_inexistente_404(mock_consultar, censo):
+    mock_consultar.return_value = MockResult([])
 
-    mock_client = Mock()
-    mock_client.query.side_effect = [mock_query_diabetes, mock_query_hipertensao]
-    mock_make_bq_client.return_value = mock_client
+    with pytest.raises(HTTPException) as exc_info:
+        auxiliar.obter_caracteristicas_usuario("inexistente-bq")
+    assert exc_info.value.status_code == 404
+    assert mock_consultar.call_count == 1
 
-    # Need to patch isinstance to recognize MockResult as RowIterator
-    with patch(
-        "ip_mensageria_alocacao_api.core.auxiliar.isinstance"
-    ) as mock_isinstance:
 
-        def isinstance_side_effect(obj, cls):
-            if cls is RowIterator and isinstance(obj, MockResult):
-                return True
-            return isinstance.__wrapped__(obj, cls)
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_indice_recusa_cidadao_desconhecido_sem_consulta(mock_consultar, monkeypatch):
+    monkeypatch.setattr(
+        indice_cidadaos, "_indice", IndiceCidadaos.de_ids(["conhecido"])
+    )
 
-        mock_isinstance.side_effect = isinstance_side_effect
+    with pytest.raises(HTTPException) as exc_info:
+        auxiliar.obter_caracteristicas_usuario("fora-do-indice")
+    assert exc_info.value.status_code == 404
+    assert auxiliar.antecipar_caracteristicas_usuarios(["fora-do-indice"]) == 0
+    mock_consultar.assert_not_called()
 
-        result = auxiliar.obter_tempo_desde_ultimo_procedimento(
-            "123", modelos.LinhaCuidado.cronicos
+
+def test_idade_e_dias_calculados_na_data_da_chamada(monkeypatch):
+    dados = modelos.CidadaoDados(
+        data_nascimento=date(1990, 6, 1),
+        plano_saude_privado=None,
+        raca_cor=None,
+        sexo=None,
+        municipio_prop_domicilios_zona_rural=None,
+    )
+    auxiliar.obter_dados_cidadao.armazenar(dados, "datas")
+    linha_cuidado = modelos.LinhaCuidado.citotopatologico
+    auxiliar.obter_data_ultimo_procedimento.armazenar(
+        date(2025, 12, 1), "datas", linha_cuidado
+    )
+
+    # a mesma entrada em cache vale em dias diferentes
+    for hoje, idade, dias in [
+        (date(2025, 12, 31), 35, 30),
+        (date(2026, 1, 1), 36, 31),
+    ]:
+        monkeypatch.setattr(auxiliar, "hoje_utc", lambda hoje=hoje: hoje)
+        assert auxiliar.obter_caracteristicas_usuario("datas").idade == idade
+        assert (
+            auxiliar.obter_tempo_desde_ultimo_procedimento("datas", linha_cuidado)
+            == dias
         )
 
-    assert result == 15  # min of 20 and 15
+
+def test_obter_tempos_desde_ultimo_procedimento_vazio():
+    assert (
+        auxiliar.obter_tempos_desde_ultimo_procedimento(
+            [], modelos.LinhaCuidado.cronicos
+        )
+        == {}
+    )
 
 
-@patch("ip_mensageria_alocacao_api.core.auxiliar.make_bq_client")
-def test_obter_template_embedding_por_nome_success(mock_make_bq_client):
-    mock_row = Mock(embedding=[0.1, 0.2, 0.3])
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_template_embedding_por_nome_success(mock_consultar):
+    mock_row = Mock(template_nome="template1", embedding=[0.1, 0.2, 0.3])
     mock_result = MockResult([mock_row])
-    mock_query = Mock()
-    mock_query.result.return_value = mock_result
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query
-    mock_make_bq_client.return_value = mock_client
+    mock_consultar.return_value = mock_result
 
     result = auxiliar.obter_template_embedding_por_nome("template1")
 
     assert isinstance(result, np.ndarray)
-    assert np.array_equal(result, np.array([0.1, 0.2, 0.3]))
+    assert result.dtype == np.float32
+    assert np.array_equal(result, np.array([0.1, 0.2, 0.3], dtype=np.float32))
 
 
-@patch("ip_mensageria_alocacao_api.core.auxiliar.make_bq_client")
-def test_obter_template_embedding_por_nome_not_found(mock_make_bq_client):
-    mock_query = Mock()
-    mock_query.result.return_value = _EmptyRowIterator()
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query
-    mock_make_bq_client.return_value = mock_client
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_template_embedding_por_nome_not_found(mock_consultar):
+    mock_consultar.return_value = _EmptyRowIterator()
 
     with pytest.raises(HTTPException):
         auxiliar.obter_template_embedding_por_nome("nonexistent")
 
 
-@patch("ip_mensageria_alocacao_api.core.auxiliar.make_bq_client")
-def test_obter_template_embedding_por_texto_cached(mock_make_bq_client):
-    # First query returns empty result
-    mock_empty = _EmptyRowIterator()
-    # Second query returns result with embedding
-    mock_row = Mock(embedding=[0.4, 0.5, 0.6])
-    mock_result = MockResult([mock_row])
-    mock_query_with_result = Mock()
-    mock_query_with_result.result.return_value = mock_result
-
-    # Set up the mock to return empty result on first call, then query with result on second call
-    mock_client = Mock()
-    mock_client.query.side_effect = [mock_empty, mock_query_with_result]
-    mock_make_bq_client.return_value = mock_client
+@patch("ip_mensageria_alocacao_api.core.embeddings_gerados.make_bq_client")
+@patch("ip_mensageria_alocacao_api.core.embeddings_gerados.consultar")
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_template_embedding_por_texto_cached(
+    mock_consultar, mock_consultar_gerados, mock_make_bq_client_gerados
+):
+    # não está em templates_embeddings nem entre os gerados: gera e persiste
+    mock_consultar.return_value = MockResult([])
+    mock_consultar_gerados.side_effect = [
+        MockResult([]),
+        MockResult([Mock(content="text\nbtn0\nbtn1\nbtn2", embedding=[0.4, 0.5, 0.6])]),
+    ]
+    mock_client = mock_make_bq_client_gerados.return_value
+    mock_client.insert_rows_json.return_value = []
 
     result = auxiliar.obter_template_embedding_por_texto("text", "btn0", "btn1", "btn2")
 
     assert isinstance(result, np.ndarray)
+    np.testing.assert_allclose(result, [0.4, 0.5, 0.6], rtol=1e-6)
+    assert mock_client.insert_rows_json.call_count == 1
+
+    # segunda chamada vem do cache
+    auxiliar.obter_template_embedding_por_texto("text", "btn0", "btn1", "btn2")
+    assert mock_consultar.call_count == 1
+    assert mock_consultar_gerados.call_count == 2
+
+
+@patch("ip_mensageria_alocacao_api.core.auxiliar.gerar_embeddings_textos")
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_template_embeddings_por_textos_em_lote(mock_consultar, mock_gerar):
+    mock_consultar.return_value = MockResult(
+        [Mock(content="existente\n\n\n", embedding=[1.0, 1.0])]
+    )
+    mock_gerar.side_effect = lambda textos: {
+        texto: np.zeros(2, dtype=np.float32) for texto in textos
+    }
+
+    templates = [
+        modelos.Template(texto="existente"),
+        modelos.Template(texto="inédito 1"),
+        modelos.Template(texto="inédito 2"),
+        modelos.Template(texto="existente"),
+    ]
+    result = auxiliar.obter_template_embeddings_por_textos(templates)
+
+    assert len(result) == 4
+    np.testing.assert_allclose(result[0], [1.0, 1.0])
+    np.testing.assert_allclose(result[1], [0.0, 0.0])
+    assert mock_consultar.call_count == 1
+    mock_gerar.assert_called_once_with(["inédito 1\n\n\n", "inédito 2\n\n\n"])
+    # os resultados alimentam o cache da versão unitária
+    assert auxiliar.obter_template_embedding_por_texto.consultar_cache("inédito 2")[0]
+
+
+@patch("ip_mensageria_alocacao_api.core.auxiliar.gerar_embeddings_textos")
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_falha_na_geracao_nao_afeta_outros_textos_do_lote(
+    mock_consultar, mock_gerar, monkeypatch
+):
+    monkeypatch.setattr(
+        auxiliar._carregador_templates_por_texto, "_janela_segundos", 0.1
+    )
+    mock_consultar.return_value = MockResult([])
+    consultas_iniciadas = threading.Barrier(2)
+
+    def gerar(textos):
+        if textos == ["ruim\n\n\n"]:
+            raise HTTPException(status_code=500)
+        return {texto: np.ones(2, dtype=np.float32) for texto in textos}
 
+    mock_gerar.side_effect = gerar
 
-@patch("ip_mensageria_alocacao_api.core.auxiliar.make_bq_client")
-def test_obter_midia_embedding_gs(mock_make_bq_client):
-    mock_row = Mock(embedding=[0.7, 0.8])
+    def obter(texto):
+        consultas_iniciadas.wait(1)
+        return auxiliar.obter_template_embedding_por_texto(texto)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        bom = executor.submit(obter, "bom")
+        ruim = executor.submit(obter, "ruim")
+
+        np.testing.assert_allclose(bom.result(), [1.0, 1.0])
+        with pytest.raises(HTTPException):
+            ruim.result()
+    # a consulta foi agrupada; a geração, não
+    assert mock_consultar.call_count == 1
+    assert mock_gerar.call_count == 2
+
+
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_midia_embedding_gs(mock_consultar):
+    mock_row = Mock(uri="gs://bucket/file.jpg", embedding=[0.7, 0.8])
     mock_result = MockResult([mock_row])
-    mock_query = Mock()
-    mock_query.result.return_value = mock_result
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query
-    mock_make_bq_client.return_value = mock_client
+    mock_consultar.return_value = mock_result
 
     result = auxiliar.obter_midia_embedding("gs://bucket/file.jpg")
 
     assert isinstance(result, np.ndarray)
 
 
-@patch("ip_mensageria_alocacao_api.core.auxiliar.make_bq_client")
-def test_obter_midia_embedding_http(mock_make_bq_client):
-    mock_row = Mock(embedding=[0.9, 1.0])
-    mock_result = MockResult([mock_row])
-    mock_query = Mock()
-    mock_query.result.return_value = mock_result
-    mock_client = Mock()
-    mock_client.query.return_value = mock_query
-    mock_make_bq_client.return_value = mock_client
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_midia_embedding_http(mock_consultar):
+    mock_consultar.side_effect = [
+        MockResult(
+            [
+                Mock(
+                    url_turn="http://example.com/image.jpg",
+                    uri="gs://ip-mensageria-turn-midias/ip-mensageria-turn-midias/o/a.jpg",
+                )
+            ]
+        ),
+        MockResult(
+            [Mock(uri="gs://ip-mensageria-turn-midias/a.jpg", embedding=[0.9, 1.0])]
+        ),
+    ]
 
     result = auxiliar.obter_midia_embedding("http://example.com/image.jpg")
 
     assert isinstance(result, np.ndarray)
+    # a URI é normalizada em Python, sem REGEXP_REPLACE na consulta
+    for chamada in mock_consultar.call_args_list:
+        assert "REGEXP_REPLACE" not in chamada.args[0]
+    parametro = mock_consultar.call_args.kwargs["job_config"].query_parameters[0]
+    assert parametro.values == ["gs://ip-mensageria-turn-midias/a.jpg"]
+
+
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_midia_embedding_http_sem_midia(mock_consultar):
+    mock_consultar.return_value = MockResult([])
+
+    with pytest.raises(HTTPException) as exc_info:
+        auxiliar.obter_midia_embedding("http://example.com/inexistente.jpg")
+    assert exc_info.value.status_code == 404
+    assert mock_consultar.call_count == 1
 
 
-@patch("ip_mensageria_alocacao_api.core.auxiliar.make_bq_client")
-def test_obter_midia_embedding_invalid_url(mock_make_bq_client):
+@patch("ip_mensageria_alocacao_api.core.auxiliar.consultar")
+def test_obter_midia_embedding_invalid_url(mock_consultar):
     with pytest.raises(HTTPException):  # HTTPException
         auxiliar.obter_midia_embedding("ftp://invalid.com/file.jpg")
 
@@ -0,0 +1,136 @@
+import contextvars
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from ip_mensageria_alocacao_api.core import bd
+
+
+@pytest.fixture
+def sem_cliente(monkeypatch):
+    monkeypatch.setattr(bd, "_bq_client", None)
+    monkeypatch.setattr(bd, "_criar_sessao_http", Mock())
+
+
+def test_make_bq_client_cria_um_unico_cliente(sem_cliente, monkeypatch):
+    criados = []
+    liberar = threading.Event()
+
+    def criar_cliente(**kwargs):
+        liberar.wait(1)
+        criados.append(kwargs)
+        return Mock()
+
+    monkeypatch.setattr(bd.bigquery, "Client", criar_cliente)
+    clientes = []
+    threads = [
+        threading.Thread(target=lambda: clientes.append(bd.make_bq_client()))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    liberar.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(criados) == 1
+    assert criados[0]["default_job_creation_mode"] == "JOB_CREATION_OPTIONAL"
+    assert all(cliente is clientes[0] for cliente in clientes)
+
+
+def test_sessao_http_com_pool_dimensionado(monkeypatch):
+    monkeypatch.setattr(bd.google.auth, "default", lambda scopes: (Mock(), None))
+    monkeypatch.setattr(bd, "GOOGLE_ARQUIVO_CREDENCIAIS", None)
+    monkeypatch.setattr(bd, "BQ_POOL_CONEXOES", 40)
+
+    adaptador = bd._criar_sessao_http().get_adapter("https://bigquery.googleapis.com")
+
+    assert adaptador._pool_maxsize == 40
+
+
+def _resultado(bytes_processados=0, slot_ms=0, job_id=None):
+    return Mock(
+        spec=["total_bytes_processed", "slot_millis", "job_id"],
+        total_bytes_processed=bytes_processados,
+        slot_millis=slot_ms,
+        job_id=job_id,
+    )
+
+
+@pytest.fixture
+def sem_custos(monkeypatch):
+    monkeypatch.setattr(bd, "_custos", {})
+
+
+def test_consultar_usa_query_and_wait_com_timeouts(sem_custos, monkeypatch):
+    cliente = Mock()
+    cliente.query_and_wait.return_value = _resultado()
+    monkeypatch.setattr(bd, "make_bq_client", lambda: cliente)
+    job_config = bd.parametros_lista("ids", ["1"])
+
+    bd.consultar("SELECT 1", job_config=job_config)
+    bd.consultar("SELECT 2", page_size=10, timeout=None)
+
+    cliente.query.assert_not_called()
+    primeira, segunda = cliente.query_and_wait.call_args_list
+    assert primeira.args == ("SELECT 1",)
+    assert primeira.kwargs["job_config"] is job_config
+    assert primeira.kwargs["wait_timeout"] == bd.BQ_TIMEOUT_SEGUNDOS
+    assert primeira.kwargs["api_timeout"] == bd.BQ_TIMEOUT_API_SEGUNDOS
+    assert segunda.kwargs["wait_timeout"] is None
+    assert segunda.kwargs["page_size"] == 10
+
+
+def test_consultar_contabiliza_custos_por_consulta_e_endpoint(sem_custos, monkeypatch):
+    cliente = Mock()
+    cliente.query_and_wait.side_effect = [
+        _resultado(bytes_processados=1000, slot_ms=20, job_id="job-1"),
+        _resultado(),
+        _resultado(bytes_processados=500, slot_ms=5),
+    ]
+    monkeypatch.setattr(bd, "make_bq_client", lambda: cliente)
+
+    def requisicao(endpoint, nome):
+        bd.definir_endpoint(endpoint)
+        bd.consultar("SELECT 1", nome=nome)
+
+    contextvars.copy_context().run(requisicao, "/predicao", "caracteristicas")
+    contextvars.copy_context().run(requisicao, "/predicao", "caracteristicas")
+    contextvars.copy_context().run(requisicao, "/alocacao", "templates")
+
+    estatisticas = bd.estatisticas_consultas()
+    caracteristicas = estatisticas["por_consulta"]["caracteristicas"]
+    assert caracteristicas["consultas"] == 2
+    assert caracteristicas["jobs"] == 1
+    # sem job, 0 bytes processados indica resultado do cache do BigQuery
+    assert caracteristicas["em_cache"] == 1
+    assert caracteristicas["bytes_processados"] == 1000
+    assert caracteristicas["slot_ms"] == 20
+    assert estatisticas["por_endpoint"]["/predicao"]["consultas"] == 2
+    assert estatisticas["por_endpoint"]["/alocacao"]["bytes_processados"] == 500
+
+
+def test_consultar_contabiliza_erros(sem_custos, monkeypatch):
+    cliente = Mock()
+    cliente.query_and_wait.side_effect = TimeoutError
+    monkeypatch.setattr(bd, "make_bq_client", lambda: cliente)
+
+    with pytest.raises(TimeoutError):
+        bd.consultar("SELECT 1", nome="usuarios")
+
+    custos = bd.estatisticas_consultas()["por_consulta"]["usuarios"]
+    assert custos["consultas"] == 1
+    assert custos["erros"] == 1
+    assert bd.estatisticas_consultas()["por_endpoint"]["segundo_plano"] == custos
+
+
+def test_registrar_consulta_usa_cache_hit_do_job(sem_custos):
+    job = _resultado(job_id="job-1")
+    job.cache_hit = False
+
+    bd.registrar_consulta("catalogo", job, 0.1)
+
+    custos = bd.estatisticas_consultas()["por_consulta"]["catalogo"]
+    assert custos["em_cache"] == 0
+    assert custos["duracao_ms"] == 100
@@ -0,0 +1,358 @@
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+from unittest.mock import Mock
+
+import pytest
+from fastapi import HTTPException
+
+from ip_mensageria_alocacao_api.core.cache import (
+    FORA_DA_FONTE_LOCAL,
+    BackendDisco,
+    BackendMemoria,
+    BackendRedis,
+    FuncaoDerivada,
+    FuncaoEmCache,
+    cache_consulta,
+)
+
+
+def _funcao_em_cache(maxsize=128):
+    chamadas = Mock(side_effect=lambda chave, sufixo="": f"{chave}{sufixo}")
+
+    @cache_consulta(maxsize=maxsize)
+    def consulta(chave: str, sufixo: str = "") -> str:
+        return chamadas(chave, sufixo)
+
+    return consulta, chamadas
+
+
+def test_cache_consulta_reutiliza_resultado():
+    consulta, chamadas = _funcao_em_cache()
+    assert consulta("a") == "a"
+    assert consulta("a") == "a"
+    assert chamadas.call_count == 1
+    assert consulta.cache_info().hits == 1
+    assert consulta.cache_info().misses == 1
+
+
+def test_cache_consulta_normaliza_argumentos_nomeados():
+    consulta, chamadas = _funcao_em_cache()
+    consulta("a", "b")
+    consulta(chave="a", sufixo="b")
+    consulta("a", sufixo="b")
+    assert chamadas.call_count == 1
+
+
+def test_consultar_cache_nao_executa_funcao():
+    consulta, chamadas = _funcao_em_cache()
+    assert consulta.consultar_cache("a") == (False, None)
+    assert chamadas.call_count == 0
+    consulta("a")
+    assert consulta.consultar_cache("a") == (True, "a")
+    assert chamadas.call_count == 1
+
+
+def test_cache_consulta_descarta_menos_usado():
+    consulta, chamadas = _funcao_em_cache(maxsize=2)
+    consulta("a")
+    consulta("b")
+    consulta("a")
+    consulta("c")  # descarta "b"
+    assert consulta.consultar_cache("b") == (False, None)
+    assert consulta.consultar_cache("a") == (True, "a")
+    assert consulta.cache_info().currsize == 2
+
+
+def test_cache_clear():
+    consulta, chamadas = _funcao_em_cache()
+    consulta("a")
+    consulta.cache_clear()
+    consulta("a")
+    assert chamadas.call_count == 2
+
+
+def test_cache_consulta_usa_fonte_local_antes_do_cache():
+    chamadas = Mock(side_effect=lambda chave: f"bq:{chave}")
+
+    @cache_consulta(fonte_local=lambda chave: "local" if chave == "a" else None)
+    def consulta(chave: str) -> str:
+        return chamadas(chave)
+
+    assert consulta("a") == "local"
+    assert consulta.consultar_cache("a") == (True, "local")
+    assert consulta("b") == "bq:b"
+    assert chamadas.call_count == 1
+    assert consulta.cache_info().currsize == 1
+
+
+def test_fonte_local_pode_responder_none():
+    chamadas = Mock(side_effect=lambda chave: f"bq:{chave}")
+
+    @cache_consulta(
+        fonte_local=lambda chave: None if chave == "a" else FORA_DA_FONTE_LOCAL,
+        ausente_na_fonte_local=FORA_DA_FONTE_LOCAL,
+    )
+    def consulta(chave: str) -> Optional[str]:
+        return chamadas(chave)
+
+    assert consulta("a") is None
+    assert consulta.consultar_cache("a") == (True, None)
+    assert consulta("b") == "bq:b"
+    assert chamadas.call_count == 1
+
+
+def test_armazenar_preenche_cache():
+    consulta, chamadas = _funcao_em_cache()
+    consulta.armazenar("valor", chave="a")
+    assert consulta("a") == "valor"
+    assert chamadas.call_count == 0
+
+
+def test_chamadas_concorrentes_executam_funcao_uma_vez():
+    liberar = threading.Event()
+    chamadas = Mock(side_effect=lambda chave: liberar.wait(5) and chave)
+
+    @cache_consulta()
+    def consulta(chave: str) -> str:
+        return chamadas(chave)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futuros = [executor.submit(consulta, "a") for _ in range(4)]
+        while consulta.cache_info().compartilhadas < 3:
+            time.sleep(0.001)
+        liberar.set()
+        assert [f.result() for f in futuros] == ["a"] * 4
+    assert chamadas.call_count == 1
+    assert consulta.cache_info().misses == 1
+
+
+def test_chamadas_concorrentes_recebem_a_mesma_excecao():
+    liberar = threading.Event()
+
+    @cache_consulta()
+    def consulta(chave: str) -> str:
+        liberar.wait(5)
+        raise ValueError(chave)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futuros = [executor.submit(consulta, "a") for _ in range(3)]
+        while consulta.cache_info().compartilhadas < 2:
+            time.sleep(0.001)
+        liberar.set()
+        for futuro in futuros:
+            with pytest.raises(ValueError, match="a"):
+                futuro.result()
+    # falhas não ficam em cache
+    assert consulta.cache_info().currsize == 0
+
+
+def test_cache_consulta_expira_entradas():
+    chamadas = Mock(return_value="valor")
+
+    @cache_consulta(ttl_segundos=0.05)
+    def consulta(chave: str) -> str:
+        return chamadas(chave)
+
+    consulta("a")
+    consulta("a")
+    assert chamadas.call_count == 1
+    time.sleep(0.1)
+    consulta("a")
+    assert chamadas.call_count == 2
+
+
+def test_cache_consulta_guarda_nao_encontrados():
+    chamadas = Mock(side_effect=HTTPException(status_code=404, detail="inexistente"))
+
+    @cache_consulta(ttl_negativo_segundos=60)
+    def consulta(chave: str) -> str:
+        return chamadas(chave)
+
+    for _ in range(3):
+        with pytest.raises(HTTPException) as erro:
+            consulta("a")
+        assert erro.value.status_code == 404
+        assert erro.value.detail == "inexistente"
+    assert chamadas.call_count == 1
+    assert consulta.cache_info().hits_negativos == 2
+    assert consulta.consultar_cache("a") == (False, None)
+
+
+def test_cache_consulta_guarda_assertion_error_como_nao_encontrado():
+    chamadas = Mock(side_effect=AssertionError("sem linhas"))
+
+    @cache_consulta()
+    def consulta(chave: str) -> str:
+        return chamadas(chave)
+
+    for _ in range(2):
+        with pytest.raises(AssertionError, match="sem linhas"):
+            consulta("a")
+    assert chamadas.call_count == 1
+
+
+def test_cache_consulta_nao_guarda_outros_erros():
+    chamadas = Mock(side_effect=HTTPException(status_code=500, detail="falha"))
+
+    @cache_consulta()
+    def consulta(chave: str) -> str:
+        return chamadas(chave)
+
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            consulta("a")
+    assert chamadas.call_count == 2
+
+
+def test_submeter_guarda_resultados_e_nao_encontrados():
+    pendentes: dict[str, Future] = {}
+
+    def submeter(chave: str) -> Future:
+        return pendentes.setdefault(chave, Future())
+
+    @cache_consulta(submeter=submeter)
+    def consulta(chave: str) -> str:
+        return submeter(chave).result()
+
+    futuro = consulta.submeter("a")
+    # chamadas com a mesma chave compartilham a busca em andamento
+    assert consulta.submeter("a") is futuro
+    pendentes["a"].set_result("A")
+    assert futuro.result() == "A"
+    assert consulta("a") == "A"
+
+    consulta.submeter("b")
+    pendentes.pop("b").set_exception(HTTPException(status_code=404))
+    with pytest.raises(HTTPException):
+        consulta.submeter("b").result()
+    assert "b" not in pendentes
+    assert consulta.cache_info().hits_negativos == 1
+
+
+def test_backend_memoria_expira_e_descarta():
+    backend = BackendMemoria(maxsize=1)
+    backend.guardar("a", 1, ttl_segundos=None)
+    backend.guardar("b", 2, ttl_segundos=None)
+    assert backend.obter("a") == (False, None)
+    assert backend.obter("b") == (True, 2)
+    backend.guardar("c", 3, ttl_segundos=-1)
+    assert backend.obter("c") == (False, None)
+    assert backend.tamanho() == 0
+
+
+def test_backend_disco_compartilhado_entre_processos(tmp_path):
+    caminho = tmp_path / "cache.sqlite"
+    chamadas = Mock(side_effect=lambda chave: {"chave": chave})
+
+    def consulta(chave: str) -> dict:
+        return chamadas(chave)
+
+    # duas instâncias sobre o mesmo arquivo, como dois workers do gunicorn
+    backend1 = BackendDisco(caminho, "c", 10)
+    backend2 = BackendDisco(caminho, "c", 10)
+    worker1 = FuncaoEmCache(consulta, 10, backend=backend1)
+    worker2 = FuncaoEmCache(consulta, 10, backend=backend2)
+    assert worker1("a") == {"chave": "a"}
+    assert worker2("a") == {"chave": "a"}
+    assert chamadas.call_count == 1
+    assert worker2.cache_info().currsize == 1
+
+    outro_nome = BackendDisco(caminho, "outro", 10)
+    assert outro_nome.obter(repr(("a",))) == (False, None)
+    worker2.cache_clear()
+    assert worker1.cache_info().currsize == 0
+    for backend in (backend1, backend2, outro_nome):
+        backend.fechar()
+
+
+def test_backend_disco_remove_excedentes(tmp_path, monkeypatch):
+    monkeypatch.setattr(BackendDisco, "_INTERVALO_LIMPEZA", 1)
+    backend = BackendDisco(tmp_path / "cache.sqlite", "c", maxsize=2)
+    for chave in "abc":
+        backend.guardar(chave, chave, ttl_segundos=None)
+    assert backend.tamanho() == 2
+    assert backend.obter("a") == (False, None)
+    backend.fechar()
+
+
+def test_backend_disco_leitura_nao_grava(tmp_path, monkeypatch):
+    monkeypatch.setattr(BackendDisco, "_INTERVALO_LIMPEZA", 1)
+    caminho = tmp_path / "cache.sqlite"
+    backend = BackendDisco(caminho, "c", maxsize=2)
+    backend.guardar("a", "a", ttl_segundos=None)
+    backend.guardar("b", "b", ttl_segundos=None)
+
+    # outro worker segurando a trava de escrita do arquivo
+    outro = sqlite3.connect(caminho, isolation_level=None)
+    outro.execute("BEGIN IMMEDIATE")
+    assert backend.obter("a") == (True, "a")
+    outro.execute("ROLLBACK")
+    outro.close()
+
+    # o acesso a "a" é gravado com a próxima entrada e a preserva
+    backend.guardar("c", "c", ttl_segundos=None)
+    assert backend.obter("a") == (True, "a")
+    assert backend.obter("b") == (False, None)
+    backend.fechar()
+
+
+class _ClienteRedisFalso:
+    def __init__(self):
+        self.dados = {}
+        self.validades = {}
+
+    def get(self, chave):
+        return self.dados.get(chave)
+
+    def set(self, chave, valor, px=None):
+        self.dados[chave] = valor
+        self.validades[chave] = px
+
+    def scan_iter(self, match):
+        return [chave for chave in self.dados if chave.startswith(match[:-1])]
+
+    def delete(self, *chaves):
+        for chave in chaves:
+            self.dados.pop(chave, None)
+
+
+def test_backend_redis_usa_prefixo_e_validade():
+    cliente = _ClienteRedisFalso()
+    backend = BackendRedis("redis://local", "midia", cliente=cliente)
+    backend.guardar("a", [1, 2], ttl_segundos=1.5)
+    assert backend.obter("a") == (True, [1, 2])
+    assert cliente.validades == {"ip_mensageria:midia:a": 1500}
+    assert backend.tamanho() == 1
+    backend.limpar()
+    assert backend.obter("a") == (False, None)
+
+
+def test_backend_redis_reaproveita_contagem_de_chaves():
+    cliente = _ClienteRedisFalso()
+    cliente.scan_iter = Mock(side_effect=lambda match: ["ip_mensageria:midia:a"])
+    backend = BackendRedis("redis://local", "midia", cliente=cliente)
+
+    assert backend.tamanho() == 1
+    assert backend.tamanho() == 1
+    assert cliente.scan_iter.call_count == 1
+
+
+def test_backend_redis_sem_pacote(monkeypatch):
+    monkeypatch.setitem(sys.modules, "redis", None)
+    with pytest.raises(RuntimeError, match="redis"):
+        BackendRedis("redis://local", "midia")
+
+
+def test_funcao_derivada_aplica_derivacao_a_cada_chamada():
+    consulta, chamadas = _funcao_em_cache()
+    sufixos = iter(["!", "?"])
+    derivada = FuncaoDerivada(consulta, lambda valor: valor + next(sufixos))
+
+    assert derivada.consultar_cache("a") == (False, None)
+    assert derivada("a") == "a!"
+    assert derivada.consultar_cache("a") == (True, "a?")
+    assert chamadas.call_count == 1
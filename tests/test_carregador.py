@@ -0,0 +1,96 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock
+
+import pytest
+
+from ip_mensageria_alocacao_api.core.carregador import CarregadorEmLote
+
+
+def _carregador(janela_segundos=0.05, max_lote=100, carregar_lote=None):
+    carregar_lote = Mock(
+        side_effect=carregar_lote
+        or (lambda chaves: {c: c.upper() for c in chaves if c != "ausente"})
+    )
+    return (
+        CarregadorEmLote(
+            "teste",
+            carregar_lote,
+            janela_segundos=janela_segundos,
+            max_lote=max_lote,
+        ),
+        carregar_lote,
+    )
+
+
+def test_agrupa_pedidos_concorrentes_em_um_lote():
+    carregador, carregar_lote = _carregador()
+    chaves = ["a", "b", "c", "a", "ausente"]
+    with ThreadPoolExecutor(max_workers=len(chaves)) as executor:
+        resultados = list(executor.map(carregador.carregar, chaves))
+
+    assert resultados == ["A", "B", "C", "A", None]
+    assert carregar_lote.call_count == 1
+    assert sorted(carregar_lote.call_args.args[0]) == ["a", "ausente", "b", "c"]
+    assert carregador.estatisticas() == {"pedidos": 5, "chaves": 4, "lotes": 1}
+
+
+def test_sem_janela_carrega_imediatamente():
+    carregador, carregar_lote = _carregador(janela_segundos=0)
+    assert carregador.carregar("a") == "A"
+    assert carregador.carregar("b") == "B"
+    assert carregar_lote.call_count == 2
+
+
+def test_divide_lotes_maiores_que_o_maximo():
+    carregador, carregar_lote = _carregador(max_lote=2)
+    chaves = ["a", "b", "c", "d", "e"]
+    with ThreadPoolExecutor(max_workers=len(chaves)) as executor:
+        resultados = list(executor.map(carregador.carregar, chaves))
+
+    assert resultados == ["A", "B", "C", "D", "E"]
+    assert all(len(c.args[0]) <= 2 for c in carregar_lote.call_args_list)
+
+
+def test_submeter_nao_bloqueia_e_agrupa_na_mesma_janela():
+    carregador, carregar_lote = _carregador(max_lote=1000)
+    futuros = [carregador.submeter(f"c{i}") for i in range(200)]
+
+    assert not any(futuro.done() for futuro in futuros)
+    assert [futuro.result(timeout=5) for futuro in futuros] == [
+        f"C{i}" for i in range(200)
+    ]
+    assert carregar_lote.call_count == 1
+    assert carregador.estatisticas() == {"pedidos": 200, "chaves": 200, "lotes": 1}
+
+
+def test_lote_cheio_despacha_antes_da_janela():
+    carregador, carregar_lote = _carregador(janela_segundos=60, max_lote=3)
+    futuros = [carregador.submeter(c) for c in "abc"]
+
+    assert [futuro.result(timeout=5) for futuro in futuros] == ["A", "B", "C"]
+    assert carregar_lote.call_count == 1
+
+
+def test_erro_propagado_a_todos_os_chamadores():
+    def falhar(chaves):
+        raise RuntimeError("BigQuery indisponível")
+
+    carregador, _ = _carregador(carregar_lote=falhar)
+    erros = []
+
+    def carregar(chave):
+        try:
+            carregador.carregar(chave)
+        except RuntimeError as exc:
+            erros.append(exc)
+
+    threads = [threading.Thread(target=carregar, args=(c,)) for c in "abc"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(erros) == 3
+
+    with pytest.raises(RuntimeError):
+        carregador.carregar("d")
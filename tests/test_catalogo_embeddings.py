@@ -0,0 +1,180 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from ip_mensageria_alocacao_api.core import auxiliar, catalogo_embeddings
+from ip_mensageria_alocacao_api.core.catalogo_embeddings import (
+    CatalogoEmbeddings,
+    montar_texto_template,
+    normalizar_uri_midia,
+)
+
+
+@pytest.fixture
+def catalogo():
+    return CatalogoEmbeddings.de_linhas(
+        [
+            SimpleNamespace(
+                template_nome="lembrete",
+                content=montar_texto_template("Olá!", "Sim"),
+                embedding=[0.1, 0.2, 0.3],
+            ),
+            SimpleNamespace(template_nome=None, content="outro", embedding=[1, 2, 3]),
+        ],
+        [
+            SimpleNamespace(uri="gs://bucket/a.png", embedding=[0.5, 0.5]),
+            SimpleNamespace(
+                uri="gs://bucket/ip-mensageria-turn-midias/b.png", embedding=[0.7, 0.3]
+            ),
+        ],
+        [
+            SimpleNamespace(url_turn="https://turn/a", uri="gs://bucket/a.png"),
+            SimpleNamespace(
+                url_turn="https://turn/b",
+                uri="gs://bucket/ip-mensageria-turn-midias/ip-mensageria-turn-midias/o/b.png",
+            ),
+            SimpleNamespace(url_turn="https://turn/x", uri="gs://bucket/x.png"),
+        ],
+    )
+
+
+@pytest.fixture
+def catalogo_ativo(catalogo, monkeypatch):
+    monkeypatch.setattr(catalogo_embeddings, "_catalogo", catalogo)
+    return catalogo
+
+
+def test_catalogo_matrizes_float32_somente_leitura(catalogo):
+    assert catalogo.templates.dtype == np.float32
+    assert catalogo.templates.shape == (2, 3)
+    assert catalogo.midias.shape == (2, 2)
+    assert not catalogo.templates.flags.writeable
+
+
+def test_catalogo_indices(catalogo):
+    np.testing.assert_allclose(catalogo.template_por_nome("lembrete"), [0.1, 0.2, 0.3])
+    np.testing.assert_allclose(catalogo.template_por_texto("outro"), [1, 2, 3])
+    np.testing.assert_allclose(
+        catalogo.midia_por_url("gs://bucket/ip-mensageria-turn-midias/b.png"),
+        [0.7, 0.3],
+    )
+    # url_turn mapeada pela URI normalizada
+    np.testing.assert_allclose(catalogo.midia_por_url("https://turn/b"), [0.7, 0.3])
+    np.testing.assert_allclose(catalogo.midia_por_url("https://turn/a"), [0.5, 0.5])
+    assert catalogo.template_por_nome("inexistente") is None
+    # url_turn cuja mídia não tem embedding não entra no índice
+    assert catalogo.midia_por_url("https://turn/x") is None
+
+
+def test_consultas_usam_catalogo_sem_bigquery(catalogo_ativo, monkeypatch):
+    consultar = Mock()
+    monkeypatch.setattr(auxiliar, "consultar", consultar)
+
+    np.testing.assert_allclose(
+        auxiliar.obter_template_embedding_por_nome("lembrete"), [0.1, 0.2, 0.3]
+    )
+    np.testing.assert_allclose(
+        auxiliar.obter_template_embedding_por_texto("Olá!", "Sim"), [0.1, 0.2, 0.3]
+    )
+    np.testing.assert_allclose(
+        auxiliar.obter_midia_embedding("https://turn/a"), [0.5, 0.5]
+    )
+    consultar.assert_not_called()
+
+
+def test_atualizar_so_recarrega_quando_tabelas_mudam(catalogo, monkeypatch):
+    versoes = [(datetime(2025, 1, 1),) * 3]
+    monkeypatch.setattr(catalogo_embeddings, "_catalogo", None)
+    monkeypatch.setattr(catalogo_embeddings, "_versoes_tabelas", None)
+    monkeypatch.setattr(catalogo_embeddings, "_versoes_atuais", lambda: versoes[0])
+    carregar = Mock(return_value=catalogo)
+    monkeypatch.setattr(CatalogoEmbeddings, "carregar_do_bigquery", carregar)
+
+    catalogo_embeddings.atualizar_catalogo_embeddings()
+    catalogo_embeddings.atualizar_catalogo_embeddings()
+    assert carregar.call_count == 1
+
+    versoes[0] = (datetime(2025, 1, 2),) * 3
+    catalogo_embeddings.atualizar_catalogo_embeddings()
+    assert carregar.call_count == 2
+    assert catalogo_embeddings.obter_catalogo_embeddings() is catalogo
+
+
+def test_carregar_registra_duracao_de_cada_job(monkeypatch):
+    def job(segundos):
+        inicio = datetime(2025, 1, 1, 12, 0, 0)
+        return Mock(
+            started=inicio,
+            ended=inicio + timedelta(seconds=segundos),
+            result=Mock(return_value=[]),
+        )
+
+    cliente = Mock()
+    cliente.query.side_effect = [job(1), job(2), job(3)]
+    registrar = Mock()
+    monkeypatch.setattr(catalogo_embeddings, "make_bq_client", lambda: cliente)
+    monkeypatch.setattr(catalogo_embeddings, "registrar_consulta", registrar)
+    monkeypatch.setattr(CatalogoEmbeddings, "de_linhas", Mock())
+
+    CatalogoEmbeddings.carregar_do_bigquery()
+
+    duracoes = {c.args[0]: c.args[2] for c in registrar.call_args_list}
+    assert duracoes == {
+        "catalogo_templates": 1.0,
+        "catalogo_midias": 2.0,
+        "catalogo_midias_turn": 3.0,
+    }
+
+
+def test_normalizar_uri_midia():
+    assert (
+        normalizar_uri_midia(
+            "gs://b/ip-mensageria-turn-midias/ip-mensageria-turn-midias/o/x.png"
+        )
+        == "gs://b/ip-mensageria-turn-midias/x.png"
+    )
+    assert normalizar_uri_midia("gs://b/x.png") == "gs://b/x.png"
+
+
+def test_salvar_e_abrir_mapeia_matrizes(catalogo, tmp_path):
+    catalogo.salvar(tmp_path, ["2025-01-01T00:00:00"])
+    catalogo.salvar(tmp_path, ["2025-01-02T00:00:00"])
+    # a gravação anterior é descartada
+    assert len(list(tmp_path.glob("embeddings-*.f32"))) == 1
+
+    aberto, versoes = CatalogoEmbeddings.abrir(tmp_path)
+    assert versoes == ["2025-01-02T00:00:00"]
+    assert isinstance(aberto.templates, np.memmap)
+    assert not aberto.midias.flags.writeable
+    np.testing.assert_allclose(aberto.templates, catalogo.templates)
+    np.testing.assert_allclose(aberto.midias, catalogo.midias)
+    np.testing.assert_allclose(aberto.midia_por_url("https://turn/b"), [0.7, 0.3])
+    assert aberto.templates_por_hash == catalogo.templates_por_hash
+
+
+def test_abrir_sem_catalogo_gravado(tmp_path):
+    assert CatalogoEmbeddings.abrir(tmp_path) is None
+
+
+def test_atualizar_compartilhado_exporta_uma_vez(catalogo, monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        catalogo_embeddings.configs, "CATALOGO_EMBEDDINGS_CAMINHO", str(tmp_path)
+    )
+    monkeypatch.setattr(
+        catalogo_embeddings, "_versoes_atuais", lambda: (datetime(2025, 1, 1),) * 3
+    )
+    carregar = Mock(return_value=catalogo)
+    monkeypatch.setattr(CatalogoEmbeddings, "carregar_do_bigquery", carregar)
+
+    # dois workers: o segundo mapeia o arquivo gravado pelo primeiro
+    for _ in range(2):
+        monkeypatch.setattr(catalogo_embeddings, "_catalogo", None)
+        monkeypatch.setattr(catalogo_embeddings, "_versoes_tabelas", None)
+        catalogo_embeddings.atualizar_catalogo_embeddings()
+        ativo = catalogo_embeddings.obter_catalogo_embeddings()
+        assert isinstance(ativo.templates, np.memmap)
+        np.testing.assert_allclose(ativo.template_por_nome("lembrete"), [0.1, 0.2, 0.3])
+    assert carregar.call_count == 1
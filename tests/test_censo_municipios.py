@@ -0,0 +1,88 @@
+import threading
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from ip_mensageria_alocacao_api.core import censo_municipios
+from ip_mensageria_alocacao_api.core.censo_municipios import CensoMunicipios
+
+
+@pytest.fixture
+def censo():
+    return CensoMunicipios.de_linhas(
+        [
+            SimpleNamespace(cod_mun_ibge=221100, perc_dom_zona_rural=0.4),
+            SimpleNamespace(cod_mun_ibge=210000, perc_dom_zona_rural=0.1),
+            SimpleNamespace(cod_mun_ibge=230000, perc_dom_zona_rural=None),
+            SimpleNamespace(cod_mun_ibge=None, perc_dom_zona_rural=0.9),
+        ]
+    )
+
+
+def test_censo_ordenado_por_codigo(censo):
+    assert list(censo.codigos) == ["210000", "221100", "230000"]
+    assert len(censo) == 3
+
+
+def test_proporcoes_por_busca_binaria(censo):
+    props = censo.proporcoes([221100, "210000", None, "999999", 230000, "000001"])
+    np.testing.assert_array_equal(props, [0.4, 0.1, np.nan, np.nan, np.nan, np.nan])
+    assert censo.proporcao("221100") == 0.4
+    assert censo.proporcao("999999") is None
+
+
+def test_proporcoes_censo_vazio():
+    vazio = CensoMunicipios.de_linhas([])
+    assert np.isnan(vazio.proporcoes(["1"])).all()
+    assert len(vazio.proporcoes([])) == 0
+
+
+def test_obter_censo_carrega_uma_vez(censo, monkeypatch):
+    carregar = Mock(return_value=censo)
+    monkeypatch.setattr(CensoMunicipios, "carregar_do_bigquery", carregar)
+    monkeypatch.setattr(censo_municipios, "_censo", None)
+
+    assert censo_municipios.obter_censo_municipios() is censo
+    assert censo_municipios.obter_censo_municipios() is censo
+    assert carregar.call_count == 1
+
+
+@pytest.mark.parametrize("requisicao_primeiro", [False, True])
+def test_carga_inicial_e_sob_demanda_nao_se_repetem(
+    censo, monkeypatch, requisicao_primeiro
+):
+    iniciou = threading.Event()
+    liberar = threading.Event()
+
+    def carregar():
+        iniciou.set()
+        liberar.wait(5)
+        return censo
+
+    carregar_do_bigquery = Mock(side_effect=carregar)
+    monkeypatch.setattr(CensoMunicipios, "carregar_do_bigquery", carregar_do_bigquery)
+    monkeypatch.setattr(censo_municipios, "_censo", None)
+    monkeypatch.setattr(censo_municipios, "_sincronizado", False)
+
+    primeira, segunda = (
+        censo_municipios.obter_censo_municipios,
+        censo_municipios._sincronizar_censo_municipios,
+    )
+    if not requisicao_primeiro:
+        primeira, segunda = segunda, primeira
+    threads = [threading.Thread(target=primeira), threading.Thread(target=segunda)]
+    threads[0].start()
+    assert iniciou.wait(5)
+    threads[1].start()
+    liberar.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert carregar_do_bigquery.call_count == 1
+    assert censo_municipios.obter_censo_municipios() is censo
+
+    # as execuções seguintes da tarefa recarregam
+    censo_municipios._sincronizar_censo_municipios()
+    assert carregar_do_bigquery.call_count == 2
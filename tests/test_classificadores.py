@@ -2,7 +2,9 @@ import importlib.util
 import json
 import pickle
 import sys
+import time
 import types
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pytest
@@ -31,6 +33,7 @@ def _load_classificadores_module(artefatos_predicao_uri: str = "gs://bucket/pref
             imputador_numerico,
             template_embedding_dims,
             midia_embedding_dims,
+            plano_atributos=None,
         ):
             self.modelos = modelos
             self.atributos_colunas = atributos_colunas
@@ -38,6 +41,7 @@ def _load_classificadores_module(artefatos_predicao_uri: str = "gs://bucket/pref
             self.imputador_numerico = imputador_numerico
             self.template_embedding_dims = template_embedding_dims
             self.midia_embedding_dims = midia_embedding_dims
+            self.plano_atributos = plano_atributos
 
     setattr(modelos_mod, "Classificador", Classificador)
 
@@ -117,14 +121,28 @@ def _load_classificadores_module(artefatos_predicao_uri: str = "gs://bucket/pref
         sys_modules_backup[name] = sys.modules.get(name)
         sys.modules[name] = mod
 
-    module_path = (
+    core_path = (
         Path(__file__).resolve().parents[1]
         / "src"
         / "ip_mensageria_alocacao_api"
         / "core"
-        / "classificadores.py"
     )
+    module_path = core_path / "classificadores.py"
     try:
+        # os helpers de GCS, carregados sobre o storage falso
+        sys_modules_backup["ip_mensageria_alocacao_api.core.gcs"] = sys.modules.get(
+            "ip_mensageria_alocacao_api.core.gcs"
+        )
+        spec_gcs = importlib.util.spec_from_file_location(
+            "ip_mensageria_alocacao_api.core.gcs", str(core_path / "gcs.py")
+        )
+        assert spec_gcs is not None
+        assert spec_gcs.loader is not None
+        gcs_mod = importlib.util.module_from_spec(spec_gcs)
+        sys.modules["ip_mensageria_alocacao_api.core.gcs"] = gcs_mod
+        spec_gcs.loader.exec_module(gcs_mod)
+        setattr(src_core, "gcs", gcs_mod)
+
         spec = importlib.util.spec_from_file_location(
             "classificadores_under_test", str(module_path)
         )
@@ -150,8 +168,8 @@ def _load_classificadores_module(artefatos_predicao_uri: str = "gs://bucket/pref
 
 def test_parse_gcs_variants():
     mod, _ = _load_classificadores_module()
-    assert mod._parse_gcs("gs://bucket/prefix/path") == ("bucket", "prefix/path")
-    assert mod._parse_gcs("gs://bucket") == ("bucket", "")
+    assert mod.parse_gcs("gs://bucket/prefix/path") == ("bucket", "prefix/path")
+    assert mod.parse_gcs("gs://bucket") == ("bucket", "")
 
 
 def test_carregar_classificadores_and_caching():
@@ -166,9 +184,29 @@ def test_carregar_classificadores_and_caching():
     assert artef is artef2
 
 
+def test_carregar_classificadores_concorrente_baixa_uma_vez(monkeypatch):
+    mod, _ = _load_classificadores_module()
+    baixar = mod._baixar_classificadores
+    chamadas = []
+
+    def baixar_devagar():
+        chamadas.append(1)
+        time.sleep(0.05)
+        return baixar()
+
+    monkeypatch.setattr(mod, "_baixar_classificadores", baixar_devagar)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        resultados = list(
+            executor.map(lambda _: mod.carregar_classificadores(), range(8))
+        )
+
+    assert len(chamadas) == 1
+    assert all(r is resultados[0] for r in resultados)
+
+
 def test_parse_gcs_invalid_uri():
     with pytest.raises(AssertionError):
-        _load_classificadores_module()[0]._parse_gcs("http://invalid.com/path")
+        _load_classificadores_module()[0].parse_gcs("http://invalid.com/path")
 
 
 def test_carregar_classificadores_offline_mode(monkeypatch):
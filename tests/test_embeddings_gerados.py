@@ -0,0 +1,86 @@
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from ip_mensageria_alocacao_api.core import embeddings_gerados
+from ip_mensageria_alocacao_api.core.catalogo_embeddings import hash_conteudo
+
+
+@pytest.fixture
+def mock_client(monkeypatch):
+    client = Mock()
+    client.insert_rows_json.return_value = []
+    monkeypatch.setattr(embeddings_gerados, "make_bq_client", lambda: client)
+    return client
+
+
+@pytest.fixture
+def mock_consultar(monkeypatch):
+    consultar = Mock()
+    monkeypatch.setattr(embeddings_gerados, "consultar", consultar)
+    return consultar
+
+
+def test_reaproveita_embeddings_persistidos(mock_client, mock_consultar):
+    mock_consultar.side_effect = [
+        iter([Mock(content_hash=hash_conteudo("olá"), embedding=[0.1, 0.2])]),
+    ]
+
+    result = embeddings_gerados.gerar_embeddings_textos([" olá \n"])
+
+    np.testing.assert_allclose(result[" olá \n"], [0.1, 0.2], rtol=1e-6)
+    assert result[" olá \n"].dtype == np.float32
+    assert mock_consultar.call_count == 1
+    mock_client.insert_rows_json.assert_not_called()
+
+
+def test_gera_ineditos_em_uma_chamada_e_persiste(mock_client, mock_consultar):
+    mock_consultar.side_effect = [
+        iter([Mock(content_hash=hash_conteudo("a"), embedding=[1.0])]),
+        iter([Mock(content="b", embedding=[2.0]), Mock(content="c", embedding=[3.0])]),
+    ]
+
+    result = embeddings_gerados.gerar_embeddings_textos(["a", "b", "c", "b"])
+
+    assert {t: float(e[0]) for t, e in result.items()} == {"a": 1, "b": 2, "c": 3}
+    assert mock_consultar.call_count == 2
+    job_config = mock_consultar.call_args.kwargs["job_config"]
+    assert job_config.query_parameters[0].values == ["b", "c"]
+    linhas = mock_client.insert_rows_json.call_args.args[1]
+    assert [linha["content"] for linha in linhas] == ["b", "c"]
+
+
+def test_falha_na_persistencia_nao_interrompe(mock_client, mock_consultar):
+    mock_consultar.side_effect = [iter([]), iter([Mock(content="a", embedding=[1])])]
+    mock_client.insert_rows_json.side_effect = RuntimeError("indisponível")
+
+    result = embeddings_gerados.gerar_embeddings_textos(["a"])
+
+    assert float(result["a"][0]) == 1.0
+
+
+def test_erro_quando_geracao_nao_devolve_embedding(mock_client, mock_consultar):
+    mock_consultar.side_effect = [iter([]), iter([])]
+
+    with pytest.raises(HTTPException) as exc_info:
+        embeddings_gerados.gerar_embeddings_textos(["a"])
+    assert exc_info.value.status_code == 500
+
+
+def test_gera_com_texto_original(mock_client, mock_consultar):
+    texto = "Olá!\nSim\nNão\n\n\n"
+    mock_consultar.side_effect = [
+        iter([]),
+        iter([Mock(content=texto, embedding=[1.0])]),
+    ]
+
+    result = embeddings_gerados.gerar_embeddings_textos([texto])
+
+    assert float(result[texto][0]) == 1.0
+    job_config = mock_consultar.call_args.kwargs["job_config"]
+    assert job_config.query_parameters[0].values == [texto]
+    linha = mock_client.insert_rows_json.call_args.args[1][0]
+    assert linha["content"] == texto
+    assert linha["content_hash"] == hash_conteudo("Olá!\nSim\nNão")
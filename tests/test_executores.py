@@ -0,0 +1,162 @@
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest.mock import Mock
+
+import pytest
+
+from ip_mensageria_alocacao_api.core import configs, executores
+
+
+@pytest.fixture(autouse=True)
+def limpar_executor(monkeypatch):
+    monkeypatch.setattr(executores, "_executor_ensemble", None)
+    monkeypatch.setattr(executores, "_num_cpus", lambda: 8)
+
+
+def test_num_threads_ensemble_padrao_usa_cpus(monkeypatch):
+    monkeypatch.setattr(configs, "ENSEMBLE_NUM_THREADS", None)
+    assert executores.num_threads_ensemble() == 8
+    assert executores.num_threads_por_modelo() == 1
+
+
+def test_num_threads_por_modelo_divide_nucleos(monkeypatch):
+    monkeypatch.setattr(configs, "ENSEMBLE_NUM_THREADS", 2)
+    assert executores.num_threads_ensemble() == 2
+    assert executores.num_threads_por_modelo() == 4
+
+
+def test_obter_executor_ensemble_sequencial(monkeypatch):
+    monkeypatch.setattr(configs, "ENSEMBLE_NUM_THREADS", 1)
+    assert executores.obter_executor_ensemble() is None
+    assert executores.num_threads_por_modelo() == 8
+
+
+def test_obter_executor_ensemble_reutiliza_instancia(monkeypatch):
+    monkeypatch.setattr(configs, "ENSEMBLE_NUM_THREADS", 4)
+    executor = executores.obter_executor_ensemble()
+    assert isinstance(executor, ThreadPoolExecutor)
+    assert executores.obter_executor_ensemble() is executor
+    executor.shutdown()
+
+
+def test_submeter_consulta_em_cache_nao_usa_pool(monkeypatch):
+    from ip_mensageria_alocacao_api.core.cache import cache_consulta
+
+    @cache_consulta(maxsize=8)
+    def consulta(chave: str) -> str:
+        return chave.upper()
+
+    assert executores.submeter_consulta(consulta, "a").result() == "A"
+
+    pool = Mock()
+    monkeypatch.setattr(executores, "obter_executor_consultas", lambda: pool)
+    futuro = executores.submeter_consulta(consulta, "a")
+
+    assert futuro.done()
+    assert futuro.result() == "A"
+    pool.submit.assert_not_called()
+
+
+def test_submeter_consulta_agrupa_mais_chaves_que_threads_do_pool(monkeypatch):
+    from ip_mensageria_alocacao_api.core.cache import cache_consulta
+    from ip_mensageria_alocacao_api.core.carregador import CarregadorEmLote
+
+    monkeypatch.setattr(configs, "CONSULTAS_NUM_THREADS", 2)
+    monkeypatch.setattr(executores, "_executor_consultas", None)
+    carregar_lote = Mock(side_effect=lambda chaves: {c: c.upper() for c in chaves})
+    carregador = CarregadorEmLote(
+        "teste", carregar_lote, janela_segundos=0.05, max_lote=1000
+    )
+
+    @cache_consulta(maxsize=1000, submeter=carregador.submeter)
+    def consulta(chave: str) -> str:
+        return carregador.carregar(chave)
+
+    chaves = [f"c{i}" for i in range(500)]
+    futuros = [executores.submeter_consulta(consulta, chave) for chave in chaves]
+
+    assert [futuro.result(timeout=5) for futuro in futuros] == [
+        chave.upper() for chave in chaves
+    ]
+    # um único job para as 500 chaves, e nenhuma thread do pool ocupada
+    assert carregar_lote.call_count == 1
+    assert executores.obter_executor_consultas().estatisticas()["concluidas"] == 0
+    assert consulta("c1") == "C1"
+    assert carregar_lote.call_count == 1
+
+
+def test_executor_monitorado_contabiliza_fila():
+    import threading
+
+    executor = executores.ExecutorMonitorado(max_workers=1, thread_name_prefix="teste")
+    liberar = threading.Event()
+    iniciou = threading.Event()
+
+    def bloqueia():
+        iniciou.set()
+        liberar.wait(5)
+
+    primeiro = executor.submit(bloqueia)
+    iniciou.wait(5)
+    segundo = executor.submit(lambda: None)
+
+    assert executor.estatisticas() == {
+        "threads": 1,
+        "na_fila": 1,
+        "em_execucao": 1,
+        "concluidas": 0,
+    }
+    liberar.set()
+    primeiro.result(5)
+    segundo.result(5)
+    assert executor.estatisticas()["concluidas"] == 2
+    assert executor.estatisticas()["na_fila"] == 0
+    executor.shutdown()
+
+
+def test_executar_bloqueante_fora_do_event_loop(monkeypatch):
+    import asyncio
+    import threading
+
+    monkeypatch.setattr(executores, "_executor_requisicoes", None)
+
+    async def principal():
+        return await executores.executar_bloqueante(
+            lambda sufixo: threading.current_thread().name + sufixo, sufixo="!"
+        )
+
+    nome = asyncio.run(principal())
+    assert nome.startswith("requisicoes")
+    assert nome.endswith("!")
+    assert "requisicoes" in executores.estatisticas_executores()
+
+
+def test_executor_monitorado_propaga_contexto():
+    variavel: contextvars.ContextVar[str] = contextvars.ContextVar(
+        "variavel", default="padrao"
+    )
+    executor = executores.ExecutorMonitorado(max_workers=1, thread_name_prefix="t")
+    try:
+        variavel.set("requisicao")
+        assert executor.submit(variavel.get).result() == "requisicao"
+    finally:
+        executor.shutdown()
+
+
+def test_calcular_prazo(monkeypatch):
+    monkeypatch.setattr(configs, "PREDICAO_PRAZO_MILISSEGUNDOS", None)
+    assert executores.calcular_prazo() is None
+
+    monkeypatch.setattr(configs, "PREDICAO_PRAZO_MILISSEGUNDOS", 200.0)
+    monkeypatch.setattr(executores.time, "monotonic", lambda: 10.0)
+    assert executores.calcular_prazo() == pytest.approx(10.2)
+    assert executores.calcular_prazo(50) == pytest.approx(10.05)
+    assert executores.calcular_prazo(50, inicio=9.0) == pytest.approx(9.05)
+
+
+def test_aguardar_respeita_prazo():
+    pendente: Future[int] = Future()
+
+    assert executores.aguardar(executores.concluido(1), prazo=0.0) == 1
+    with pytest.raises(TimeoutError):
+        executores.aguardar(pendente, executores.calcular_prazo(10))
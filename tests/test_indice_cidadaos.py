@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from ip_mensageria_alocacao_api.core import indice_cidadaos
+from ip_mensageria_alocacao_api.core.indice_cidadaos import IndiceCidadaos
+
+
+@pytest.fixture
+def indice():
+    return IndiceCidadaos.de_ids(["c3", "a1", 22, "a1"])
+
+
+def test_indice_ordenado_sem_repeticoes(indice):
+    assert list(indice.ids) == ["22", "a1", "c3"]
+    assert len(indice) == 3
+
+
+def test_conhecidos_por_busca_binaria(indice):
+    np.testing.assert_array_equal(
+        indice.conhecidos(["a1", "b", "c3", "zz", "22", "0"]),
+        [True, False, True, False, True, False],
+    )
+    assert "c3" in indice
+    assert "c" not in indice
+
+
+def test_indice_vazio():
+    vazio = IndiceCidadaos.de_ids([])
+    assert "a1" not in vazio
+    assert len(vazio.conhecidos([])) == 0
+
+
+def test_cidadao_desconhecido_sem_indice_nao_recusa(monkeypatch):
+    monkeypatch.setattr(indice_cidadaos, "_indice", None)
+    assert not indice_cidadaos.cidadao_desconhecido("qualquer")
+
+
+def test_cidadao_desconhecido_com_indice(indice, monkeypatch):
+    monkeypatch.setattr(indice_cidadaos, "_indice", indice)
+    assert indice_cidadaos.cidadao_desconhecido("b")
+    assert not indice_cidadaos.cidadao_desconhecido("a1")
+
+
+def test_atualizar_exporta_da_tabela_de_cidadaos(indice, monkeypatch):
+    monkeypatch.setattr(IndiceCidadaos, "exportar_do_bigquery", lambda: indice)
+    monkeypatch.setattr(indice_cidadaos, "_indice", None)
+
+    indice_cidadaos.atualizar_indice_cidadaos()
+
+    assert indice_cidadaos.obter_indice_cidadaos() is indice
@@ -0,0 +1,96 @@
+import time
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from ip_mensageria_alocacao_api.core import prefetch
+from ip_mensageria_alocacao_api.core.modelos import (
+    DiaSemana,
+    LinhaCuidado,
+    Mensagem,
+    PrefetchRequisicao,
+    Template,
+)
+
+
+def _aguardar(prefetch_id, timeout=5.0):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        progresso = prefetch.obter_progresso_prefetch(prefetch_id)
+        if progresso.estado in ("concluido", "falhou"):
+            return progresso
+        time.sleep(0.01)
+    raise TimeoutError(prefetch_id)
+
+
+@pytest.fixture
+def consultas(monkeypatch):
+    mocks = {
+        "antecipar_caracteristicas_usuarios": Mock(
+            side_effect=lambda ids: len([i for i in ids if i != "inexistente"])
+        ),
+        "antecipar_tempos_desde_ultimo_procedimento": Mock(),
+        "obter_template_embedding_por_nome": Mock(return_value=np.zeros(3)),
+        "obter_template_embeddings_por_textos": Mock(return_value=[np.zeros(3)]),
+        "obter_midia_embedding": Mock(
+            side_effect=HTTPException(status_code=404, detail="sem mídia")
+        ),
+    }
+    for nome, mock in mocks.items():
+        monkeypatch.setattr(prefetch, nome, mock)
+    monkeypatch.setattr(prefetch.configs, "CARREGADOR_MAX_LOTE", 2)
+    return mocks
+
+
+def test_prefetch_carrega_cidadaos_em_lotes_e_mensagens(consultas):
+    mensagem_nome = Mensagem(dia_semana=DiaSemana.segunda, horario=9, template_nome="t")
+    mensagem_texto = Mensagem(
+        dia_semana=DiaSemana.segunda, horario=9, template=Template(texto="Olá")
+    )
+    mensagem_midia = Mensagem(
+        dia_semana=DiaSemana.segunda,
+        horario=9,
+        template_nome="t",
+        midia_url="https://turn/x",
+    )
+    requisicao = PrefetchRequisicao(
+        cidadaos_ids=["1", "2", "inexistente", "1"],
+        linha_cuidado=LinhaCuidado.cronicos,
+        mensagens=[mensagem_nome, mensagem_texto, mensagem_midia, mensagem_nome],
+    )
+
+    iniciado = prefetch.iniciar_prefetch(requisicao)
+    assert iniciado.cidadaos_total == 3
+    assert iniciado.mensagens_total == 3
+    progresso = _aguardar(iniciado.id)
+
+    assert progresso.estado == "concluido"
+    assert progresso.cidadaos_carregados == 2
+    assert progresso.cidadaos_nao_encontrados == 1
+    assert progresso.mensagens_carregadas == 2
+    assert progresso.mensagens_com_erro == 1
+    assert progresso.concluido_em is not None
+    lotes = [
+        c.args[0]
+        for c in consultas["antecipar_caracteristicas_usuarios"].call_args_list
+    ]
+    assert lotes == [["1", "2"], ["inexistente"]]
+    consultas["antecipar_tempos_desde_ultimo_procedimento"].assert_called_with(
+        ["inexistente"], LinhaCuidado.cronicos
+    )
+
+
+def test_prefetch_registra_falha(consultas):
+    consultas["antecipar_caracteristicas_usuarios"].side_effect = RuntimeError("bq")
+    requisicao = PrefetchRequisicao(
+        cidadaos_ids=["1"], linha_cuidado=LinhaCuidado.cronicos
+    )
+    progresso = _aguardar(prefetch.iniciar_prefetch(requisicao).id)
+    assert progresso.estado == "falhou"
+    assert progresso.erro == "bq"
+
+
+def test_progresso_de_prefetch_inexistente():
+    assert prefetch.obter_progresso_prefetch("nao-existe") is None
@@ -1,6 +1,8 @@
-from unittest.mock import Mock, patch
+import time
+from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
 from ip_mensageria_alocacao_api.core.autenticacao import obter_usuario_atual_via_api_key
@@ -72,6 +74,36 @@ def test_alocar_missing_auth(client):
     assert response.status_code == 400
 
 
+def test_prever_efetividade_em_lote_missing_auth(client):
+    """Test batch prediction endpoint requires authentication."""
+    response = client.post(
+        "/prever_efetividade_mensagens/lote",
+        params={"linha_cuidado": "crônicos", "mensagem_tipo": "mensagem_inicial"},
+        json={"cidadaos_ids": ["123"], "mensagens": []},
+    )
+    assert response.status_code == 400
+
+
+def test_prever_e_alocar_missing_auth(client):
+    """Test predict-and-allocate endpoint requires authentication."""
+    response = client.post(
+        "/prever_e_alocar",
+        params={
+            "cidadao_id": "123",
+            "linha_cuidado": "crônicos",
+            "mensagem_tipo": "mensagem_inicial",
+        },
+        json=[],
+    )
+    assert response.status_code == 400
+
+
+def test_alocar_em_lote_missing_auth(client):
+    """Test batch allocation endpoint requires authentication."""
+    response = client.post("/alocar/lote", json=[[]])
+    assert response.status_code == 400
+
+
 def test_prever_efetividade_missing_classificadores():
     """Test prediction returns 503 when lazy classifier load fails."""
     app = create_app(carregar_classificadores_na_inicializacao=False)
@@ -97,3 +129,111 @@ def test_prever_efetividade_missing_classificadores():
 
     assert response.status_code == 503
     assert response.json()["detail"] == "credenciais ausentes"
+
+
+def test_prazo_conta_a_partir_do_inicio_da_requisicao():
+    """Test the request deadline starts before authentication runs."""
+    app = create_app(carregar_classificadores_na_inicializacao=False)
+    app.state.classificadores = Mock()
+    autenticado_em = []
+
+    def autenticar():
+        autenticado_em.append(time.monotonic())
+        return UsuarioNaBase(usuario_nome="testuser", senha_hash="hash")
+
+    app.dependency_overrides[obter_usuario_atual_via_api_key] = autenticar
+    client = TestClient(app)
+
+    with patch(
+        "ip_mensageria_alocacao_api.routes.executar_bloqueante",
+        AsyncMock(side_effect=HTTPException(status_code=503)),
+    ) as executar:
+        client.post(
+            "/prever_efetividade_mensagem",
+            params={
+                "cidadao_id": "123",
+                "linha_cuidado": "crônicos",
+                "mensagem_tipo": "mensagem_inicial",
+                "prazo_ms": 1000,
+            },
+            json={"dia_semana": "Monday", "horario": 10},
+            headers={"X-Api-Key": "fake"},
+        )
+
+    prazo = executar.call_args.kwargs["prazo"]
+    assert prazo - 1.0 <= autenticado_em[0]
+
+
+def test_estatisticas_missing_auth(client):
+    """Test stats endpoint requires authentication."""
+    response = client.get("/estatisticas")
+    assert response.status_code == 400
+
+
+def test_estatisticas_executores():
+    """Test stats endpoint reports executor queue depth."""
+    app = create_app(carregar_classificadores_na_inicializacao=False)
+    app.dependency_overrides[obter_usuario_atual_via_api_key] = lambda: UsuarioNaBase(
+        usuario_nome="testuser", senha_hash="hash", desativado=False
+    )
+    client = TestClient(app)
+
+    with patch(
+        "ip_mensageria_alocacao_api.routes.autenticar_usuario", return_value=False
+    ):
+        client.post("/token", data={"username": "testuser", "password": "wrong"})
+    response = client.get("/estatisticas", headers={"X-Api-Key": "fake"})
+
+    assert response.status_code == 200
+    requisicoes = response.json()["executores"]["requisicoes"]
+    assert requisicoes["na_fila"] == 0
+    assert requisicoes["concluidas"] >= 1
+    assert "caracteristicas_usuario" in response.json()["carregadores"]
+    assert "dados_cidadao" in response.json()["caches"]
+    assert set(response.json()["consultas_bigquery"]) == {
+        "por_consulta",
+        "por_endpoint",
+    }
+
+
+def test_prefetch_agenda_e_reporta_progresso():
+    """Test prefetch endpoint schedules the load and exposes its progress."""
+    app = create_app(carregar_classificadores_na_inicializacao=False)
+    app.dependency_overrides[obter_usuario_atual_via_api_key] = lambda: UsuarioNaBase(
+        usuario_nome="testuser", senha_hash="hash", desativado=False
+    )
+    client = TestClient(app)
+
+    with patch("ip_mensageria_alocacao_api.core.prefetch._executar") as executar:
+        response = client.post(
+            "/prefetch",
+            json={"cidadaos_ids": ["1", "2"], "linha_cuidado": "crônicos"},
+            headers={"X-Api-Key": "fake"},
+        )
+    assert response.status_code == 202
+    assert response.json()["cidadaos_total"] == 2
+    assert response.json()["estado"] == "pendente"
+    executar.assert_called_once()
+
+    prefetch_id = response.json()["id"]
+    response = client.get(f"/prefetch/{prefetch_id}", headers={"X-Api-Key": "fake"})
+    assert response.status_code == 200
+    assert response.json()["id"] == prefetch_id
+
+    response = client.get("/prefetch/outro", headers={"X-Api-Key": "fake"})
+    assert response.status_code == 404
+
+
+def test_prefetch_vazio():
+    """Test prefetch endpoint rejects empty requests."""
+    app = create_app(carregar_classificadores_na_inicializacao=False)
+    app.dependency_overrides[obter_usuario_atual_via_api_key] = lambda: UsuarioNaBase(
+        usuario_nome="testuser", senha_hash="hash", desativado=False
+    )
+    client = TestClient(app)
+    response = client.post(
+        "/prefetch",
+        json={"cidadaos_ids": [], "linha_cuidado": "crônicos"},
+        headers={"X-Api-Key": "fake"},
+    )
+    assert response.status_code == 400
@@ -0,0 +1,347 @@
+import json
+import os
+import pickle
+import re
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timezone
+from pathlib import Path
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from ip_mensageria_alocacao_api.core import snapshot_cache
+from ip_mensageria_alocacao_api.core.cache import (
+    Ausencia,
+    BackendMemoria,
+    cache_consulta,
+)
+from ip_mensageria_alocacao_api.core.modelos import CidadaoDados
+
+
+@pytest.fixture
+def consulta():
+    chamadas = Mock(side_effect=lambda chave: f"valor-{chave}")
+
+    @cache_consulta(nome="teste_snapshot", maxsize=10)
+    def consulta(chave: str) -> str:
+        return chamadas(chave)
+
+    consulta.chamadas = chamadas
+    return consulta
+
+
+def test_salvar_e_restaurar_snapshot_local(consulta, tmp_path):
+    caminho = str(tmp_path / "caches")
+    consulta("a")
+    consulta("b")
+    assert snapshot_cache.salvar_snapshot_caches(caminho) >= 2
+
+    consulta.cache_clear()
+    assert snapshot_cache.restaurar_snapshot_caches(caminho) >= 2
+    assert consulta("a") == "valor-a"
+    assert consulta("b") == "valor-b"
+    assert consulta.chamadas.call_count == 2
+    assert consulta.cache_info().hits == 2
+
+
+def test_restaurar_sem_snapshot(tmp_path):
+    assert snapshot_cache.restaurar_snapshot_caches(str(tmp_path / "nada")) == 0
+
+
+def test_snapshots_de_varios_workers_sao_mesclados(consulta, tmp_path, monkeypatch):
+    caminho = str(tmp_path / "caches")
+    monkeypatch.setattr(snapshot_cache, "_escritor", lambda: "instancia-1")
+    consulta("a")
+    snapshot_cache.salvar_snapshot_caches(caminho)
+    consulta.cache_clear()
+    monkeypatch.setattr(snapshot_cache, "_escritor", lambda: "instancia-2")
+    consulta("b")
+    snapshot_cache.salvar_snapshot_caches(caminho)
+    consulta.cache_clear()
+
+    assert snapshot_cache.restaurar_snapshot_caches(caminho) == 2
+    assert consulta.consultar_cache("a") == (True, "valor-a")
+    assert consulta.consultar_cache("b") == (True, "valor-b")
+
+
+def test_mesclar_mantem_entrada_mais_recente_e_descarta_expiradas():
+    futuro = time.time() + 60
+    mescladas = snapshot_cache._mesclar(
+        [
+            {"c": [("a", "velho", futuro), ("expirada", 1, 0.0)]},
+            {"c": [("a", "novo", futuro + 1), ("b", 2, None)]},
+        ]
+    )
+    assert mescladas == {"c": [("a", "novo", futuro + 1), ("b", 2, None)]}
+
+
+def test_restaurar_apaga_snapshots_sem_entradas_validas(tmp_path):
+    caminho = tmp_path / "caches"
+    caminho.mkdir()
+    antigo = caminho / "worker-antigo.json.gz"
+    antigo.write_bytes(
+        snapshot_cache._serializar(
+            {
+                "versao": snapshot_cache._VERSAO_FORMATO,
+                "criado_em": 0.0,
+                "caches": {"teste_snapshot": [("a", "valor-a", 1.0)]},
+            }
+        )
+    )
+
+    assert snapshot_cache.restaurar_snapshot_caches(str(caminho)) == 0
+    assert not antigo.exists()
+
+
+def test_restaurar_apaga_snapshots_nao_regravados_na_retencao(
+    consulta, tmp_path, monkeypatch
+):
+    caminho = tmp_path / "caches"
+    monkeypatch.setattr(snapshot_cache, "_escritor", lambda: "worker-encerrado")
+    consulta("a")
+    snapshot_cache.salvar_snapshot_caches(str(caminho))
+    antigo = caminho / "worker-encerrado.json.gz"
+    dois_dias_atras = time.time() - 2 * 24 * 60 * 60
+    os.utime(antigo, (dois_dias_atras, dois_dias_atras))
+    consulta.cache_clear()
+
+    monkeypatch.setattr(
+        snapshot_cache.configs, "CACHE_SNAPSHOT_RETENCAO_SEGUNDOS", 24 * 60 * 60
+    )
+    assert snapshot_cache.restaurar_snapshot_caches(str(caminho)) == 0
+    assert not antigo.exists()
+    assert consulta.consultar_cache("a") == (False, None)
+
+
+def test_serializacao_preserva_tipos_em_cache():
+    dados = CidadaoDados.model_validate(
+        {
+            "data_nascimento": "1990-05-17",
+            "plano_saude_privado": False,
+            "raca_cor": "Parda",
+            "sexo": "Feminino",
+            "municipio_prop_domicilios_zona_rural": 0.25,
+        }
+    )
+    valores = [
+        dados,
+        date(2024, 1, 31),
+        None,
+        np.arange(6, dtype=np.float32).reshape(2, 3),
+        Ausencia(404, "Template não encontrado"),
+        Ausencia(None, ("cidadão sem município",)),
+    ]
+    snapshot = {
+        "caches": {
+            "c": [
+                [str(i), snapshot_cache._codificar(v), None]
+                for i, v in enumerate(valores)
+            ]
+        }
+    }
+    restaurados = [
+        valor
+        for _, valor, _ in snapshot_cache._desserializar(
+            snapshot_cache._serializar(snapshot)
+        )["caches"]["c"]
+    ]
+    assert restaurados[0] == dados
+    assert restaurados[1:3] == [date(2024, 1, 31), None]
+    assert restaurados[3].dtype == np.float32
+    np.testing.assert_array_equal(restaurados[3], valores[3])
+    assert restaurados[4:] == valores[4:]
+    assert all(type(r) is type(v) for r, v in zip(restaurados, valores))
+
+
+def test_salvar_ignora_valores_de_tipo_nao_suportado(tmp_path, monkeypatch):
+    @cache_consulta(nome="teste_snapshot_tipos", maxsize=10)
+    def consulta(chave: str) -> object:
+        return object() if chave == "estranho" else chave
+
+    monkeypatch.setattr(snapshot_cache, "_escritor", lambda: "instancia-1")
+    consulta("estranho")
+    consulta("a")
+    snapshot_cache.salvar_snapshot_caches(str(tmp_path))
+    consulta.cache_clear()
+
+    snapshot_cache.restaurar_snapshot_caches(str(tmp_path))
+    assert consulta.consultar_cache("a") == (True, "a")
+    assert consulta.consultar_cache("estranho") == (False, None)
+
+
+def test_restaurar_apaga_snapshots_em_pickle_sem_ler(tmp_path):
+    class Explosivo:
+        def __reduce__(self):
+            return (os.remove, (str(tmp_path / "vitima"),))
+
+    (tmp_path / "vitima").touch()
+    legado = tmp_path / "worker-antigo.pkl"
+    legado.write_bytes(pickle.dumps(Explosivo()))
+
+    assert snapshot_cache.restaurar_snapshot_caches(str(tmp_path)) == 0
+    assert not legado.exists()
+    assert (tmp_path / "vitima").exists()
+
+
+def test_snapshot_no_gcs(consulta, monkeypatch):
+    blob = Mock()
+    cliente = Mock()
+    cliente.bucket.return_value.blob.return_value = blob
+    monkeypatch.setattr(snapshot_cache, "make_storage_client", lambda: cliente)
+    monkeypatch.setattr(snapshot_cache, "_escritor", lambda: "instancia-1")
+
+    consulta("a")
+    snapshot_cache.salvar_snapshot_caches("gs://bucket/caches")
+    cliente.bucket.assert_called_with("bucket")
+    cliente.bucket.return_value.blob.assert_called_with("caches/instancia-1.json.gz")
+    (dados,), _ = blob.upload_from_string.call_args
+
+    consulta.cache_clear()
+    listado = Mock()
+    listado.name = "caches/instancia-1.json.gz"
+    listado.updated = datetime.now(timezone.utc)
+    cliente.list_blobs.return_value = [listado]
+    blob.exists.return_value = True
+    blob.download_as_bytes.return_value = dados
+    assert snapshot_cache.restaurar_snapshot_caches("gs://bucket/caches")
+    cliente.list_blobs.assert_called_with("bucket", prefix="caches/")
+    assert consulta.consultar_cache("a") == (True, "valor-a")
+
+
+def test_iniciar_restaura_e_parar_grava(consulta, monkeypatch, tmp_path):
+    monkeypatch.setattr(snapshot_cache.configs, "CACHE_SNAPSHOT_URI", str(tmp_path))
+    monkeypatch.setattr(snapshot_cache, "_escritor", lambda: "instancia-1")
+    caminho = tmp_path / "instancia-1.json.gz"
+    consulta("a")
+    snapshot_cache.salvar_snapshot_caches()
+    consulta.cache_clear()
+
+    snapshot_cache.iniciar_snapshot_caches()
+    try:
+        assert consulta.consultar_cache("a") == (True, "valor-a")
+        consulta("b")
+    finally:
+        snapshot_cache.parar_snapshot_caches()
+
+    gravado = snapshot_cache._desserializar(caminho.read_bytes())
+    chaves = [chave for chave, _, _ in gravado["caches"]["teste_snapshot"]]
+    assert chaves == [repr(("a",)), repr(("b",))]
+
+
+def test_backend_memoria_importa_sem_expirados_nem_sobrescrever():
+    backend = BackendMemoria(maxsize=2)
+    backend.guardar("atual", "novo", ttl_segundos=None)
+    importadas = backend.importar(
+        [
+            ("expirado", 1, 0.0),
+            ("antigo", 2, None),
+            ("atual", "velho", None),
+        ]
+    )
+    assert importadas == 1
+    assert backend.obter("atual") == (True, "novo")
+    assert backend.obter("expirado") == (False, None)
+    # entradas importadas são as primeiras a serem descartadas
+    backend.guardar("outro", 3, ttl_segundos=None)
+    assert backend.obter("antigo") == (False, None)
+
+
+APP_ENCERRAMENTO = """
+import os
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+
+from ip_mensageria_alocacao_api.core.cache import cache_consulta
+from ip_mensageria_alocacao_api.core.snapshot_cache import (
+    iniciar_snapshot_caches,
+    parar_snapshot_caches,
+)
+
+
+@cache_consulta(nome="teste_encerramento", maxsize=10)
+def consulta(chave):
+    return chave
+
+
+@asynccontextmanager
+async def lifespan(app):
+    iniciar_snapshot_caches()
+    consulta(str(os.getpid()))
+    yield
+    parar_snapshot_caches()
+
+
+app = FastAPI(lifespan=lifespan)
+"""
+
+
+def _comando_do_dockerfile() -> tuple[signal.Signals, list[str]]:
+    dockerfile = Path(__file__).parents[1] / "dockerfiles/python313/Dockerfile"
+    conteudo = dockerfile.read_text()
+    sinal = re.search(r"^STOPSIGNAL (\w+)$", conteudo, re.MULTILINE)
+    entrypoint = re.search(r"^ENTRYPOINT (.+)$", conteudo, re.MULTILINE)
+    assert sinal
+    assert entrypoint
+    comando = shlex.split(json.loads(entrypoint.group(1))[-1])
+    assert comando[:2] == ["exec", "gunicorn"]
+    return signal.Signals[sinal.group(1)], comando[2:]
+
+
+def _porta_livre() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_encerramento_pelo_sinal_do_dockerfile_grava_snapshot(tmp_path):
+    """
+    Sobe o gunicorn com os argumentos e o STOPSIGNAL da imagem e confirma que
+    cada worker grava o seu snapshot ao receber o sinal de parada.
+    """
+    sinal, argumentos = _comando_do_dockerfile()
+    argumentos[0] = "app_encerramento:app"
+    argumentos[argumentos.index("-b") + 1] = f"127.0.0.1:{_porta_livre()}"
+    workers = int(argumentos[argumentos.index("--workers") + 1])
+    (tmp_path / "app_encerramento.py").write_text(APP_ENCERRAMENTO)
+    snapshots = tmp_path / "caches"
+    ambiente = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join([str(tmp_path), *sys.path]),
+        "CACHE_BACKEND": "memoria",
+        "CACHE_SNAPSHOT_URI": str(snapshots),
+    }
+    log = tmp_path / "gunicorn.log"
+    with log.open("w") as saida:
+        processo = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", *argumentos],
+            env=ambiente,
+            stdout=saida,
+            stderr=subprocess.STDOUT,
+        )
+    try:
+        limite = time.monotonic() + 30
+        while log.read_text().count("Application startup complete") < workers:
+            assert processo.poll() is None, log.read_text()
+            assert time.monotonic() < limite, log.read_text()
+            time.sleep(0.1)
+        processo.send_signal(sinal)
+        processo.wait(timeout=30)
+    finally:
+        if processo.poll() is None:
+            processo.kill()
+            processo.wait()
+
+    gravados = sorted(snapshots.glob("*.json.gz"))
+    assert len(gravados) == workers, log.read_text()
+    for arquivo in gravados:
+        snapshot = snapshot_cache._desserializar(arquivo.read_bytes())
+        [(chave, _, _)] = snapshot["caches"]["teste_encerramento"]
+        pid = arquivo.name.removesuffix(".json.gz").rsplit("-", 1)[1]
+        assert chave == repr((pid,))